@@ -0,0 +1,189 @@
+import os
+import gzip
+import posixpath
+import time
+import mimetypes
+import weakref
+import threading
+from email.utils import formatdate
+'''
+Cache en memoria de los archivos del frontend.
+
+Cada archivo se lee una sola vez y se guarda ya codificado (bytes) junto con
+su tipo MIME y sus validadores HTTP (ETag y Last-Modified). Como mucho cada
+check_interval segundos se hace un stat() del archivo: si cambio su mtime o
+su tamaño se vuelve a cargar.
+
+Los tipos comprimibles (HTML, CSS, JS...) guardan ademas una variante gzip
+construida una sola vez al cargar el archivo; las imagenes ya comprimidas
+(jpg, png...) se envian tal cual.
+
+Los archivos mayores que max_cached_size no se guardan en memoria: el Asset
+solo lleva los metadatos y el cuerpo se envia con sendfile desde disco.
+'''
+
+# Tipos MIME que vale la pena comprimir
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+
+def is_compressible(mime_type):
+    return mime_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def gzip_bytes(body, level=9):
+    # mtime=0 para que la variante sea identica en cada carga
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class Asset:
+    '''Archivo del frontend listo para enviarse'''
+
+    __slots__ = ('path', 'body', 'gzip_body', 'mime_type', 'etag', 'gzip_etag', 'last_modified',
+                 'mtime', 'size', 'checked_at', 'compressible')
+
+    def __init__(self, path, body, mime_type, mtime, size, gzip_body=None):
+        self.path = path
+        self.body = body                # None si el archivo se sirve desde disco
+        self.gzip_body = gzip_body      # variante gzip (None si no compensa)
+        self.mime_type = mime_type
+        self.compressible = is_compressible(mime_type)
+        self.mtime = mtime
+        self.size = size
+        self.etag = f'"{int(mtime * 1000):x}-{size:x}"'
+        self.gzip_etag = f'"{int(mtime * 1000):x}-{size:x}-gz"' # cada representacion tiene su ETag
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.checked_at = time.monotonic()
+
+
+class AssetCache:
+
+    # Errores renderizados que se guardan (los mensajes pueden ser dinamicos)
+    MAX_RENDERED_ERRORS = 64
+
+    def __init__(self, root, check_interval=2.0, gzip_min_size=256, max_cached_size=256 * 1024):
+        """
+        root: carpeta del frontend
+        check_interval: segundos entre comprobaciones de mtime de un archivo
+        gzip_min_size: tamaño minimo para precomprimir un archivo
+        max_cached_size: archivos mas grandes se envian desde disco (sendfile)
+        """
+        self.root = os.path.realpath(root)
+        self.check_interval = check_interval
+        self.gzip_min_size = gzip_min_size
+        self.max_cached_size = max_cached_size
+        self._assets = {}
+        self._rendered_errors = {}
+        self._lock = threading.Lock()
+
+        # el cache se carga antes del fork (modo pre-fork): si un hilo del
+        # supervisor tenia el lock tomado, el hijo lo rehace
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._reset_after_fork())
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def resolve(self, relpath):
+        '''
+            Ruta absoluta del archivo dentro de root, o None si intenta
+            salir de la carpeta del frontend
+        '''
+        full_path = os.path.realpath(os.path.join(self.root, relpath.lstrip('/')))
+        if full_path != self.root and not full_path.startswith(self.root + os.sep):
+            return None
+        return full_path
+
+    def get(self, relpath):
+        '''
+            Devuelve el Asset de relpath (relativo a root) o None si no existe
+        '''
+        relpath = posixpath.normpath(relpath.lstrip('/'))
+        asset = self._assets.get(relpath)
+        now = time.monotonic()
+        if asset is not None and now - asset.checked_at < self.check_interval:
+            return asset
+
+        full_path = asset.path if asset is not None else self.resolve(relpath)
+        if full_path is None:
+            return None
+
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            with self._lock:
+                self._assets.pop(relpath, None)
+            return None
+
+        if asset is not None and asset.mtime == stat.st_mtime and asset.size == stat.st_size:
+            asset.checked_at = now
+            return asset
+
+        asset = self._load(full_path, stat)
+        if asset is None:
+            return None
+
+        with self._lock:
+            self._assets[relpath] = asset
+            if relpath == 'error.html':
+                self._rendered_errors.clear()
+        return asset
+
+    def _load(self, full_path, stat):
+        if not os.path.isfile(full_path):
+            return None
+
+        mime_type, _ = mimetypes.guess_type(full_path)
+        if mime_type is None:
+            mime_type = 'application/octet-stream'
+        elif mime_type.startswith('text/'):
+            mime_type += '; charset=utf-8'
+
+        if stat.st_size > self.max_cached_size:
+            return Asset(full_path, None, mime_type, stat.st_mtime, stat.st_size)
+
+        with open(full_path, 'rb') as file:
+            body = file.read()
+
+        gzip_body = None
+        if is_compressible(mime_type) and len(body) >= self.gzip_min_size:
+            compressed = gzip_bytes(body)
+            if len(compressed) < len(body):
+                gzip_body = compressed
+
+        return Asset(full_path, body, mime_type, stat.st_mtime, len(body), gzip_body)
+
+    def preload(self):
+        '''Carga todo el frontend en memoria (al iniciar el servidor)'''
+        count = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                relpath = os.path.relpath(os.path.join(dirpath, filename), self.root)
+                if self.get(relpath.replace(os.sep, '/')) is not None:
+                    count += 1
+        return count
+
+    def render_error(self, code, title, message):
+        '''
+            Devuelve error.html con los marcadores reemplazados (bytes).
+            El resultado se guarda para no repetir los reemplazos.
+        '''
+        template = self.get('error.html')
+        if template is None:
+            return None
+
+        key = (code, title, message)
+        body = self._rendered_errors.get(key)
+        if body is not None:
+            return body
+
+        html_content = template.body.decode('utf-8')
+        html_content = html_content.replace('ERROR_CODE', str(code))
+        html_content = html_content.replace('ERROR_TITLE', title)
+        html_content = html_content.replace('ERROR_MESSAGE', message)
+        body = html_content.encode('utf-8')
+
+        with self._lock:
+            if len(self._rendered_errors) >= self.MAX_RENDERED_ERRORS:
+                self._rendered_errors.clear()
+            self._rendered_errors[key] = body
+        return body
@@ -0,0 +1,358 @@
+import os
+import socket
+import selectors
+import time
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from httpParser import HTTPParseError
+from httpServer import advance_buffers
+from threadingTCPServer import ConnectionGuard
+'''
+Servidor TCP basado en un unico event loop (selectors) como alternativa al
+ThreadingTCPServer.
+
+Todos los sockets de clientes se multiplexan en un solo hilo; un hilo del
+executor solo se ocupa mientras se ejecuta el handler (routing, ARP, auth,
+firewall), no mientras el cliente tarda en enviar o recibir datos.
+
+                 ┌──────────── event loop (1 hilo) ───────────┐
+ accept() ──→    │  leer bytes ──→ ¿peticion completa? ──┐     │
+                 │                                       │     │
+                 │  escribir respuesta ←── cola de ──────┼──┐  │
+                 └──────────────────────── resultados ───┘  │  │
+                                                            │  │
+                 executor (N hilos) ←── handler(peticion) ──┘  │
+                   get_client_mac / validate_user / run_script │
+'''
+
+class _Connection:
+    '''Estado de una conexion de cliente dentro del event loop'''
+
+    __slots__ = ('sock', 'address', 'parser', 'outbuf', 'file', 'file_offset', 'file_remaining',
+                 'busy', 'requests', 'close_after_write', 'last_active', 'phase', 'phase_started')
+
+    def __init__(self, sock, address, parser):
+        self.sock = sock
+        self.address = address
+        self.parser = parser       # buffer de recepcion + parser incremental
+        self.outbuf = []           # buffers de la respuesta pendientes de enviar
+        self.file = None           # archivo a enviar con sendfile tras outbuf
+        self.file_offset = 0
+        self.file_remaining = 0
+        self.busy = False          # hay un handler ejecutandose en el executor
+        self.requests = 0          # peticiones atendidas en esta conexion
+        self.close_after_write = True
+        self.last_active = time.monotonic() # ultimo progreso de escritura
+        self.phase = 'header'      # idle | header | body: plazo que se esta vigilando
+        self.phase_started = self.last_active
+
+    def set_phase(self, phase, now):
+        self.phase = phase
+        self.phase_started = now
+
+
+class SelectorTCPServer:
+
+    def __init__(self, serverAddress, RequestHandlerClass, max_workers=8, backlog=128, reuse_port=False,
+                 max_connections_per_ip=16):
+        """
+            serverAddress: direccion del servidor con formato (host, port)
+            RequestHandlerClass: Clase del handler (debe heredar de BaseHTTPRequestHandler)
+            max_workers: hilos del executor para el trabajo bloqueante del handler
+            backlog: conexiones pendientes en el kernel (argumento de listen)
+            reuse_port: SO_REUSEPORT para que varios procesos escuchen el mismo puerto
+            max_connections_per_ip: conexiones abiertas a la vez por cliente (0 = sin limite)
+        """
+        self.serverAddress = serverAddress
+        self.RequestHandlerClass = RequestHandlerClass
+        self.socket = None
+        self.running = False
+
+        self.max_workers = max_workers
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.selector = None
+        self.executor = None
+        self.connections = {}
+        self.guard = ConnectionGuard(max_connections_per_ip)
+
+        # Resultados del executor pendientes de entregar al loop
+        self._completed = deque()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server_close()
+
+    def server_start(self):
+        '''
+            Crea socket no bloqueante y enlaza a puerto
+        '''
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(self.serverAddress)
+        self.socket.setblocking(False)
+
+    def server_activate(self):
+        '''
+            Escucha conexiones entrantes
+        '''
+        self.socket.listen(self.backlog)
+
+    def serve_forever(self):
+        '''
+            loop principal: acepta, lee, despacha al executor y escribe
+        '''
+        self.server_start()
+        self.server_activate()
+
+        self.selector = selectors.DefaultSelector()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="http-executor")
+        self.selector.register(self.socket, selectors.EVENT_READ, self._accept)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, self._drain_completed)
+
+        print(f"[SelectorTCPServer] Servidor escuchando en {self.serverAddress[0]}:{self.serverAddress[1]} "
+              f"(event loop, executor {self.max_workers} hilos, backlog {self.backlog})")
+
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    events = self.selector.select(timeout=1.0)
+                    for key, mask in events:
+                        callback = key.data
+                        callback(key.fileobj, mask)
+                    self._reap_connections()
+
+                except KeyboardInterrupt:
+                    print("\n[SelectorTCPServer] Deteniendo servidor...")
+                    break
+                except Exception as e:
+                    if self.running:
+                        print(f"[SelectorTCPServer] Error: {e}", file=sys.stderr)
+        finally:
+            self.server_close()
+
+    # Eventos del loop
+
+    def _accept(self, sock, mask):
+        while True:
+            try:
+                clientSocket, clientAddress = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+
+            clientSocket.setblocking(False)
+            if not self.guard.acquire(clientAddress[0]):
+                # el 429 cabe en el buffer del socket: se intenta una vez y se cierra
+                try:
+                    clientSocket.send(ConnectionGuard.IP_LIMIT_RESPONSE)
+                except OSError:
+                    pass
+                clientSocket.close()
+                continue
+
+            conn = _Connection(clientSocket, clientAddress, self.RequestHandlerClass.create_parser())
+            self.connections[clientSocket.fileno()] = conn
+            self.selector.register(clientSocket, selectors.EVENT_READ, self._on_event)
+
+    def _on_event(self, sock, mask):
+        conn = self.connections.get(sock.fileno())
+        if conn is None:
+            return
+        if mask & selectors.EVENT_READ:
+            self._read(conn)
+        elif mask & selectors.EVENT_WRITE:
+            self._write(conn)
+
+    def _read(self, conn):
+        try:
+            received = conn.parser.recv_from(conn.sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._close(conn)
+            return
+
+        if not received:
+            self._close(conn)
+            return
+
+        if conn.phase == 'idle':
+            conn.set_phase('header', time.monotonic())
+        self._process_buffered(conn)
+        if not conn.busy and conn.phase == 'header' and conn.parser.waiting_body():
+            conn.set_phase('body', time.monotonic())
+
+    def _process_buffered(self, conn):
+        '''
+            Despacha la siguiente peticion completa del buffer (pipelining);
+            las peticiones de una conexion se atienden de una en una y en orden
+        '''
+        try:
+            request = conn.parser.next_request()
+        except HTTPParseError as e:
+            request = e # el handler responde el error y cierra la conexion
+
+        if request is not None:
+            self._dispatch(conn, request)
+
+    def _dispatch(self, conn, request):
+        '''
+            Ejecuta el handler en el executor; el socket sale del selector
+            mientras tanto y vuelve a entrar para escribir la respuesta
+        '''
+        conn.busy = True
+        self.selector.unregister(conn.sock)
+        future = self.executor.submit(self._run_handler, conn, request)
+        future.add_done_callback(lambda f, conn=conn: self._complete(conn, f))
+
+    def _run_handler(self, conn, request):
+        handler = self.RequestHandlerClass(None, conn.address, self, request=request, requestsHandled=conn.requests)
+        return handler.wfile.take(), handler.close_connection, handler.pending_file
+
+    def _complete(self, conn, future):
+        # Llamado desde un hilo del executor: se entrega el resultado al loop
+        self._completed.append((conn, future))
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def _drain_completed(self, sock, mask):
+        try:
+            while sock.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        while self._completed:
+            conn, future = self._completed.popleft()
+            conn.busy = False
+            if conn.sock.fileno() < 0:
+                continue # el servidor cerro la conexion mientras se procesaba
+
+            try:
+                chunks, conn.close_after_write, pending_file = future.result()
+                conn.outbuf = [memoryview(chunk) for chunk in chunks]
+                conn.requests += 1
+                if pending_file is not None:
+                    path, conn.file_offset, conn.file_remaining = pending_file
+                    conn.file = open(path, 'rb')
+            except Exception as e:
+                print(f"[SelectorTCPServer] Error procesando petición: {e}", file=sys.stderr)
+                self._close(conn)
+                continue
+
+            self.selector.register(conn.sock, selectors.EVENT_WRITE, self._on_event)
+            self._write(conn)
+
+    def _write(self, conn):
+        try:
+            if conn.outbuf:
+                # headers + body en una sola llamada (scatter/gather)
+                sent = conn.sock.sendmsg(conn.outbuf)
+                conn.last_active = time.monotonic()
+                conn.outbuf = advance_buffers(conn.outbuf, sent)
+                if conn.outbuf:
+                    return
+
+            if conn.file is not None:
+                # cuerpo grande: del page cache al socket sin copiar a Python
+                sent = os.sendfile(conn.sock.fileno(), conn.file.fileno(), conn.file_offset, conn.file_remaining)
+                conn.file_offset += sent
+                conn.last_active = time.monotonic()
+                conn.file_remaining -= sent
+                if sent == 0 and conn.file_remaining:
+                    conn.close_after_write = True # el archivo se acorto
+                    conn.file_remaining = 0
+                if conn.file_remaining:
+                    return
+                conn.file.close()
+                conn.file = None
+
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._close(conn)
+            return
+
+        if conn.close_after_write:
+            self._close(conn)
+            return
+
+        # keep-alive: volver a leer y atender lo que ya llego por pipelining
+        conn.set_phase('header' if conn.parser.pending_bytes() else 'idle', time.monotonic())
+        self.selector.modify(conn.sock, selectors.EVENT_READ, self._on_event)
+        self._process_buffered(conn)
+
+    def _reap_connections(self):
+        '''
+            Cierra las conexiones que agotaron el plazo de su fase:
+            idle (keepalive_timeout), header (header_timeout), body
+            (body_timeout) o escritura sin progreso (write_timeout).
+            Las que estan en el executor no cuentan.
+        '''
+        handler = self.RequestHandlerClass
+        timeouts = {
+            'idle': handler.keepalive_timeout,
+            'header': handler.header_timeout,
+            'body': handler.body_timeout,
+        }
+        now = time.monotonic()
+        for conn in list(self.connections.values()):
+            if conn.busy:
+                continue
+            if conn.outbuf or conn.file is not None:
+                if now - conn.last_active > handler.write_timeout:
+                    self.record_reaped('write_timeout')
+                    self._close(conn)
+            elif now - conn.phase_started > timeouts[conn.phase]:
+                self.record_reaped(f'{conn.phase}_timeout')
+                self._close(conn)
+
+    def record_reaped(self, reason):
+        self.guard.record_reaped(reason)
+
+    def get_stats(self):
+        stats = {'open_connections': len(self.connections)}
+        stats.update(self.guard.get_stats())
+        return stats
+
+    def _close(self, conn):
+        if conn.file is not None:
+            conn.file.close()
+            conn.file = None
+        if self.connections.pop(conn.sock.fileno(), None) is not None:
+            self.guard.release(conn.address[0])
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            conn.sock.close()
+        except OSError:
+            pass
+
+    def server_close(self):
+        self.running = False
+        for conn in list(self.connections.values()):
+            self._close(conn)
+        if self.selector:
+            self.selector.close()
+            self.selector = None
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.socket:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
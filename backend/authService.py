@@ -1,16 +1,130 @@
+import os
 import json
 import hashlib
+import threading
+'''
+Usuarios del portal en memoria, indexados, con persistencia incremental.
+
+    dataUsers.json   snapshot: {"users": [...]} (el mismo formato de siempre)
+    dataUsers.wal    un usuario nuevo o modificado por linea desde el snapshot:
+                         ["put", {"username": ..., "email": ..., ...}]
+
+Login y registro buscan en dicts por nombre de usuario y por email (O(1)).
+Un registro agrega UNA linea al WAL en lugar de reescribir el archivo
+entero; cuando el WAL acumula compact_every lineas (o una cuarta parte de
+los usuarios, si son mas) se escribe un snapshot nuevo (archivo temporal +
+rename atomico) y el WAL se vacia. Asi el costo de compactar, proporcional
+a la cantidad de usuarios, se reparte en O(1) por registro.
+
+Comprobar que el usuario no existe, agregarlo a los indices y escribir su
+linea se hace con el mismo lock: dos registros simultaneos (hilos del pool,
+o procesos pre-fork via RPC al supervisor) no pueden pisarse ni duplicarse.
+'''
+
+def hash_password(password):
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+
+def journal_path_for(data):
+    return os.path.splitext(data)[0] + '.wal'
+
+
+def read_users(data, journal_path=None):
+    '''
+        Lee el snapshot y aplica el WAL encima sin escribir nada (sirve para
+        importar los usuarios a otro backend sin tocar los archivos).
+
+        Returns:
+            (dict username -> usuario en orden de registro, lineas del WAL aplicadas)
+    '''
+    journal_path = journal_path or journal_path_for(data)
+    users = {}
+    try:
+        with open(data, 'r') as file:
+            for user in json.load(file).get('users', []):
+                users[user['username']] = user
+    except FileNotFoundError:
+        pass
+
+    replayed = 0
+    try:
+        with open(journal_path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"⚠️ Registro incompleto al final de {journal_path}, se descarta")
+                    break
+                if record[0] == 'put':
+                    users[record[1]['username']] = record[1]
+                replayed += 1
+    except FileNotFoundError:
+        pass
+    return users, replayed
+
+
 class AuthService:
-    def __init__(self, data = 'dataUsers.json'):
+    def __init__(self, data = 'dataUsers.json', compact_every=1000, fsync=False):
+        """
+        data: snapshot de usuarios; el WAL es el mismo nombre con extension .wal
+        compact_every: lineas minimas del WAL que disparan una compactacion
+        fsync: forzar cada registro a disco a costa de latencia
+        """
         self.user_data = data
+        self.journal_path = journal_path_for(data)
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._journal = None
+        self.journal_records = 0
         self._load_users()
 
     def _load_users(self):
-        try:
-            with open(self.user_data, 'r') as file:
-                self.users = json.load(file).get('users', [])
-        except FileNotFoundError:
-            self.users = []
+        self.users = {}        # username -> usuario (en orden de registro)
+        self._by_email = {}    # email en minusculas -> username
+        users, replayed = read_users(self.user_data, self.journal_path)
+        for user in users.values():
+            self._index(user)
+
+        # snapshot limpio: el proximo arranque no repite el replay
+        if replayed:
+            self._compact()
+
+    def _index(self, user):
+        previous = self.users.get(user['username'])
+        if previous is not None and previous.get('email'):
+            self._by_email.pop(previous['email'].lower(), None)
+        self.users[user['username']] = user
+        if user.get('email'):
+            self._by_email[user['email'].lower()] = user['username']
+
+    def _append(self, user):
+        '''Escribe el usuario al WAL; llamar con self._lock tomado'''
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a')
+        self._journal.write(json.dumps(['put', user], separators=(',', ':')) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self.journal_records += 1
+
+    def needs_compaction(self):
+        return self.journal_records >= max(self.compact_every, len(self.users) // 4)
+
+    def _compact(self):
+        '''Snapshot con todos los usuarios y WAL vacio; llamar con self._lock tomado (o al cargar)'''
+        tmp_path = self.user_data + '.tmp'
+        with open(tmp_path, 'w') as file:
+            # un usuario por linea: legible y con el encoder en C (indent usa el de Python)
+            file.write('{"users": [\n    ' + ',\n    '.join(json.dumps(user) for user in self.users.values())
+                       + '\n]}\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.user_data)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, 'w')
+        self.journal_records = 0
 
     def _add_user(self, username, email,  password):
         password_hash = self.__hash_password(password)
@@ -20,24 +134,35 @@ class AuthService:
             "password_hash": password_hash,
             "activo": True
         }
-        self.users.append(new_user)
-        with open(self.user_data, 'w') as file:
-            json.dump({'users': self.users}, file, indent=4)
-    
+        with self._lock:
+            if username in self.users:
+                return 'exists'
+            if email and email.lower() in self._by_email:
+                return 'email_exists'
+            self._index(new_user)
+            self._append(new_user)
+            if self.needs_compaction():
+                self._compact()
+        return None
+
     def __hash_password(self, password):
-        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+        return hash_password(password)
 
     def validate_user(self, username, password):
-        hashed_password = self.__hash_password(password)
-        for user in self.users:
-            if user['username'] == username and user['password_hash'] == hashed_password and user.get('activo', False):
-                return {'status': 'success', 'username': username}
+        user = self.users.get(username)
+        if user is not None and user['password_hash'] == self.__hash_password(password) and user.get('activo', False):
+            return {'status': 'success', 'username': username}
         return {'status': 'failure', 'error_type': 'invalid'}
-    
+
     def register_user(self, username, email, password):
-        # Comprobar si el usuario ya existe
-        for user in self.users:
-            if user['username'] == username:
-                return {'status': 'failure', 'error_type': 'exists'}
-        self._add_user(username, email, password)
-        return {'status': 'success', 'username': username}
\ No newline at end of file
+        # Falla si el usuario (o el email) ya existe
+        error = self._add_user(username, email, password)
+        if error is not None:
+            return {'status': 'failure', 'error_type': error}
+        return {'status': 'success', 'username': username}
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
@@ -0,0 +1,72 @@
+import sys
+import time
+from firewallBackends import FakeBackend
+from firewallManager import FirewallManager
+from firewallQueue import FirewallApplyQueue
+'''
+Benchmark de la cola del firewall con un backend falso (no requiere root).
+
+Se encolan N logins y luego N expiraciones, como cuando muchas sesiones
+empiezan o vencen a la vez, y se mide cuanto tarda la cola en aplicarlos:
+
+    por cambio: una llamada al kernel por cambio (los scripts de iptables)
+    en lote:    FirewallManager.apply_batch, una llamada por lote
+
+Cada llamada al backend tarda CALL_DELAY segundos (fork + transaccion del
+kernel); el backend falso cuenta las llamadas.
+
+Uso: python3 benchFirewall.py [CAMBIOS]
+'''
+
+CALL_DELAY = 0.005
+
+
+class PerChangeFirewall:
+    '''Sin apply_batch: la cola aplica cada cambio por separado'''
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def unlock_user(self, ip):
+        return self.backend.allow(ip)
+
+    def lock_user(self, ip, attacker_mac=None):
+        return self.backend.revoke(ip)
+
+
+def run(firewall, count):
+    '''Segundos que tarda la cola en aplicar `count` altas y `count` bajas'''
+    apply_queue = FirewallApplyQueue(firewall)
+    apply_queue.start()
+    ips = [f"10.0.{i // 256 % 256}.{i % 256}" for i in range(count)]
+
+    started = time.perf_counter()
+    for ip in ips:
+        apply_queue.submit('unlock_user', ip)
+    for ip in ips:
+        apply_queue.submit('lock_user', ip)
+    for ip in ips:
+        apply_queue.wait(ip)
+    elapsed = time.perf_counter() - started
+
+    apply_queue.stop()
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    single = FakeBackend(delay=CALL_DELAY)
+    single_seconds = run(PerChangeFirewall(single), count)
+
+    batched = FakeBackend(delay=CALL_DELAY)
+    batched_seconds = run(FirewallManager('eth0', 'wlan0', 8080, backend=batched), count)
+
+    print(f"{count} altas + {count} bajas (cada llamada al backend tarda {CALL_DELAY * 1000:.0f} ms)")
+    for name, backend, seconds in (('por cambio', single, single_seconds), ('en lote', batched, batched_seconds)):
+        print(f"   {name:<11} {seconds * 1000:8.0f} ms  {len(backend.calls):5} llamadas  "
+              f"{2 * count / seconds:8.0f} cambios/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import sys
+import time
+import threading
+import tracemalloc
+from sessionsManager import NetworkSessionManager, Session, expiry_entry, ip_to_int, mac_to_int
+'''
+Benchmarks de NetworkSessionManager.
+
+contencion: varios hilos lectores consultan sesiones (como los workers HTTP
+    en cada GET) mientras un hilo escritor crea y termina sesiones con un
+    firewall lento (cada llamada tarda FIREWALL_DELAY, como un script de
+    iptables). Se compara el diseño actual (lectura sin lock + locks por
+    franja) con el anterior (un unico lock global), variando los lectores.
+    Junto a las consultas/s de los lectores se muestran las sesiones/s que
+    completa el escritor y el % del tiempo que cada lado pasa esperando un
+    lock, para separar la contencion del reparto del GIL.
+
+memoria: bytes por sesion con N sesiones, comparando los dicts por IP del
+    diseño anterior con los registros Session + indices por usuario y MAC +
+    heap de vencimientos (el diseño anterior no tenia ni indices ni heap:
+    recorria todas las sesiones).
+
+Uso: python3 benchSessions.py [contencion [SEGUNDOS] | memoria [SESIONES]]
+'''
+
+FIREWALL_DELAY = 0.005
+SESSIONS = 1000
+THREAD_COUNTS = (1, 2, 4, 8, 16)
+
+
+class SlowFirewall:
+    '''Firewall falso: cada regla tarda FIREWALL_DELAY segundos'''
+
+    def unlock_user(self, ip, *args):
+        time.sleep(FIREWALL_DELAY)
+
+    def lock_user(self, ip, *args):
+        time.sleep(FIREWALL_DELAY)
+
+
+class InlineFirewallQueue:
+    '''Sin cola: el cambio se aplica en el hilo que lo pide, con su lock tomado'''
+
+    def __init__(self, firewall):
+        self.firewall = firewall
+
+    def submit(self, action, ip, *args):
+        getattr(self.firewall, action)(ip, *args)
+
+    def wait(self, ip, timeout=None):
+        return True
+
+    def stop(self, timeout=5):
+        pass
+
+
+class GlobalLockSessionManager(NetworkSessionManager):
+    '''
+        Diseño anterior: un solo lock para lecturas, escrituras y firewall.
+        create_session/terminate_session encolan el cambio con el lock de la
+        IP tomado; aqui ese lock es el global y el cambio se aplica ahi
+        mismo, asi que el lock queda tomado mientras dura el script.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        shared = threading.RLock()
+        self._stripes = [shared] * self.LOCK_STRIPES
+        self.firewall_queue.stop()
+        self.firewall_queue = InlineFirewallQueue(self.firewall)
+
+    def is_authenticated(self, ip, mac=None):
+        with self._stripes[0]:
+            return super().is_authenticated(ip, mac)
+
+
+class TimedLock:
+    '''Envuelve un lock y acumula, por hilo, los segundos esperando para tomarlo'''
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.waited = {}  # ident del hilo -> segundos
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        ident = threading.get_ident()
+        self.waited[ident] = self.waited.get(ident, 0.0) + time.perf_counter() - started
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+def _time_locks(manager):
+    '''Cambia los locks de franja por TimedLock (el global, compartido, queda uno solo)'''
+    wrapped = {}
+    manager._stripes = [wrapped.setdefault(id(lock), TimedLock(lock)) for lock in manager._stripes]
+    return list(wrapped.values())
+
+
+def _client(i):
+    return f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}", f"02:00:00:{i // 65536 % 256:02X}:{i // 256 % 256:02X}:{i % 256:02X}"
+
+
+def run(manager, locks, readers, duration):
+    '''
+        `readers` hilos consultan y un escritor crea y termina sesiones
+        durante `duration` segundos. Devuelve (consultas/s, sesiones
+        creadas y terminadas/s, % del tiempo de los lectores esperando un
+        lock, % del tiempo del escritor esperando un lock).
+    '''
+    clients = [_client(i) for i in range(SESSIONS)]
+    for ip, mac in clients:
+        session = Session(ip_to_int(ip), mac_to_int(mac), 'bench', time.time())
+        manager.active_sessions[session.ip_int] = session
+    for lock in locks:
+        lock.waited.clear()
+
+    stop = threading.Event()
+    counts = [0] * readers
+    written = [0]
+
+    def reader(index):
+        n = 0
+        step = index + 1
+        pos = index
+        while not stop.is_set():
+            ip, mac = clients[pos]
+            manager.is_authenticated(ip, mac)
+            pos = (pos + step) % SESSIONS
+            n += 1
+        counts[index] = n
+
+    def writer():
+        i = SESSIONS
+        while not stop.is_set():
+            ip, mac = _client(i)
+            manager.create_session(ip, 'escritor', mac)
+            manager.terminate_session(ip)
+            i += 1
+        written[0] = i - SESSIONS
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    # con muchos hilos el principal tarda en recuperar el GIL: medir lo que duro de verdad
+    duration = time.perf_counter() - started
+
+    writer_ident = threads[-1].ident
+    reader_wait = sum(w for lock in locks for ident, w in lock.waited.items() if ident != writer_ident)
+    writer_wait = sum(lock.waited.get(writer_ident, 0.0) for lock in locks)
+
+    manager.active_sessions.clear()
+    return (sum(counts) / duration, written[0] / duration,
+            reader_wait / (readers * duration) * 100, writer_wait / duration * 100)
+
+
+def contention(duration):
+    import builtins
+    real_print = builtins.print
+    builtins.print = lambda *args, **kwargs: None  # silenciar los logs de sesiones
+    try:
+        managers = {
+            'lock global': GlobalLockSessionManager(SlowFirewall()),
+            'por franjas': NetworkSessionManager(SlowFirewall()),
+        }
+        results = {}
+        for name, manager in managers.items():
+            locks = _time_locks(manager)
+            results[name] = [run(manager, locks, n, duration) for n in THREAD_COUNTS]
+        for manager in managers.values():
+            manager.stop_cleanup()
+    finally:
+        builtins.print = real_print
+
+    # Si las consultas/s caen con mas lectores pero la espera por locks es ~0,
+    # lo que se ve es el reparto del GIL, no contencion
+    print(f"is_authenticated con escritor concurrente (firewall {FIREWALL_DELAY * 1000:.0f} ms, {SESSIONS} sesiones)")
+    for name, rows in results.items():
+        print(f"\n{name}")
+        print(f"{'hilos':>6} {'lecturas':>12} {'escrituras':>12} {'espera lect.':>13} {'espera escr.':>13}")
+        for n, (reads, writes, reader_wait, writer_wait) in zip(THREAD_COUNTS, rows):
+            print(f"{n:>6} {reads:>8.0f} q/s {writes:>8.0f} s/s {reader_wait:>12.1f}% {writer_wait:>12.1f}%")
+
+
+def _measure(build):
+    '''Bytes que siguen reservados tras construir la estructura'''
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    data = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return size, data
+
+
+def memory(count):
+    # los nombres de usuario existen de antemano en ambos casos (AuthService): no se cuentan
+    users = [f"usuario{i % (count // 2 or 1)}" for i in range(count)]  # ~2 sesiones por usuario
+    now = time.time()
+
+    def build_dicts():
+        # diseño anterior: dict por IP en texto, MAC como string
+        sessions = {}
+        for i, user in enumerate(users):
+            ip, mac = _client(i)
+            sessions[ip] = {'mac': mac, 'username': user, 'login_time': now + i, 'expires_at': now + i + 1800}
+        return sessions
+
+    def build_records(indexes=True, heap=True):
+        # diseño actual: Session con IP/MAC enteras, indices secundarios y heap de vencimientos
+        manager = NetworkSessionManager.__new__(NetworkSessionManager)
+        manager._by_user, manager._by_mac, manager._index_lock = {}, {}, threading.Lock()
+        sessions = {}
+        for i, user in enumerate(users):
+            ip, mac = _client(i)
+            session = Session(ip_to_int(ip), mac_to_int(mac), user, now + i)
+            sessions[session.ip_int] = session
+            if indexes:
+                manager._index_add(session)
+        expiry_heap = [expiry_entry(s.login_time + 1800, key) for key, s in sessions.items()] if heap else None
+        return sessions, manager, expiry_heap
+
+    old_size, _ = _measure(build_dicts)
+    new_size, _ = _measure(build_records)
+    records_size, _ = _measure(lambda: build_records(indexes=False, heap=False))
+    index_size = _measure(lambda: build_records(heap=False))[0] - records_size
+    heap_size = new_size - records_size - index_size
+
+    print(f"Memoria con {count} sesiones")
+    print(f"   dict por IP (anterior):         {old_size / count:6.0f} bytes/sesión  ({old_size / 2**20:6.1f} MiB)")
+    print(f"   Session + índices + heap:       {new_size / count:6.0f} bytes/sesión  ({new_size / 2**20:6.1f} MiB)")
+    print(f"     registros Session:            {records_size / count:6.0f} bytes/sesión")
+    print(f"     índices usuario/MAC:          {index_size / count:6.0f} bytes/sesión")
+    print(f"     heap de vencimientos:         {heap_size / count:6.0f} bytes/sesión")
+    print(f"   ahorro en los registros:        {(1 - records_size / old_size) * 100:6.0f} %  (total: {(1 - new_size / old_size) * 100:.0f} %)")
+
+def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'contencion'
+    if mode == 'memoria':
+        memory(int(sys.argv[2]) if len(sys.argv) > 2 else 100_000)
+    elif mode == 'contencion':
+        contention(float(sys.argv[2]) if len(sys.argv) > 2 else 2.0)
+    else:
+        print(__doc__)
+
+
+if __name__ == '__main__':
+    main()
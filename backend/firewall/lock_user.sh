@@ -19,10 +19,10 @@ if [ -n "$MAC_ATACANTE" ] && [ "$MAC_ATACANTE" != "00:00:00:00:00:00" ]; then
     # Normalizar MAC a mayúsculas con dos puntos
     MAC_ATACANTE=$(echo "$MAC_ATACANTE" | tr '[:lower:]' '[:upper:]' | sed 's/-/:/g')
     echo "🔒 Bloqueo por MAC atacante: $MAC_ATACANTE"
-    iptables -I FORWARD -m mac --mac-source "$MAC_ATACANTE" -j DROP
+    iptables -I FORWARD -m mac --mac-source "$MAC_ATACANTE" -m comment --comment captive-portal -j DROP
 fi
 
 echo "🔒 Bloqueo por IP: $IP_USUARIO"
-iptables -I FORWARD -s "$IP_USUARIO" -j DROP
-iptables -I FORWARD -d "$IP_USUARIO" -j DROP
+iptables -I FORWARD -s "$IP_USUARIO" -m comment --comment captive-portal -j DROP
+iptables -I FORWARD -d "$IP_USUARIO" -m comment --comment captive-portal -j DROP
 echo "✅ Bloqueo aplicado para IP $IP_USUARIO"
@@ -8,8 +8,8 @@ if [ -z "$IP_USUARIO" ]; then
     exit 1
 fi
 
-# Permitir tráfico completo para esta IP
-iptables -I FORWARD -s $IP_USUARIO -j ACCEPT 
-iptables -I FORWARD -d $IP_USUARIO -j ACCEPT 
+# Permitir tráfico completo para esta IP (el comentario marca las reglas del portal)
+iptables -I FORWARD -s $IP_USUARIO -m comment --comment captive-portal -j ACCEPT 
+iptables -I FORWARD -d $IP_USUARIO -m comment --comment captive-portal -j ACCEPT 
 
 echo "✅ Usuario $IP_USUARIO desbloqueado - Tiene internet completo"
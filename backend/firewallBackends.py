@@ -0,0 +1,545 @@
+import time
+from abc import ABC, abstractmethod
+from trafficCounters import COUNTERS_COMMAND, parse_forward_counters
+from firewallBatch import (IptablesRestoreBatch, IpsetRestoreBatch, NftBatch, run_command, check_mac,
+                           PORTAL_COMMENT, RESTORE_COMMAND, IPSET_RESTORE_COMMAND, NFT_COMMAND)
+from firewallReconciler import (IptablesReconciler, IpsetReconciler, NftReconciler, new_report, rule_spec,
+                                owned_rule, parse_forward_rules, parse_iptables_save, parse_ipset_members,
+                                parse_nft_table, nft_list_command, SAVE_COMMAND, SAVE_ALL_COMMAND,
+                                IPSET_SAVE_COMMAND)
+'''
+Backends del FirewallManager: como se traduce "dar/quitar acceso a una IP"
+a reglas del kernel.
+
+iptables (legado, por defecto): los scripts de firewall/ agregan dos ACCEPT
+    por usuario al principio de FORWARD (y DROP al bloquear). La cadena crece
+    con cada login y el kernel la recorre entera por cada paquete.
+
+ipset: FORWARD tiene siempre las mismas reglas, que consultan dos sets:
+
+    FORWARD ──→ PORTAL_SETS ──→ MAC en portal_blocked_macs?  DROP
+                                IP en portal_allowed (src)?  ACCEPT
+                                IP en portal_allowed (dst)?  ACCEPT
+                ──→ resto de FORWARD (DNS, portal, politica DROP)
+
+    Dar o quitar acceso es agregar o borrar un elemento de un set hash
+    (O(1)), sin importar cuantos usuarios haya. Opcionalmente el set tiene
+    timeout: el kernel borra la IP solo si el portal no lo hizo antes.
+
+nftables: la misma idea sin iptables ni scripts. Toda la politica del portal
+    (sets, filtro, DNS, redireccion y NAT) vive en la tabla `ip captive_portal`;
+    cada IP del set puede tener su propio timeout y cada cambio o lote es
+    una transaccion atomica de `nft -f -`.
+
+fake: no toca el kernel; guarda las llamadas y los sets en memoria para
+    pruebas y benchmarks sin root.
+
+Arranque en caliente (FirewallManager.warm_start): con una lectura del
+kernel (kernel_state) se decide entre
+    - la politica base esta: solo se reconcilian las IPs y MACs, sin vaciar
+      nada (si ya coincide, no se escribe nada)
+    - falta: restore() reconstruye todo (politica base + sesiones vigentes +
+      MACs bloqueadas) en una transaccion, en vez de block_all.sh y un
+      unlock_user.sh por sesion
+'''
+
+
+class FirewallBackend(ABC):
+    '''
+        Interfaz de los backends:
+            setup()          politica base del portal
+            allow(ip)        da acceso a internet a la IP
+            revoke(ip)       quita el acceso a la IP
+            block_mac(mac)   bloquea todo el trafico de una MAC (suplantacion)
+            apply(changes)   aplica [(accion, ip, args)] en una transaccion y
+                             devuelve el resultado de cada cambio
+            reconciler       objeto con reconcile(ips, macs) -> reporte
+                             (ver firewallReconciler.py)
+            kernel_state()   {'base': politica base instalada?, 'blocked_macs': {...}}
+                             leido del kernel, o None si no se pudo leer
+            restore(ips, macs)
+                             politica base + estado completo en una transaccion
+
+        kernel_timeouts: el backend puede hacer caducar las IPs en el kernel
+        (el constructor recibe el timeout en segundos).
+        traffic_counters: el backend tiene reglas por IP con contadores y
+        read_counters() devuelve {ip: (pkts_sub, bytes_sub, pkts_baj, bytes_baj)}.
+
+        allow y revoke tienen una version por defecto sobre apply; el resto
+        son abstractos: una subclase que no los implemente no se puede crear.
+    '''
+
+    name = None
+    kernel_timeouts = False
+    traffic_counters = False
+
+    @abstractmethod
+    def setup(self):
+        raise NotImplementedError
+
+    def allow(self, ip):
+        return self.apply([('unlock_user', ip, ())])[0]
+
+    def revoke(self, ip):
+        return self.apply([('lock_user', ip, ())])[0]
+
+    def read_counters(self):
+        raise NotImplementedError(f"El backend {self.name} no tiene contadores de tráfico por IP")
+
+    @abstractmethod
+    def block_mac(self, mac):
+        raise NotImplementedError
+
+    @abstractmethod
+    def apply(self, changes):
+        raise NotImplementedError
+
+    @abstractmethod
+    def kernel_state(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def restore(self, allowed, blocked_macs):
+        raise NotImplementedError
+
+
+class BlockAllPolicy:
+    '''Politica de block_all.sh para los backends que usan iptables'''
+
+    def base_rules(self):
+        '''Reglas de block_all.sh tal como las escribe iptables-save: {tabla: [(cadena, regla)]}'''
+        internet, local, port = self.manager.internet_iface, self.manager.local_iface, self.manager.portal_port
+        return {
+            'filter': [
+                ('FORWARD', f"-i {local} -o {internet} -p udp -m udp --dport 53 -j ACCEPT"),
+                ('FORWARD', f"-i {local} -o {internet} -p tcp -m tcp --dport 53 -j ACCEPT"),
+                ('FORWARD', f"-i {internet} -o {local} -p udp -m udp --sport 53 -j ACCEPT"),
+                ('FORWARD', f"-i {internet} -o {local} -p tcp -m tcp --sport 53 -j ACCEPT"),
+                ('FORWARD', f"-i {local} -p tcp -m tcp --dport {port} -j ACCEPT"),
+            ],
+            'nat': [
+                ('PREROUTING', f"-i {local} -p tcp -m tcp --dport 80 -j REDIRECT --to-ports {port}"),
+                ('POSTROUTING', f"-o {internet} -j MASQUERADE"),
+            ],
+        }
+
+    def _read_tables(self):
+        code, saved, stderr = self.runner(SAVE_ALL_COMMAND)
+        if code != 0:
+            print(f"❌ Error leyendo iptables-save: {stderr.strip()}")
+            return None
+        return parse_iptables_save(saved)
+
+    def _base_ready(self, tables):
+        filter_table = tables.get('filter', {'policies': {}, 'rules': {}})
+        if filter_table['policies'].get('FORWARD') != 'DROP':
+            return False
+        for table, rules in self.base_rules().items():
+            chains = tables.get(table, {'rules': {}})['rules']
+            if any(spec not in chains.get(chain, ()) for chain, spec in rules):
+                return False
+        return True
+
+    def _restore_base(self, filter_lines, chains=()):
+        '''
+            iptables-restore (--noflush) de la politica base precedida por
+            `filter_lines`. Solo se vacian las cadenas del portal (FORWARD,
+            PREROUTING, POSTROUTING y las de `chains`), no INPUT ni OUTPUT.
+        '''
+        base = self.base_rules()
+        lines = ["*filter", ":INPUT ACCEPT [0:0]", ":FORWARD DROP [0:0]", ":OUTPUT ACCEPT [0:0]"]
+        lines += [f":{chain} - [0:0]" for chain in chains]
+        lines += ["-F FORWARD"] + [f"-F {chain}" for chain in chains]
+        lines += filter_lines
+        lines += [f"-A {chain} {spec}" for chain, spec in base['filter']]
+        lines += ["COMMIT", "*nat", "-F PREROUTING", "-F POSTROUTING"]
+        lines += [f"-A {chain} {spec}" for chain, spec in base['nat']]
+        lines.append("COMMIT")
+        code, _, stderr = self.runner(RESTORE_COMMAND, "\n".join(lines) + "\n")
+        if code != 0:
+            print(f"❌ Error reconstruyendo el firewall: {stderr.strip()}")
+        return code == 0
+
+
+class LegacyScriptsBackend(BlockAllPolicy, FirewallBackend):
+    '''Los scripts de firewall/ para cambios sueltos e iptables-restore para lotes'''
+
+    name = 'iptables'
+    traffic_counters = True
+
+    def __init__(self, manager, runner=run_command, timeout=0):
+        """
+        manager: FirewallManager (interfaces, puerto y run_script)
+        runner: ejecuta iptables/iptables-restore (inyectable en pruebas)
+        timeout: sin uso (las reglas de iptables no caducan)
+        """
+        self.manager = manager
+        self.runner = runner
+        self.batch = IptablesRestoreBatch(runner)
+        self.reconciler = IptablesReconciler(runner)
+
+    def setup(self):
+        return self.manager.run_script('block_all.sh', [self.manager.internet_iface, self.manager.local_iface,
+                                                         self.manager.portal_port])
+
+    def allow(self, ip):
+        if self.manager.blocked_macs:
+            # unlock_user.sh inserta arriba, encima de las MACs bloqueadas
+            return self.apply([('unlock_user', ip, ())])[0]
+        return self.manager.run_script('unlock_user.sh', [ip])
+
+    def revoke(self, ip):
+        return self.manager.run_script('lock_user.sh', [ip])
+
+    def block_mac(self, mac):
+        mac = check_mac(mac)
+        if mac is None:
+            return False
+        code, _, stderr = self.runner(('iptables', '-w', '-I', 'FORWARD', '-m', 'mac', '--mac-source', mac,
+                                       '-m', 'comment', '--comment', PORTAL_COMMENT, '-j', 'DROP'))
+        if code != 0:
+            print(f"❌ Error bloqueando la MAC {mac}: {stderr.strip()}")
+        return code == 0
+
+    def apply(self, changes):
+        return self.batch.apply(changes, *self._accept_position(changes))
+
+    def _accept_position(self, changes):
+        '''
+            Posicion de FORWARD justo debajo de la ultima MAC bloqueada y los
+            DROP de las IPs a desbloquear que quedan por encima. Sin MACs
+            bloqueadas los ACCEPT van arriba sin leer nada; si no se puede leer
+            la cadena van al final (debajo de cualquier MAC).
+
+            Returns:
+                (posicion o None, {ip: [reglas DROP]})
+        '''
+        unlocking = {ip for action, ip, _ in changes if action == 'unlock_user'}
+        if not self.manager.blocked_macs or not unlocking:
+            return 1, {}
+        code, saved, stderr = self.runner(SAVE_COMMAND)
+        if code != 0:
+            print(f"⚠️  No se pudo leer FORWARD ({stderr.strip()}): los ACCEPT van al final")
+            return None, {}
+        keys = [(spec, owned_rule(spec)) for spec in parse_forward_rules(saved)]
+        last_mac = max((position for position, (_, key) in enumerate(keys, 1) if key and key[0] == 'mac'), default=0)
+        shadowing = {}
+        for spec, key in keys[:last_mac]:
+            if key and key[0] == 'deny' and key[1] in unlocking:
+                shadowing.setdefault(key[1], []).append(spec)
+        return last_mac + 1, shadowing
+
+    def read_counters(self):
+        '''Contadores de las reglas ACCEPT de cada IP con un `iptables -L FORWARD`'''
+        code, listing, stderr = self.runner(COUNTERS_COMMAND)
+        if code != 0:
+            raise OSError(f"iptables -L FORWARD: {stderr.strip()}")
+        return parse_forward_counters(listing)
+
+    def kernel_state(self):
+        tables = self._read_tables()
+        if tables is None:
+            return None
+        forward = tables.get('filter', {'rules': {}})['rules'].get('FORWARD', [])
+        macs = {key[1] for key in map(owned_rule, forward) if key is not None and key[0] == 'mac'}
+        return {'base': self._base_ready(tables), 'blocked_macs': macs}
+
+    def restore(self, allowed, blocked_macs):
+        # MACs antes que cualquier ACCEPT, como las deja el reconciliador
+        lines = [f"-A FORWARD {rule_spec(('mac', mac))}" for mac in sorted(blocked_macs)]
+        for ip in sorted(allowed):
+            lines += [f"-A FORWARD {rule_spec(('allow', ip, 's'))}", f"-A FORWARD {rule_spec(('allow', ip, 'd'))}"]
+        return self._restore_base(lines)
+
+
+class IpsetBackend(BlockAllPolicy, FirewallBackend):
+    '''Acceso por pertenencia a sets hash (ipset) en lugar de una regla por usuario'''
+
+    name = 'ipset'
+    kernel_timeouts = True
+
+    ALLOWED_SET = 'portal_allowed'
+    BLOCKED_MACS_SET = 'portal_blocked_macs'
+    CHAIN = 'PORTAL_SETS'
+
+    def __init__(self, manager, runner=run_command, timeout=0):
+        """
+        manager: FirewallManager (interfaces, puerto y run_script)
+        runner: ejecuta ipset/iptables (inyectable en pruebas)
+        timeout: segundos tras los que el kernel quita una IP del set (0 = nunca)
+        """
+        self.manager = manager
+        self.runner = runner
+        self.timeout = timeout
+        self.batch = IpsetRestoreBatch(self.ALLOWED_SET, self.BLOCKED_MACS_SET, runner)
+        self.reconciler = IpsetReconciler(self.ALLOWED_SET, self.BLOCKED_MACS_SET, runner)
+
+    def _run(self, command, input_text=None, what=''):
+        code, _, stderr = self.runner(command, input_text)
+        if code != 0:
+            print(f"❌ Error {what}: {stderr.strip()}")
+        return code == 0
+
+    def setup(self):
+        '''Politica base de block_all.sh + los sets + la cadena que los consulta'''
+        if not self.manager.run_script('block_all.sh', [self.manager.internet_iface, self.manager.local_iface,
+                                                         self.manager.portal_port]):
+            return False
+        return self._create_sets() and self._install_rules()
+
+    def _set_definitions(self):
+        # -exist: si los sets ya existen (reinicio del portal) se conservan sus elementos
+        timeout = f" timeout {self.timeout}" if self.timeout else ""
+        return (f"create {self.ALLOWED_SET} hash:ip family inet{timeout}\n"
+                f"create {self.BLOCKED_MACS_SET} hash:mac\n")
+
+    def _create_sets(self):
+        return self._run(IPSET_RESTORE_COMMAND, self._set_definitions(), 'creando los sets de ipset')
+
+    def chain_rules(self):
+        '''Reglas de la cadena PORTAL_SETS tal como las escribe iptables-save'''
+        return [
+            f"-m set --match-set {self.BLOCKED_MACS_SET} src -j DROP",
+            f"-m set --match-set {self.ALLOWED_SET} src -j ACCEPT",
+            f"-m set --match-set {self.ALLOWED_SET} dst -j ACCEPT",
+        ]
+
+    def _install_rules(self):
+        self.runner(('iptables', '-w', '-N', self.CHAIN))  # falla si ya existe: no importa
+        jump_missing = self.runner(('iptables', '-w', '-C', 'FORWARD', '-j', self.CHAIN))[0] != 0
+
+        rules = [f"-F {self.CHAIN}"] + [f"-A {self.CHAIN} {spec}" for spec in self.chain_rules()]
+        if jump_missing:
+            rules.append(f"-I FORWARD 1 -j {self.CHAIN}")
+        return self._run(RESTORE_COMMAND, "*filter\n" + "\n".join(rules) + "\nCOMMIT\n",
+                         'instalando las reglas de ipset')
+
+    def block_mac(self, mac):
+        mac = check_mac(mac)
+        if mac is None:
+            return False
+        return self._run(('ipset', 'add', self.BLOCKED_MACS_SET, mac, '-exist'), what=f"bloqueando la MAC {mac}")
+
+    def apply(self, changes):
+        return self.batch.apply(changes)
+
+    def kernel_state(self):
+        tables = self._read_tables()
+        if tables is None:
+            return None
+        code, saved, _ = self.runner(IPSET_SAVE_COMMAND)
+        if code != 0:
+            saved = ''  # sin ipset o sin sets: la politica base no esta
+        rules = tables.get('filter', {'rules': {}})['rules']
+        base = (self._base_ready(tables)
+                and f"-j {self.CHAIN}" in rules.get('FORWARD', ())
+                and rules.get(self.CHAIN) == self.chain_rules()
+                and f"create {self.ALLOWED_SET} " in saved and f"create {self.BLOCKED_MACS_SET} " in saved)
+        return {'base': base, 'blocked_macs': parse_ipset_members(saved, self.BLOCKED_MACS_SET)}
+
+    def restore(self, allowed, blocked_macs):
+        '''Sets con todos sus elementos (ipset restore) y luego las reglas (iptables-restore)'''
+        elements = [f"flush {self.ALLOWED_SET}", f"flush {self.BLOCKED_MACS_SET}"]
+        elements += [f"add {self.ALLOWED_SET} {ip}" for ip in sorted(allowed)]
+        elements += [f"add {self.BLOCKED_MACS_SET} {mac}" for mac in sorted(blocked_macs)]
+        if not self._run(IPSET_RESTORE_COMMAND, self._set_definitions() + "\n".join(elements) + "\n",
+                         'reconstruyendo los sets de ipset'):
+            return False
+        lines = [f"-A FORWARD -j {self.CHAIN}"] + [f"-A {self.CHAIN} {spec}" for spec in self.chain_rules()]
+        return self._restore_base(lines, chains=(self.CHAIN,))
+
+
+class NftablesBackend(FirewallBackend):
+    '''Politica completa del portal en una tabla nftables propia, sin scripts'''
+
+    name = 'nftables'
+    kernel_timeouts = True
+
+    TABLE = 'ip captive_portal'
+    ALLOWED_SET = 'allowed'
+    BLOCKED_MACS_SET = 'blocked_macs'
+
+    def __init__(self, manager, runner=run_command, timeout=0):
+        """
+        manager: FirewallManager (interfaces y puerto)
+        runner: ejecuta nft (inyectable en pruebas)
+        timeout: segundos tras los que el kernel quita una IP del set (0 = nunca)
+        """
+        self.manager = manager
+        self.runner = runner
+        self.timeout = timeout
+        self.batch = NftBatch(self.TABLE, self.ALLOWED_SET, self.BLOCKED_MACS_SET, timeout, runner)
+        self.reconciler = NftReconciler(self.batch, runner)
+
+    def ruleset(self):
+        '''
+            Script de nft con la politica de block_all.sh. Los sets se declaran
+            con "add" (si ya existen no se vacian) y solo se reescriben las
+            cadenas: reiniciar el portal no quita el acceso a nadie.
+        '''
+        table = self.TABLE
+        internet, local, port = self.manager.internet_iface, self.manager.local_iface, self.manager.portal_port
+        allowed_flags = "flags timeout; " if self.timeout else ""
+        return f"""add table {table}
+add set {table} {self.ALLOWED_SET} {{ type ipv4_addr; {allowed_flags}}}
+add set {table} {self.BLOCKED_MACS_SET} {{ type ether_addr; }}
+add chain {table} forward {{ type filter hook forward priority 0; policy drop; }}
+add chain {table} prerouting {{ type nat hook prerouting priority -100; }}
+add chain {table} postrouting {{ type nat hook postrouting priority 100; }}
+flush chain {table} forward
+flush chain {table} prerouting
+flush chain {table} postrouting
+add rule {table} forward ether saddr @{self.BLOCKED_MACS_SET} drop
+add rule {table} forward ip saddr @{self.ALLOWED_SET} accept
+add rule {table} forward ip daddr @{self.ALLOWED_SET} accept
+add rule {table} forward iifname "{local}" oifname "{internet}" udp dport 53 accept
+add rule {table} forward iifname "{local}" oifname "{internet}" tcp dport 53 accept
+add rule {table} forward iifname "{internet}" oifname "{local}" udp sport 53 accept
+add rule {table} forward iifname "{internet}" oifname "{local}" tcp sport 53 accept
+add rule {table} prerouting iifname "{local}" tcp dport 80 redirect to :{port}
+add rule {table} postrouting oifname "{internet}" masquerade
+"""
+
+    def setup(self):
+        code, _, stderr = self.runner(NFT_COMMAND, self.ruleset())
+        if code != 0:
+            print(f"❌ Error configurando nftables: {stderr.strip()}")
+            return False
+        print(f"✅ Tabla nftables {self.TABLE} configurada")
+        return True
+
+    def block_mac(self, mac):
+        mac = check_mac(mac)
+        if mac is None:
+            return False
+        code, _, stderr = self.runner(NFT_COMMAND, self.batch.element('add', self.BLOCKED_MACS_SET, mac) + "\n")
+        if code != 0:
+            print(f"❌ Error bloqueando la MAC {mac}: {stderr.strip()}")
+        return code == 0
+
+    def apply(self, changes):
+        return self.batch.apply(changes)
+
+    def expected_rules(self):
+        '''Cantidad de reglas de cada cadena segun ruleset()'''
+        counts = {}
+        prefix = f"add rule {self.TABLE} "
+        for line in self.ruleset().splitlines():
+            if line.startswith(prefix):
+                chain = line[len(prefix):].split()[0]
+                counts[chain] = counts.get(chain, 0) + 1
+        return counts
+
+    def kernel_state(self):
+        code, saved, _ = self.runner(nft_list_command(self.TABLE))
+        if code != 0:
+            return {'base': False, 'blocked_macs': set()}  # la tabla no existe (arranque en frio)
+        try:
+            table = parse_nft_table(saved)
+        except ValueError as e:
+            print(f"❌ Error leyendo la tabla nftables: {e}")
+            return None
+        allowed = table['sets'].get(self.ALLOWED_SET)
+        blocked = table['sets'].get(self.BLOCKED_MACS_SET)
+        # la tabla es solo del portal: basta con comparar sets y cantidad de reglas
+        base = (allowed is not None and blocked is not None
+                and ('timeout' in allowed['flags']) == bool(self.timeout)
+                and table['rules'] == self.expected_rules())
+        return {'base': base, 'blocked_macs': blocked['members'] if blocked else set()}
+
+    def restore(self, allowed, blocked_macs):
+        '''
+            Borra y recrea la tabla con todos sus elementos en una transaccion:
+            el kernel pasa de la tabla vieja a la nueva sin un instante sin reglas
+        '''
+        lines = [f"add table {self.TABLE}", f"delete table {self.TABLE}", self.ruleset().rstrip("\n")]
+        for ip in sorted(allowed):
+            lines += self.batch.rules_for('unlock_user', ip)[-1:]
+        lines += [self.batch.element('add', self.BLOCKED_MACS_SET, mac) for mac in sorted(blocked_macs)]
+        code, _, stderr = self.runner(NFT_COMMAND, "\n".join(lines) + "\n")
+        if code != 0:
+            print(f"❌ Error reconstruyendo la tabla nftables: {stderr.strip()}")
+        return code == 0
+
+
+class FakeBackend(FirewallBackend):
+    '''
+        Backend en memoria: registra cada llamada en `calls` y guarda los
+        sets como si fueran del kernel. `delay` simula lo que tarda cada
+        llamada al kernel; los cambios de las IPs de `fail_ips` fallan.
+    '''
+
+    name = 'fake'
+    kernel_timeouts = True
+
+    def __init__(self, manager=None, runner=None, timeout=0, delay=0.0, fail_ips=()):
+        self.timeout = timeout
+        self.delay = delay
+        self.fail_ips = set(fail_ips)
+        self.calls = []
+        self.allowed = set()
+        self.blocked_macs = set()
+        self.ready = False      # politica base instalada
+        self.reconciler = self
+
+    def _call(self, *call):
+        self.calls.append(call)
+        if self.delay:
+            time.sleep(self.delay)
+
+    def setup(self):
+        self._call('setup')
+        self.ready = True
+        return True
+
+    def block_mac(self, mac):
+        self._call('block_mac', mac)
+        mac = check_mac(mac)
+        if mac is None:
+            return False
+        self.blocked_macs.add(mac)
+        return True
+
+    def apply(self, changes):
+        self._call('apply', list(changes))
+        results = []
+        for action, ip, args in changes:
+            if ip in self.fail_ips or action not in ('unlock_user', 'lock_user'):
+                results.append(False)
+                continue
+            if action == 'unlock_user':
+                self.allowed.add(ip)
+            else:
+                self.allowed.discard(ip)
+                mac = check_mac(args[0]) if args else None
+                if mac:
+                    self.blocked_macs.add(mac)
+            results.append(True)
+        return results
+
+    def kernel_state(self):
+        self._call('kernel_state')
+        return {'base': self.ready, 'blocked_macs': set(self.blocked_macs)}
+
+    def restore(self, allowed, blocked_macs):
+        self._call('restore', len(allowed), len(blocked_macs))
+        self.allowed, self.blocked_macs, self.ready = set(allowed), set(blocked_macs), True
+        return True
+
+    def reconcile(self, allowed, blocked_macs):
+        '''Deja los sets en memoria iguales al estado deseado'''
+        self._call('reconcile')
+        report = new_report()
+        report['missing'] = len(allowed - self.allowed) + len(blocked_macs - self.blocked_macs)
+        report['stale'] = len(self.allowed - allowed) + len(self.blocked_macs - blocked_macs)
+        report['inserted'], report['deleted'] = report['missing'], report['stale']
+        self.allowed, self.blocked_macs = set(allowed), set(blocked_macs)
+        return report
+
+
+BACKENDS = {
+    LegacyScriptsBackend.name: LegacyScriptsBackend,
+    IpsetBackend.name: IpsetBackend,
+    NftablesBackend.name: NftablesBackend,
+    FakeBackend.name: FakeBackend,
+}
@@ -0,0 +1,308 @@
+import re
+import subprocess
+import ipaddress
+from abc import ABC, abstractmethod
+'''
+Aplicacion de cambios de firewall en lote con iptables-restore.
+
+Cada script (unlock_user.sh, lock_user.sh) hace fork de bash y luego 2 o 3
+forks de iptables, y cada iptables toma el lock de xtables y reescribe la
+tabla entera. IptablesRestoreBatch traduce una lista de cambios a las
+mismas reglas y las aplica con UNA llamada:
+
+    [unlock 10.0.0.2, lock 10.0.0.3, unlock 10.0.0.4]
+                │
+                ▼
+    iptables-restore -w --noflush      (no borra las reglas existentes)
+        *filter
+        -I FORWARD -s 10.0.0.2 -m comment --comment captive-portal -j ACCEPT
+        -I FORWARD -d 10.0.0.2 -m comment --comment captive-portal -j ACCEPT
+        -I FORWARD -s 10.0.0.3 -m comment --comment captive-portal -j DROP
+        ...
+        COMMIT                          (todo o nada)
+
+Cada regla del portal lleva el comentario "captive-portal": el
+reconciliador solo toca las reglas marcadas, no las que otro haya puesto
+con la misma forma.
+
+Como el lote es atomico, si falla no se sabe que cambio lo rompio: se divide
+en mitades y se reintenta cada una (en orden) hasta aislar los cambios que
+fallan. Asi cada cambio recibe su propio resultado.
+
+IpsetRestoreBatch y NftBatch hacen lo mismo para los backends de ipset y
+nftables: los cambios son altas y bajas en sets, enviadas en una sola
+llamada a `ipset restore` o `nft -f -`.
+
+El comando se ejecuta con un `runner` inyectable; RecordingRunner lo
+reemplaza en pruebas y benchmarks sin root.
+'''
+
+RESTORE_COMMAND = ('iptables-restore', '-w', '--noflush')
+IPSET_RESTORE_COMMAND = ('ipset', 'restore', '-exist')
+NFT_COMMAND = ('nft', '-f', '-')
+
+UNKNOWN_MAC = "00:00:00:00:00:00"
+
+MAC_PATTERN = re.compile(r'^[0-9A-F]{2}(:[0-9A-F]{2}){5}$')
+
+# Marca de las reglas que crea el portal (la misma que usan los scripts)
+PORTAL_COMMENT = 'captive-portal'
+PORTAL_TAG = f"-m comment --comment {PORTAL_COMMENT}"
+
+
+def run_command(command, input_text=None):
+    '''Runner por defecto: ejecuta el comando y devuelve (codigo, stdout, stderr)'''
+    try:
+        result = subprocess.run(list(command), input=input_text, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return 1, '', str(e)
+    return result.returncode, result.stdout, result.stderr
+
+
+class RecordingRunner:
+    '''
+        Runner falso: guarda cada comando con su entrada y responde con
+        exito, salvo que fail_when(command, input_text) devuelva True
+    '''
+
+    def __init__(self, fail_when=None, stdout=''):
+        self.calls = []
+        self.fail_when = fail_when
+        self.stdout = stdout
+
+    def __call__(self, command, input_text=None):
+        self.calls.append((tuple(command), input_text))
+        if self.fail_when is not None and self.fail_when(command, input_text):
+            return 1, '', 'error simulado'
+        return 0, self.stdout, ''
+
+
+def check_ip(ip):
+    '''Valida la IP antes de escribirla en la entrada de iptables-restore'''
+    return str(ipaddress.IPv4Address(ip))
+
+
+def check_mac(mac):
+    '''MAC normalizada (mayusculas, con ":") o None si no sirve para bloquear'''
+    if not mac:
+        return None
+    mac = mac.upper().replace('-', ':')
+    if mac == UNKNOWN_MAC or not MAC_PATTERN.match(mac):
+        return None
+    return mac
+
+
+def unlock_rules(ip):
+    '''Las mismas reglas que unlock_user.sh'''
+    return [f"-I FORWARD -s {ip} {PORTAL_TAG} -j ACCEPT", f"-I FORWARD -d {ip} {PORTAL_TAG} -j ACCEPT"]
+
+
+def lock_rules(ip, attacker_mac=None):
+    '''Las mismas reglas que lock_user.sh'''
+    rules = []
+    if attacker_mac:
+        rules.append(f"-I FORWARD -m mac --mac-source {attacker_mac} {PORTAL_TAG} -j DROP")
+    rules.append(f"-I FORWARD -s {ip} {PORTAL_TAG} -j DROP")
+    rules.append(f"-I FORWARD -d {ip} {PORTAL_TAG} -j DROP")
+    return rules
+
+
+class RestoreBatch(ABC):
+    '''
+        Base de los lotes: las subclases dicen que lineas genera cada cambio
+        (rules_for) y como se envuelven (header/footer)
+    '''
+
+    header = ''
+    footer = ''
+
+    def __init__(self, runner=run_command, command=RESTORE_COMMAND):
+        """
+        runner: funcion (comando, entrada) -> (codigo, stdout, stderr)
+        command: comando que recibe el lote por stdin
+        """
+        self.runner = runner
+        self.command = command
+        self.restores = 0       # llamadas al comando
+        self.splits = 0         # lotes fallidos que hubo que dividir
+        self.last_error = None
+
+    @abstractmethod
+    def rules_for(self, action, ip, *args):
+        '''Lineas de un cambio; ValueError si la accion o los datos no son validos'''
+        raise NotImplementedError
+
+    def apply(self, changes):
+        '''
+            changes: lista de (accion, ip, args)
+            Returns:
+                list[bool]: resultado de cada cambio, en el mismo orden
+        '''
+        results = [False] * len(changes)
+        pending = []  # (indice, reglas) de los cambios validos
+        for index, (action, ip, args) in enumerate(changes):
+            try:
+                pending.append((index, self.rules_for(action, ip, *args)))
+            except (ValueError, TypeError) as e:
+                self.last_error = str(e)
+                print(f"❌ Cambio de firewall inválido ({action}, {ip}): {e}")
+
+        self._apply_group(pending, results)
+        return results
+
+    def _apply_group(self, group, results):
+        if not group:
+            return
+        if self._restore([rule for _, rules in group for rule in rules]):
+            for index, _ in group:
+                results[index] = True
+            return
+        if len(group) == 1:
+            return
+        # el lote no se aplico: aislar el cambio que falla (las mitades en orden)
+        self.splits += 1
+        middle = len(group) // 2
+        self._apply_group(group[:middle], results)
+        self._apply_group(group[middle:], results)
+
+    def _restore(self, rules):
+        text = self.header + "\n".join(rules) + "\n" + self.footer
+        self.restores += 1
+        code, _, stderr = self.runner(self.command, text)
+        if code != 0:
+            self.last_error = stderr.strip()
+            return False
+        return True
+
+    def get_stats(self):
+        return {'restores': self.restores, 'splits': self.splits}
+
+
+class IptablesRestoreBatch(RestoreBatch):
+    '''
+        Reglas de unlock_user.sh / lock_user.sh en una transaccion de la tabla filter.
+
+        Un ACCEPT insertado con -I al principio de FORWARD quedaria encima de
+        las MACs bloqueadas y dejaria pasar a un atacante que use esa IP.
+        apply() recibe la posicion debajo de la ultima MAC bloqueada y los
+        ACCEPT se insertan ahi; cada DROP del mismo lote que va arriba corre
+        esa posicion un lugar. Los DROP viejos de la IP que quedaron por
+        encima (de un lock_user anterior) se borran en la misma transaccion.
+    '''
+
+    header = "*filter\n"
+    footer = "COMMIT\n"
+
+    def __init__(self, runner=run_command, command=RESTORE_COMMAND):
+        super().__init__(runner, command)
+        self._accept_position = 1
+        self._shadowing = {}
+
+    def apply(self, changes, accept_position=1, shadowing=None):
+        '''
+            accept_position: posicion de FORWARD para los ACCEPT (1 = arriba,
+                             como unlock_user.sh; None = al final de la cadena)
+            shadowing: {ip: [reglas DROP de la IP por encima de esa posicion]},
+                       tal como las escribe iptables-save
+        '''
+        self._accept_position = accept_position
+        self._shadowing = dict(shadowing or {})
+        return super().apply(changes)
+
+    def _restore(self, rules):
+        # una transaccion fallida no cambia la cadena: la posicion sirve para los reintentos
+        if self._accept_position != 1:
+            rules = self._place_accepts(rules)
+        return super()._restore(rules)
+
+    def _place_accepts(self, rules):
+        position = self._accept_position
+        placed = []
+        for rule in rules:
+            if rule.startswith('-D FORWARD '):
+                # solo se borran DROPs que estan por encima de la posicion
+                placed.append(rule)
+                position -= 1
+            elif not rule.startswith('-I FORWARD '):
+                placed.append(rule)
+            elif rule.endswith(' -j ACCEPT'):
+                spec = rule[len('-I FORWARD '):]
+                placed.append(f"-A FORWARD {spec}" if position is None else f"-I FORWARD {position} {spec}")
+            else:
+                placed.append(rule)
+                if position is not None:
+                    position += 1
+        return placed
+
+    def rules_for(self, action, ip, *args):
+        ip = check_ip(ip)
+        if action == 'unlock_user':
+            # cada DROP viejo se borra una sola vez aunque la IP se repita en el lote
+            deletes = [f"-D FORWARD {spec}" for spec in self._shadowing.pop(ip, ())]
+            return deletes + unlock_rules(ip)
+        if action == 'lock_user':
+            return lock_rules(ip, check_mac(args[0]) if args else None)
+        raise ValueError(f"Acción de firewall desconocida: {action}")
+
+
+class IpsetRestoreBatch(RestoreBatch):
+    '''
+        Altas y bajas en los sets del backend ipset. Con -exist, agregar una
+        IP que ya esta (renueva su timeout) o quitar una que no esta no es error.
+    '''
+
+    def __init__(self, allowed_set, blocked_macs_set, runner=run_command, command=IPSET_RESTORE_COMMAND):
+        super().__init__(runner, command)
+        self.allowed_set = allowed_set
+        self.blocked_macs_set = blocked_macs_set
+
+    def rules_for(self, action, ip, *args):
+        ip = check_ip(ip)
+        if action == 'unlock_user':
+            return [f"add {self.allowed_set} {ip}"]
+        if action == 'lock_user':
+            lines = [f"del {self.allowed_set} {ip}"]
+            mac = check_mac(args[0]) if args else None
+            if mac:
+                lines.append(f"add {self.blocked_macs_set} {mac}")
+            return lines
+        raise ValueError(f"Acción de firewall desconocida: {action}")
+
+
+class NftBatch(RestoreBatch):
+    '''
+        Cambios en los sets de la tabla nftables del portal, en una sola
+        transaccion de `nft -f -`.
+
+        nft no tiene "-exist": borrar un elemento ausente es error. Por eso
+        cada baja se escribe como alta + baja (la alta no falla si ya esta),
+        y cada alta con timeout como alta + baja + alta para renovarlo.
+    '''
+
+    def __init__(self, table, allowed_set, blocked_macs_set, timeout=0, runner=run_command, command=NFT_COMMAND):
+        super().__init__(runner, command)
+        self.table = table
+        self.allowed_set = allowed_set
+        self.blocked_macs_set = blocked_macs_set
+        self.timeout = timeout
+
+    def element(self, verb, set_name, value, timeout=''):
+        '''Linea de nft para agregar o borrar un elemento de un set de la tabla'''
+        return f"{verb} element {self.table} {set_name} {{ {value}{timeout} }}"
+
+    def rules_for(self, action, ip, *args):
+        ip = check_ip(ip)
+        if action == 'unlock_user':
+            if not self.timeout:
+                return [self.element('add', self.allowed_set, ip)]
+            timeout = f" timeout {self.timeout}s"
+            return [self.element('add', self.allowed_set, ip, timeout),
+                    self.element('delete', self.allowed_set, ip),
+                    self.element('add', self.allowed_set, ip, timeout)]
+        if action == 'lock_user':
+            lines = [self.element('add', self.allowed_set, ip), self.element('delete', self.allowed_set, ip)]
+            mac = check_mac(args[0]) if args else None
+            if mac:
+                lines.append(self.element('add', self.blocked_macs_set, mac))
+            return lines
+        raise ValueError(f"Acción de firewall desconocida: {action}")
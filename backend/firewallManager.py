@@ -1,12 +1,49 @@
 import subprocess
 import os
+import threading
+import time
+from firewallBatch import run_command, check_mac
+from firewallBackends import BACKENDS
+from firewallReconciler import record_report
+
+# margen del timeout del kernel sobre el de la sesion: quien expira es el portal
+KERNEL_TIMEOUT_GRACE = 60
 
 class FirewallManager:
-    def __init__(self, internet_iface, local_iface, port):
+    def __init__(self, internet_iface, local_iface, port, runner=run_command, backend='iptables', session_timeout=0):
+        """
+        runner: ejecuta iptables/ipset/nft (inyectable en pruebas)
+        backend: nombre de un backend de firewallBackends.BACKENDS
+                 ('iptables', 'ipset', 'nftables', 'fake') o una instancia ya creada
+        session_timeout: con backends que lo soportan (ipset, nftables), las
+                         IPs caducan en el kernel poco despues que la sesion
+                         (0 = sin timeout)
+        """
         self.scripts_dir = os.path.join(os.path.dirname(__file__), 'firewall')
         self.internet_iface = internet_iface
         self.local_iface = local_iface
         self.portal_port = port
+
+        if isinstance(backend, str):
+            if backend not in BACKENDS:
+                raise ValueError(f"Backend de firewall desconocido: {backend}")
+            backend_class = BACKENDS[backend]
+            self.kernel_timeout = (session_timeout + KERNEL_TIMEOUT_GRACE
+                                   if session_timeout and backend_class.kernel_timeouts else 0)
+            self.backend = backend_class(self, runner, self.kernel_timeout)
+        else:
+            self.backend = backend
+            self.kernel_timeout = getattr(backend, 'timeout', 0)
+
+        # Estado deseado: lo que el reconciliador exige en el kernel.
+        # _lock serializa los cambios con la reconciliacion, para que no
+        # compare contra un iptables-save que un cambio ya dejo viejo.
+        self.allowed_ips = set()
+        self.blocked_macs = set()
+        self._lock = threading.RLock()
+        self.last_reconcile = None
+        self._reconcile_stop = threading.Event()
+        self._reconcile_thread = None
     
     def run_script(self, script_name, parameters=None):
         script_path = os.path.join(self.scripts_dir, script_name)
@@ -36,14 +73,137 @@ class FirewallManager:
             return False
     
     def setup_captive_portal(self):
-        return self.run_script('block_all.sh', [self.internet_iface, self.local_iface, self.portal_port])
+        return self.backend.setup()
     
     def unlock_user(self, user_ip):
-        return self.run_script('unlock_user.sh', [user_ip])
+        with self._lock:
+            self._record_change('unlock_user', user_ip)
+            return self.backend.allow(user_ip)
     
     def lock_user(self, user_ip, attacker_mac=None):
-        params = [user_ip]
-        if attacker_mac:
-            params.append(attacker_mac)
-        return self.run_script('lock_user.sh', params)
-    
\ No newline at end of file
+        with self._lock:
+            self._record_change('lock_user', user_ip, attacker_mac)
+            locked = self.backend.revoke(user_ip)
+            if check_mac(attacker_mac):
+                locked = self.backend.block_mac(attacker_mac) and locked
+            return locked
+
+    def _record_change(self, action, ip, attacker_mac=None):
+        '''Actualiza el estado deseado (aunque el cambio falle, la reconciliacion lo reintenta)'''
+        if action == 'unlock_user':
+            self.allowed_ips.add(ip)
+        elif action == 'lock_user':
+            self.allowed_ips.discard(ip)
+            mac = check_mac(attacker_mac)
+            if mac:
+                self.blocked_macs.add(mac)
+
+    def apply_batch(self, changes):
+        '''
+            Aplica varios unlock_user/lock_user en una sola transaccion
+            (iptables-restore, ipset restore o nft -f, segun el backend).
+
+            changes: lista de (accion, ip, args)
+            Returns:
+                list[bool]: resultado de cada cambio
+        '''
+        with self._lock:
+            for action, ip, args in changes:
+                self._record_change(action, ip, *args[:1])
+            return self.backend.apply(changes)
+
+    @property
+    def traffic_counters(self):
+        '''El backend tiene contadores de trafico por IP (solo iptables)'''
+        return self.backend.traffic_counters
+
+    def read_counters(self):
+        return self.backend.read_counters()
+
+    def assume_allowed(self, ips):
+        '''Agrega al estado deseado IPs cuyas reglas ya existen (sesiones recuperadas)'''
+        with self._lock:
+            self.allowed_ips.update(ips)
+
+    def warm_start(self):
+        '''
+            Deja el firewall igual al estado deseado (las sesiones recuperadas
+            con assume_allowed) sin cortar a los usuarios autenticados:
+
+                politica base ya instalada -> solo se reconcilian las diferencias
+                                              (si coincide, no se escribe nada)
+                falta o no se pudo leer    -> se reconstruye todo en una transaccion
+                                              (politica base + sesiones + MACs)
+
+            Las MACs bloqueadas que ya estan en el kernel se conservan. Si la
+            reconstruccion falla se vuelve a setup() + reconciliacion.
+
+            Returns:
+                bool: True si el firewall quedo configurado
+        '''
+        started = time.perf_counter()
+        with self._lock:
+            state = self.backend.kernel_state()
+            if state is not None:
+                self.blocked_macs.update(state['blocked_macs'])
+
+            if state is not None and state['base']:
+                ok = self.reconcile()['ok']
+                mode = 'politica base intacta, reconciliado'
+            else:
+                ok = self.backend.restore(set(self.allowed_ips), set(self.blocked_macs))
+                mode = 'reconstruido en una transaccion'
+                if not ok:
+                    print("⚠️  Reconstruccion fallida: configurando el firewall desde cero")
+                    ok = self.backend.setup() and self.reconcile()['ok']
+                    mode = 'configurado desde cero'
+
+        elapsed = (time.perf_counter() - started) * 1000
+        if ok:
+            print(f"✅ Firewall {mode} en {elapsed:.0f} ms ({len(self.allowed_ips)} sesiones, "
+                  f"{len(self.blocked_macs)} MACs bloqueadas)")
+        return ok
+
+    def reconcile(self):
+        '''
+            Compara el firewall con el estado deseado y aplica solo las
+            diferencias (ver firewallReconciler.py)
+
+            Returns:
+                dict: diferencias encontradas, reglas borradas/insertadas y duracion
+        '''
+        with self._lock:
+            report = self.backend.reconciler.reconcile(set(self.allowed_ips), set(self.blocked_macs))
+        self.last_reconcile = report
+        record_report(report)
+
+        drift = report['missing'] + report['stale'] + report['duplicates'] + report['misordered']
+        if not report['ok']:
+            print(f"❌ Error reconciliando el firewall: {report['error']}")
+        elif drift:
+            print(f"🔧 Firewall reconciliado en {report['seconds'] * 1000:.0f} ms: "
+                  f"{report['missing']} faltantes, {report['stale']} sobrantes, "
+                  f"{report['duplicates']} duplicadas, {report['misordered']} fuera de orden")
+        return report
+
+    def start_reconciler(self, interval=60):
+        '''Reconcilia cada `interval` segundos en un hilo propio'''
+        if self._reconcile_thread is not None:
+            return
+        self._reconcile_stop.clear()
+        self._reconcile_thread = threading.Thread(target=self._reconcile_loop, args=(interval,),
+                                                  name="firewall-reconcile", daemon=True)
+        self._reconcile_thread.start()
+
+    def _reconcile_loop(self, interval):
+        while not self._reconcile_stop.wait(interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                print(f"❌ Error reconciliando el firewall: {e}")
+
+    def stop_reconciler(self):
+        self._reconcile_stop.set()
+        if self._reconcile_thread is not None:
+            self._reconcile_thread.join(timeout=5)
+            self._reconcile_thread = None
@@ -0,0 +1,184 @@
+import sys
+import time
+import queue
+import threading
+from metrics import REGISTRY
+'''
+Cola de aplicación de reglas del firewall.
+
+Los cambios de sesión se confirman primero en memoria y solo después se
+encola el cambio de firewall correspondiente; un hilo dedicado ejecuta los
+scripts de iptables. Así un fork de bash + iptables (decenas de ms) nunca
+se hace con un lock de sesiones tomado.
+
+    create_session ─┐
+    terminate ──────┼──→ cola FIFO ──→ hilo firewall ──→ FirewallManager
+    suplantación ───┘                    (en orden)
+
+El hilo junta los cambios que llegan durante batch_window y, si el firewall
+tiene apply_batch, los aplica en una sola transaccion (iptables-restore);
+cada cambio recibe su propio resultado.
+
+Un solo hilo consume la cola en orden de llegada, por lo que los cambios de
+una misma IP se aplican en el mismo orden en que se encolaron. Quien necesite
+que el cambio ya esté aplicado (el redirect tras el login) puede esperarlo
+con wait().
+'''
+
+FIREWALL_SECONDS = REGISTRY.histogram('portal_firewall_apply_seconds',
+                                      'Tiempo de cada cambio aplicado al firewall', ('action', 'result'))
+FIREWALL_BATCH_SIZE = REGISTRY.histogram('portal_firewall_batch_changes', 'Cambios por transaccion del firewall',
+                                         buckets=(1, 2, 4, 8, 16, 32, 64))
+
+class FirewallChange:
+    '''Cambio pendiente: una llamada a un metodo del FirewallManager'''
+
+    __slots__ = ('action', 'ip', 'args', 'done', 'result')
+
+    def __init__(self, action, ip, args=()):
+        self.action = action      # 'unlock_user' | 'lock_user'
+        self.ip = ip
+        self.args = args
+        self.done = threading.Event()
+        self.result = None        # True/False cuando ya se aplico
+
+    def __repr__(self):
+        return f"FirewallChange({self.action}, {self.ip}{', ' if self.args else ''}{', '.join(map(str, self.args))})"
+
+
+class FirewallApplyQueue:
+
+    def __init__(self, firewall_manager, max_batch=64, batch_window=0.005):
+        """
+        firewall_manager: objeto con unlock_user(ip) y lock_user(ip, mac=None)
+                          y opcionalmente apply_batch([(accion, ip, args)])
+        max_batch: cambios que el hilo toma de la cola de una vez
+        batch_window: segundos que se esperan mas cambios tras el primero
+        """
+        self.firewall = firewall_manager
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._last_by_ip = {}   # ip -> ultimo cambio encolado, sin aplicar o fallido
+        self.applied = 0
+        self.failed = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._apply_loop, name="firewall-apply", daemon=True)
+        self.thread.start()
+
+    def submit(self, action, ip, *args):
+        '''
+            Encola un cambio y vuelve enseguida. Para conservar el orden por IP,
+            llamar con el lock de la sesion de esa IP tomado.
+        '''
+        change = FirewallChange(action, ip, args)
+        with self._lock:
+            self._last_by_ip[ip] = change
+            self._queue.put(change)
+        return change
+
+    def wait(self, ip, timeout=None):
+        '''
+            Espera a que se apliquen todos los cambios encolados hasta ahora
+            para la IP. Devuelve True si se aplicaron con exito (o no habia);
+            False si el ultimo fallo, aunque ya hubiera terminado al llamar.
+        '''
+        with self._lock:
+            change = self._last_by_ip.get(ip)
+        if change is None:
+            return True
+        if not change.done.wait(timeout):
+            return False
+        return bool(change.result)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def get_stats(self):
+        return {
+            'firewall_pending': self.pending(),
+            'firewall_applied': self.applied,
+            'firewall_failed': self.failed,
+        }
+
+    def _next_batch(self):
+        '''
+            Bloquea hasta tener al menos un cambio y toma los que llegan
+            durante batch_window (sin esperar si se pide detener el hilo)
+        '''
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _apply_loop(self):
+        while True:
+            batch = self._next_batch()
+            stop = None in batch
+            self._apply_batch([change for change in batch if change is not None])
+            if stop:
+                return
+
+    def _apply_batch(self, batch):
+        if not batch:
+            return
+        if hasattr(self.firewall, 'apply_batch'):
+            started = time.perf_counter()
+            try:
+                results = self.firewall.apply_batch([(c.action, c.ip, c.args) for c in batch])
+            except Exception as e:
+                print(f"❌ Error aplicando lote de {len(batch)} cambios: {e}", file=sys.stderr)
+                results = [False] * len(batch)
+            if len(results) != len(batch):
+                # sin un resultado por cambio no se sabe cual se aplico: el lote falla
+                print(f"❌ apply_batch devolvio {len(results)} resultados para {len(batch)} cambios",
+                      file=sys.stderr)
+                results = [False] * len(batch)
+            elapsed = time.perf_counter() - started
+            FIREWALL_BATCH_SIZE.observe(len(batch))
+            for change, result in zip(batch, results):
+                FIREWALL_SECONDS.labels(change.action, 'ok' if result else 'error').observe(elapsed)
+                self._finish(change, result)
+            return
+
+        for change in batch:
+            started = time.perf_counter()
+            try:
+                result = bool(getattr(self.firewall, change.action)(change.ip, *change.args))
+            except Exception as e:
+                print(f"❌ Error aplicando {change}: {e}", file=sys.stderr)
+                result = False
+            FIREWALL_SECONDS.labels(change.action, 'ok' if result else 'error').observe(time.perf_counter() - started)
+            self._finish(change, result)
+
+    def _finish(self, change, result):
+        change.result = result
+        with self._lock:
+            if result:
+                self.applied += 1
+            else:
+                self.failed += 1
+            # un cambio fallido se conserva hasta que llegue otro para la IP:
+            # wait() tiene que poder devolver False despues de que termino
+            if result and self._last_by_ip.get(change.ip) is change:
+                del self._last_by_ip[change.ip]
+        change.done.set()
+
+    def stop(self, timeout=5):
+        '''Aplica lo que quede en la cola y detiene el hilo'''
+        if self.thread is None:
+            return
+        self._queue.put(None)
+        self.thread.join(timeout=timeout)
+        self.thread = None
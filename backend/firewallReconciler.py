@@ -0,0 +1,337 @@
+import json
+import time
+from firewallBatch import run_command, RESTORE_COMMAND, IPSET_RESTORE_COMMAND, NFT_COMMAND, PORTAL_COMMENT, PORTAL_TAG
+from metrics import REGISTRY
+'''
+Reconciliacion del firewall contra el estado deseado.
+
+unlock_user.sh y lock_user.sh insertan reglas con -I y nunca borran las
+anteriores: tras muchos login/logout FORWARD acumula ACCEPT y DROP repetidos
+y contradictorios para las mismas IPs, y cada paquete los recorre todos.
+
+El FirewallManager guarda en memoria lo que deberia haber (IPs con acceso y
+MACs bloqueadas). Periodicamente el reconciliador:
+
+    1. lee el estado real con UNA llamada (iptables-save / ipset save)
+    2. lo compara con el deseado:
+         missing     reglas que deberian estar y no estan
+         stale       reglas propias que sobran (IP sin sesion, DROP viejos)
+         duplicates  la misma regla mas de una vez
+         misordered  MAC bloqueada despues de un ACCEPT (no la detendria)
+    3. aplica solo esas diferencias en una transaccion atomica
+
+Solo se tocan las reglas que el portal crea (ACCEPT/DROP de una IP y DROP
+de una MAC en FORWARD, marcadas con el comentario "captive-portal"); las de
+block_all.sh y cualquier otra quedan igual, aunque tengan la misma forma.
+'''
+
+SAVE_COMMAND = ('iptables-save', '-t', 'filter')
+SAVE_ALL_COMMAND = ('iptables-save',)
+IPSET_SAVE_COMMAND = ('ipset', 'save')
+
+RECONCILE_SECONDS = REGISTRY.histogram('portal_firewall_reconcile_seconds', 'Duracion de cada reconciliacion',
+                                       buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+DRIFT = REGISTRY.counter('portal_firewall_drift_total', 'Diferencias encontradas entre el firewall y el estado deseado',
+                         ('kind',))
+
+DRIFT_KINDS = ('missing', 'stale', 'duplicates', 'misordered')
+
+
+def parse_forward_rules(text):
+    '''Reglas de FORWARD de un `iptables-save -t filter`, en orden, sin el "-A FORWARD "'''
+    rules = []
+    for line in text.splitlines():
+        if line.startswith('-A FORWARD '):
+            rules.append(line[len('-A FORWARD '):].strip())
+    return rules
+
+
+def parse_iptables_save(text):
+    '''
+        Politicas y reglas de todas las tablas de un `iptables-save`:
+        {tabla: {'policies': {cadena: politica}, 'rules': {cadena: [regla sin "-A CADENA "]}}}
+    '''
+    tables = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith('*'):
+            current = tables.setdefault(line[1:].strip(), {'policies': {}, 'rules': {}})
+        elif current is None:
+            continue
+        elif line.startswith(':'):
+            fields = line[1:].split()
+            if len(fields) >= 2:
+                current['policies'][fields[0]] = fields[1]
+        elif line.startswith('-A '):
+            chain, _, spec = line[3:].partition(' ')
+            current['rules'].setdefault(chain, []).append(spec.strip())
+    return tables
+
+
+def _host(address):
+    '''"10.0.0.2/32" -> "10.0.0.2"; None si es una red'''
+    if address.endswith('/32'):
+        address = address[:-3]
+    return None if '/' in address else address
+
+
+def _untag(tokens):
+    '''Los tokens sin la marca del portal, o None si la regla no la tiene'''
+    for i in range(len(tokens) - 3):
+        if tokens[i:i + 3] == ['-m', 'comment', '--comment'] and tokens[i + 3].strip('"') == PORTAL_COMMENT:
+            return tokens[:i] + tokens[i + 4:]
+    return None
+
+
+def owned_rule(spec):
+    '''
+        Clave de una regla creada por el portal, o None si no es suya (las
+        del portal llevan -m comment --comment captive-portal):
+            ('allow', ip, 's'|'d')   -s/-d ip -j ACCEPT
+            ('deny', ip, 's'|'d')    -s/-d ip -j DROP   (lock_user.sh)
+            ('mac', MAC)             -m mac --mac-source MAC -j DROP
+    '''
+    tokens = _untag(spec.split())
+    if tokens is None:
+        return None
+    if len(tokens) == 4 and tokens[0] in ('-s', '-d') and tokens[2] == '-j' and tokens[3] in ('ACCEPT', 'DROP'):
+        ip = _host(tokens[1])
+        if ip is None:
+            return None
+        return ('allow' if tokens[3] == 'ACCEPT' else 'deny', ip, tokens[0][1])
+    if tokens[:3] == ['-m', 'mac', '--mac-source'] and tokens[4:] == ['-j', 'DROP'] and len(tokens) == 6:
+        return ('mac', tokens[3].upper())
+    return None
+
+
+def rule_spec(key):
+    '''Regla de FORWARD (sin "-A FORWARD ") para una clave de owned_rule'''
+    if key[0] == 'mac':
+        return f"-m mac --mac-source {key[1]} {PORTAL_TAG} -j DROP"
+    return f"-{key[2]} {key[1]} {PORTAL_TAG} -j {'ACCEPT' if key[0] == 'allow' else 'DROP'}"
+
+
+def new_report():
+    '''Reporte de reconciliacion vacio (lo usan tambien los backends)'''
+    report = dict.fromkeys(DRIFT_KINDS, 0)
+    report.update({'deleted': 0, 'inserted': 0, 'seconds': 0.0, 'ok': True, 'error': None})
+    return report
+
+
+class IptablesReconciler:
+
+    def __init__(self, runner=run_command, save_command=SAVE_COMMAND, restore_command=RESTORE_COMMAND):
+        self.runner = runner
+        self.save_command = save_command
+        self.restore_command = restore_command
+
+    def plan(self, saved, allowed, blocked_macs):
+        '''
+            saved: salida de iptables-save; allowed: IPs con acceso;
+            blocked_macs: MACs bloqueadas (mayusculas)
+
+            Returns:
+                (borrar, insertar, agregar_al_final, reporte): reglas a aplicar
+        '''
+        desired = {('allow', ip, direction) for ip in allowed for direction in 'sd'}
+        desired.update(('mac', mac) for mac in blocked_macs)
+        report = new_report()
+
+        deletes = []
+        kept = set()
+        moved = set()
+        first_allow = None
+        for position, spec in enumerate(parse_forward_rules(saved)):
+            key = owned_rule(spec)
+            if key is None:
+                continue
+            if key in kept:
+                report['duplicates'] += 1
+                deletes.append(spec)
+            elif key not in desired:
+                report['stale'] += 1
+                deletes.append(spec)
+            elif key[0] == 'mac' and first_allow is not None:
+                # un ACCEPT anterior dejaria pasar a la MAC: se mueve arriba
+                report['misordered'] += 1
+                deletes.append(spec)
+                moved.add(key)
+            else:
+                kept.add(key)
+                if key[0] == 'allow' and first_allow is None:
+                    first_allow = position
+
+        missing = desired - kept
+        report['missing'] = len(missing - moved)
+        # MACs al principio (antes que cualquier ACCEPT); ACCEPTs al final
+        inserts = [rule_spec(key) for key in sorted(k for k in missing if k[0] == 'mac')]
+        appends = [rule_spec(key) for key in sorted(k for k in missing if k[0] == 'allow')]
+        return deletes, inserts, appends, report
+
+    def reconcile(self, allowed, blocked_macs):
+        started = time.perf_counter()
+        code, saved, stderr = self.runner(self.save_command)
+        if code != 0:
+            report = new_report()
+            report.update(ok=False, error=f"iptables-save: {stderr.strip()}")
+            return report
+
+        deletes, inserts, appends, report = self.plan(saved, allowed, blocked_macs)
+        lines = [f"-D FORWARD {spec}" for spec in deletes] + \
+                [f"-I FORWARD {spec}" for spec in inserts] + \
+                [f"-A FORWARD {spec}" for spec in appends]
+        if lines:
+            code, _, stderr = self.runner(self.restore_command, "*filter\n" + "\n".join(lines) + "\nCOMMIT\n")
+            if code != 0:
+                report.update(ok=False, error=f"iptables-restore: {stderr.strip()}")
+            else:
+                report['deleted'] = len(deletes)
+                report['inserted'] = len(inserts) + len(appends)
+        report['seconds'] = time.perf_counter() - started
+        return report
+
+
+def parse_ipset_members(text, set_name):
+    '''Elementos de un set en la salida de `ipset save`'''
+    members = set()
+    prefix = f"add {set_name} "
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            members.add(line[len(prefix):].split()[0].upper())
+    return members
+
+
+class IpsetReconciler:
+    '''Con ipset no hay duplicados ni orden: solo elementos que faltan o sobran'''
+
+    def __init__(self, allowed_set, blocked_macs_set, runner=run_command):
+        self.allowed_set = allowed_set
+        self.blocked_macs_set = blocked_macs_set
+        self.runner = runner
+
+    def plan(self, saved, allowed, blocked_macs):
+        '''Returns: (lineas para ipset restore, reporte)'''
+        report = new_report()
+        lines = []
+        for set_name, desired in ((self.allowed_set, set(allowed)), (self.blocked_macs_set, set(blocked_macs))):
+            actual = parse_ipset_members(saved, set_name)
+            missing = sorted(desired - actual)
+            stale = sorted(actual - desired)
+            report['missing'] += len(missing)
+            report['stale'] += len(stale)
+            lines += [f"add {set_name} {member}" for member in missing]
+            lines += [f"del {set_name} {member}" for member in stale]
+        return lines, report
+
+    def reconcile(self, allowed, blocked_macs):
+        started = time.perf_counter()
+        code, saved, stderr = self.runner(IPSET_SAVE_COMMAND)
+        if code != 0:
+            report = new_report()
+            report.update(ok=False, error=f"ipset save: {stderr.strip()}")
+            return report
+
+        lines, report = self.plan(saved, allowed, blocked_macs)
+        if lines:
+            code, _, stderr = self.runner(IPSET_RESTORE_COMMAND, "\n".join(lines) + "\n")
+            if code != 0:
+                report.update(ok=False, error=f"ipset restore: {stderr.strip()}")
+            else:
+                report['deleted'] = report['stale']
+                report['inserted'] = report['missing']
+        report['seconds'] = time.perf_counter() - started
+        return report
+
+
+def nft_list_command(table):
+    return ('nft', '-j', 'list', 'table') + tuple(table.split())
+
+
+def parse_nft_table(text):
+    '''
+        Sets y cadenas de la salida de `nft -j list table ...`:
+        {'sets': {nombre: {'members': {elementos en mayusculas}, 'flags': {...}}},
+         'rules': {cadena: cantidad de reglas}}
+    '''
+    table = {'sets': {}, 'rules': {}}
+    for item in json.loads(text).get('nftables', []):
+        if 'chain' in item:
+            table['rules'].setdefault(item['chain']['name'], 0)
+        elif 'rule' in item:
+            chain = item['rule']['chain']
+            table['rules'][chain] = table['rules'].get(chain, 0) + 1
+        elif 'set' in item:
+            nft_set = item['set']
+            flags = nft_set.get('flags', [])
+            entry = table['sets'].setdefault(nft_set['name'], {
+                'members': set(), 'flags': set([flags] if isinstance(flags, str) else flags)})
+            for element in nft_set.get('elem', []):
+                if isinstance(element, dict):  # con timeout: {"elem": {"val": ..., "timeout": ...}}
+                    element = element.get('elem', {}).get('val')
+                if isinstance(element, str):
+                    entry['members'].add(element.upper())
+    return table
+
+
+def parse_nft_sets(text):
+    '''Elementos de cada set de `nft -j list table ...` -> {nombre_set: {elementos en mayusculas}}'''
+    return {name: entry['members'] for name, entry in parse_nft_table(text)['sets'].items()}
+
+
+class NftReconciler:
+    '''Como IpsetReconciler, leyendo la tabla del portal con una llamada a `nft -j list table`'''
+
+    def __init__(self, batch, runner=run_command):
+        """
+        batch: NftBatch del backend (tabla, nombres de los sets y timeout)
+        """
+        self.batch = batch
+        self.runner = runner
+
+    def plan(self, saved, allowed, blocked_macs):
+        '''Returns: (lineas para nft -f, reporte)'''
+        report = new_report()
+        lines = []
+        sets = parse_nft_sets(saved)
+        actual_ips = sets.get(self.batch.allowed_set, set())
+        actual_macs = sets.get(self.batch.blocked_macs_set, set())
+
+        missing_ips, stale_ips = sorted(set(allowed) - actual_ips), sorted(actual_ips - set(allowed))
+        missing_macs, stale_macs = sorted(set(blocked_macs) - actual_macs), sorted(actual_macs - set(blocked_macs))
+        report['missing'] = len(missing_ips) + len(missing_macs)
+        report['stale'] = len(stale_ips) + len(stale_macs)
+
+        for ip in missing_ips:
+            lines += self.batch.rules_for('unlock_user', ip)
+        for ip in stale_ips:
+            lines += self.batch.rules_for('lock_user', ip)
+        lines += [self.batch.element('add', self.batch.blocked_macs_set, mac) for mac in missing_macs]
+        lines += [self.batch.element('delete', self.batch.blocked_macs_set, mac) for mac in stale_macs]
+        return lines, report
+
+    def reconcile(self, allowed, blocked_macs):
+        started = time.perf_counter()
+        code, saved, stderr = self.runner(nft_list_command(self.batch.table))
+        if code != 0:
+            report = new_report()
+            report.update(ok=False, error=f"nft list: {stderr.strip()}")
+            return report
+
+        lines, report = self.plan(saved, allowed, blocked_macs)
+        if lines:
+            code, _, stderr = self.runner(NFT_COMMAND, "\n".join(lines) + "\n")
+            if code != 0:
+                report.update(ok=False, error=f"nft: {stderr.strip()}")
+            else:
+                report['deleted'] = report['stale']
+                report['inserted'] = report['missing']
+        report['seconds'] = time.perf_counter() - started
+        return report
+
+
+def record_report(report):
+    '''Publica el resultado de una reconciliacion en las metricas'''
+    RECONCILE_SECONDS.observe(report['seconds'])
+    for kind in DRIFT_KINDS:
+        if report[kind]:
+            DRIFT.labels(kind).inc(report[kind])
@@ -0,0 +1,210 @@
+'''
+Parser HTTP incremental sobre bytes.
+
+Los datos del socket se reciben directamente (recv_into) en un bytearray
+reutilizable; el parser busca el fin de los headers sin volver a recorrer lo
+ya revisado, respeta Content-Length exacto y limita el tamaño de headers y
+body. Solo se decodifica la linea de peticion: los valores de los headers se
+guardan como bytes y se decodifican cuando alguien los consulta.
+
+    buffer: [ peticion ya consumida | datos pendientes | espacio libre ]
+                                    ^start             ^end
+'''
+
+class HTTPParseError(Exception):
+    '''Peticion invalida: code es el status HTTP con el que se responde'''
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class HTTPHeaders:
+    '''
+        Headers de una peticion con busqueda sin distinguir mayusculas.
+        Los valores se decodifican (latin-1) solo al consultarlos.
+    '''
+
+    __slots__ = ('_raw',)
+
+    def __init__(self):
+        self._raw = {}
+
+    def add(self, name, value):
+        self._raw[name.lower()] = value
+
+    def get(self, name, default=None):
+        value = self._raw.get(name.lower().encode('latin-1'))
+        if value is None:
+            return default
+        return value.decode('latin-1')
+
+    def get_raw(self, name):
+        return self._raw.get(name.lower().encode('latin-1'))
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return name.lower().encode('latin-1') in self._raw
+
+    def __len__(self):
+        return len(self._raw)
+
+    def items(self):
+        return [(k.decode('latin-1'), v.decode('latin-1')) for k, v in self._raw.items()]
+
+
+class HTTPRequest:
+    '''Peticion completa extraida por el parser'''
+
+    __slots__ = ('command', 'path', 'request_version', 'requestline', 'headers', 'content_length', 'body')
+
+    def __init__(self, command, path, request_version, requestline, headers, content_length):
+        self.command = command
+        self.path = path
+        self.request_version = request_version
+        self.requestline = requestline
+        self.headers = headers
+        self.content_length = content_length
+        self.body = b''
+
+
+class HTTPRequestParser:
+
+    def __init__(self, max_header_size=8192, max_body_size=64 * 1024, chunk_size=8192):
+        """
+        max_header_size: bytes maximos de linea de peticion + headers (431)
+        max_body_size: bytes maximos del body segun Content-Length (413)
+        chunk_size: bytes pedidos al socket en cada recv_into
+        """
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.chunk_size = chunk_size
+
+        self._buf = bytearray(2 * chunk_size)
+        self._view = memoryview(self._buf)
+        self._start = 0      # inicio de los datos aun no consumidos
+        self._end = 0        # fin de los datos recibidos
+        self._scan = 0       # desde donde seguir buscando el fin de headers
+        self._pending = None # peticion con headers completos esperando body
+
+    def pending_bytes(self):
+        return self._end - self._start
+
+    def waiting_body(self):
+        '''True si ya llegaron los headers y falta parte del body'''
+        return self._pending is not None
+
+    def recv_from(self, sock):
+        '''
+            Recibe del socket directamente en el buffer.
+            Devuelve los bytes leidos (0 si el cliente cerro la conexion).
+        '''
+        self._reserve(self.chunk_size)
+        n = sock.recv_into(self._view[self._end:], self.chunk_size)
+        self._end += n
+        return n
+
+    def feed(self, data):
+        '''Añade bytes ya recibidos por otra via'''
+        self._reserve(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def _reserve(self, size):
+        '''Garantiza espacio libre al final del buffer compactando o creciendo'''
+        if len(self._buf) - self._end >= size:
+            return
+
+        pending = self._end - self._start
+        if self._start > 0:
+            # mover los datos pendientes al inicio (sin cambiar el tamaño)
+            self._view[:pending] = self._view[self._start:self._end]
+            self._scan -= self._start
+            self._start = 0
+            self._end = pending
+
+        if len(self._buf) - self._end < size:
+            # la peticion no cabe: crecer (hay que soltar la vista primero)
+            self._view.release()
+            self._buf.extend(bytes(max(size, len(self._buf))))
+            self._view = memoryview(self._buf)
+
+    def next_request(self):
+        '''
+            Devuelve la siguiente peticion completa del buffer o None si aun
+            faltan datos. Lanza HTTPParseError si la peticion es invalida.
+        '''
+        if self._pending is None:
+            # ignorar CRLF sueltos entre peticiones (RFC 9112 2.2)
+            while self._end - self._start >= 2 and self._buf[self._start:self._start + 2] == b'\r\n':
+                self._start += 2
+            self._scan = max(self._scan, self._start)
+
+            idx = self._buf.find(b'\r\n\r\n', self._scan, self._end)
+            if idx < 0 or idx - self._start > self.max_header_size:
+                if idx >= 0 or self._end - self._start > self.max_header_size:
+                    raise HTTPParseError(431, "Headers de la petición demasiado grandes")
+                self._scan = max(self._start, self._end - 3)
+                return None
+
+            self._pending = self._parse_head(self._start, idx)
+            self._start = idx + 4
+            self._scan = self._start
+
+        request = self._pending
+        length = request.content_length
+        if self._end - self._start < length:
+            return None
+
+        if length:
+            request.body = bytes(self._view[self._start:self._start + length])
+            self._start += length
+
+        self._pending = None
+        self._scan = self._start
+        if self._start == self._end:
+            self._start = self._end = self._scan = 0
+        return request
+
+    def _parse_head(self, start, end):
+        head = bytes(self._view[start:end])
+        lines = head.split(b'\r\n')
+
+        requestline = lines[0]
+        parts = requestline.split()
+        if len(parts) != 3 or not parts[2].startswith(b'HTTP/'):
+            raise HTTPParseError(400, "Línea de petición inválida")
+
+        headers = HTTPHeaders()
+        for line in lines[1:]:
+            name, sep, value = line.partition(b':')
+            if not sep or not name or name != name.strip():
+                raise HTTPParseError(400, "Header inválido")
+            headers.add(name, value.strip())
+
+        if headers.get_raw('Transfer-Encoding') is not None:
+            raise HTTPParseError(501, "Transfer-Encoding no soportado")
+
+        content_length = 0
+        raw_length = headers.get_raw('Content-Length')
+        if raw_length is not None:
+            if not raw_length.isdigit():
+                raise HTTPParseError(400, "Content-Length inválido")
+            content_length = int(raw_length)
+            if content_length > self.max_body_size:
+                raise HTTPParseError(413, "El cuerpo de la petición es demasiado grande")
+
+        return HTTPRequest(
+            parts[0].decode('ascii', errors='replace'),
+            parts[1].decode('latin-1'),
+            parts[2].decode('ascii', errors='replace'),
+            requestline.decode('latin-1'),
+            headers,
+            content_length,
+        )
@@ -1,7 +1,11 @@
 import socket
 import threading
+import time
 from urllib.parse import parse_qs, unquote
 from io import BytesIO
+from httpParser import HTTPRequestParser, HTTPParseError
+from assetCache import AssetCache, gzip_bytes
+from email.utils import parsedate_to_datetime
 import sys
 import os
 
@@ -28,57 +32,225 @@ Respuesta HTTP (Response)
 └──────────────────────────────────────────┘
 """
 
+# Lineas de control pre-codificadas que aparecen en casi todas las respuestas
+SERVER_HEADER = b"Server: CaptivePortalHTTP/1.0\r\n"
+CONNECTION_CLOSE = b"Connection: close\r\n"
+CONNECTION_KEEP_ALIVE = b"Connection: keep-alive\r\n"
+
+
+class ResponseBuffer:
+    '''
+        Acumula la respuesta (status line + headers en un solo bloque y los
+        trozos del body sin copiarlos) para enviarla con una sola llamada
+        sendmsg en lugar de una escritura por header
+    '''
+
+    __slots__ = ('chunks',)
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        if data:
+            self.chunks.append(data)
+
+    def take(self):
+        chunks = self.chunks
+        self.chunks = []
+        return chunks
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+
+def send_buffers(sock, chunks):
+    '''
+        Envia una lista de buffers con sendmsg (scatter/gather), reintentando
+        con lo que quede si el kernel acepta menos de lo pedido
+    '''
+    views = [memoryview(chunk) for chunk in chunks]
+    while views:
+        sent = sock.sendmsg(views)
+        views = advance_buffers(views, sent)
+
+
+def advance_buffers(views, sent):
+    '''Descarta de la lista los primeros `sent` bytes ya enviados'''
+    index = 0
+    while index < len(views) and sent >= len(views[index]):
+        sent -= len(views[index])
+        index += 1
+    views = views[index:]
+    if views and sent:
+        views[0] = views[0][sent:]
+    return views
+
+
 class BaseHTTPRequestHandler:
 
     frontend_path = os.path.join(os.path.dirname(__file__), '..', 'frontend')
 
-    def __init__(self, socketRequest, clientAddress, serverInstance):
+    # Archivos del frontend en memoria (compartida por todas las conexiones)
+    assets = AssetCache(frontend_path)
+
+    # Compresion al vuelo de paginas renderizadas (errores)
+    dynamic_gzip_min_size = 1024
+    dynamic_gzip_level = 5
+
+    # Conexiones persistentes (HTTP/1.1 keep-alive)
+    keepalive_timeout = 5          # segundos de espera entre peticiones (idle)
+    max_keepalive_requests = 100   # peticiones maximas por conexion
+
+    # Plazos por conexion contra clientes lentos (segundos)
+    header_timeout = 10            # para recibir linea de peticion + headers completos
+    body_timeout = 15              # para recibir el body completo
+    write_timeout = 10             # maximo sin progreso al enviar la respuesta
+
+    # Limites del parser
+    max_header_size = 8 * 1024     # linea de peticion + headers
+    max_body_size = 64 * 1024      # body (formularios de login/registro)
+
+    def __init__(self, socketRequest, clientAddress, serverInstance, request=None, requestsHandled=0):
         """
         socketRequest: socket de la conexion
         clientAddress: direccion del cliente con formato (host, port)
         serverInstance: instancia actual del servidor
+        request: peticion ya parseada (HTTPRequest o HTTPParseError) por un
+                 servidor de event loop; si es None se lee del socket
+        requestsHandled: peticiones ya atendidas en esta conexion (event loop)
         """
         self.socketRequest = socketRequest
         self.clientAddress = clientAddress
         self.serverInstance = serverInstance
         
         # Parsear datos http
-        self.raw_requestline = None # cadena de solicitud http cruda
-        self.requestline = None # cadena de solicitud sin CRLS
+        self.requestline = None # linea de solicitud sin CRLF
         self.command = None  # GET, POST, etc.
         self.path = None # ruta de la solicitud
         self.request_version = None # cadena de versiones de la solicitud ex: 'Http/1.0'
         self.headers = {} # metadatos de la solicitud
         self.rfile = None  # Para leer el body
-        self.wfile = None  # Para escribir respuesta
+        self.wfile = ResponseBuffer()  # Respuesta acumulada hasta flush_response
+        self._header_lines = []  # status line + headers de la respuesta en curso
+
+        # Estado de la conexion
+        self.requests_handled = requestsHandled
+        self.close_connection = True
+        self.pending_file = None # (ruta, offset, bytes) que debe enviar el event loop
         
 
-        self.handle() # procesa la peticion
+        if request is None:
+            self.handle() # procesa las peticiones leyendo del socket
+        else:
+            # la peticion ya fue leida por el event loop: la respuesta queda
+            # en wfile y la envia el propio loop
+            self.handle_request(request)
+
+    @classmethod
+    def create_parser(cls):
+        return HTTPRequestParser(cls.max_header_size, cls.max_body_size)
     
     def handle(self):
-        try:
-            # recibir datos max 8192 bytes
-            self.raw_requestline = self.socketRequest.recv(8192).decode('utf-8', errors='ignore')
+        '''
+            Atiende peticiones sobre la misma conexion mientras el cliente
+            pida keep-alive. Los bytes sobrantes de una peticion (pipelining)
+            quedan en el parser para la siguiente.
+        '''
+        parser = self.create_parser()
 
-            if not self.raw_requestline:
+        while True:
+            request = self.read_request(parser)
+            if request is None:
                 return
-            
-            # parsear peticion http
-            if not self.parse_request():
+
+            self.handle_request(request)
+
+            try:
+                self.flush_response()
+            except socket.timeout:
+                self.record_reaped('write_timeout')
+                return
+            except OSError:
                 return
 
-            # separar los headers del body
-            remaining_data = self.raw_requestline.split('\r\n\r\n', 1)
-            if len(remaining_data) > 1: 
-                body_data = remaining_data[1] # solicitud POST
-            else:
-                body_data = '' # solicitud GET tipica
+            if self.close_connection:
+                return
 
-            # simular un archivo de solo lectura en memoria para el body
-            self.rfile = BytesIO(body_data.encode('utf-8'))
+    def read_request(self, parser):
+        '''
+            Recibe del socket hasta que el parser tenga una peticion completa.
+            Devuelve la peticion, el HTTPParseError si es invalida, o None si
+            el cliente cerro o no cumplio los plazos.
+
+            Plazos (absolutos, un cliente que envia byte a byte no los renueva):
+              idle   -> keepalive_timeout hasta el primer byte de la siguiente peticion
+              header -> header_timeout hasta tener todos los headers
+              body   -> body_timeout hasta tener todo el body
+        '''
+        phase = 'idle' if self.requests_handled and not parser.pending_bytes() else 'header'
+        started = time.monotonic()
+
+        while True:
+            try:
+                request = parser.next_request()
+            except HTTPParseError as e:
+                return e
+            if request is not None:
+                return request
+
+            now = time.monotonic()
+            if phase == 'idle' and parser.pending_bytes():
+                phase, started = 'header', now
+            if phase == 'header' and parser.waiting_body():
+                phase, started = 'body', now
+
+            remaining = started + self._phase_timeouts[phase] - now
+            if remaining <= 0:
+                self.record_reaped(f'{phase}_timeout')
+                return None
+
+            try:
+                self.socketRequest.settimeout(remaining)
+                received = parser.recv_from(self.socketRequest)
+            except socket.timeout:
+                self.record_reaped(f'{phase}_timeout')
+                return None
+            except OSError as e:
+                print(f"[HTTP Handler] Error: {e}", file=sys.stderr)
+                return None
+
+            if not received:
+                return None
+
+    @property
+    def _phase_timeouts(self):
+        return {'idle': self.keepalive_timeout, 'header': self.header_timeout, 'body': self.body_timeout}
+
+    def record_reaped(self, reason):
+        '''Avisa al servidor de una conexion cerrada por no cumplir un plazo'''
+        if hasattr(self.serverInstance, 'record_reaped'):
+            self.serverInstance.record_reaped(reason)
+
+    def handle_request(self, request):
+        '''
+            Atiende una peticion ya parseada llamando al metodo do_* indicado
+        '''
+        # reiniciar el estado de la peticion anterior en la misma conexion
+        self.headers = {}
+        self.close_connection = True
+        self.requests_handled += 1
+        self.command = self.path = None
+        self.status_code = None
+        started = time.perf_counter()
 
-            # crear un archivo para escribir la respuesta
-            self.wfile = self.socketRequest.makefile('wb')
+        if isinstance(request, HTTPParseError):
+            self.send_error(request.code, request.message)
+            self.record_request(time.perf_counter() - started)
+            return
+
+        try:
+            self.parse_request(request)
+            self.close_connection = not self.wants_keep_alive()
 
             # llamar al metodo indicado
             method_name = f'do_{self.command}'
@@ -91,12 +263,43 @@ class BaseHTTPRequestHandler:
         
         except Exception as e:
             print(f"[HTTP Handler] Error: {e}", file=sys.stderr)
+            self.close_connection = True
+            # descartar la respuesta a medio construir antes de enviar el error
+            self.wfile.take()
+            self._header_lines = []
             try:
                 self.send_error(500, str(e))
             except:
                 pass
 
-    def parse_request(self):
+        self.record_request(time.perf_counter() - started)
+
+    def record_request(self, duration):
+        '''
+            Se llama al terminar cada peticion con el tiempo que tardo el
+            handler (self.status_code tiene el codigo enviado). Las
+            subclases lo usan para sus metricas.
+        '''
+
+    def wants_keep_alive(self):
+        '''
+            HTTP/1.1 mantiene la conexion salvo "Connection: close";
+            HTTP/1.0 solo si el cliente envia "Connection: keep-alive"
+        '''
+        if self.requests_handled >= self.max_keepalive_requests:
+            return False
+
+        # con conexiones esperando worker se libera el hilo tras responder
+        if hasattr(self.serverInstance, 'should_keep_alive') and not self.serverInstance.should_keep_alive():
+            return False
+
+        connection = self.headers.get('Connection', '').lower()
+
+        if self.request_version == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
+
+    def parse_request(self, request):
         '''
 
             Estructura de un Mensaje HTTP
@@ -122,29 +325,16 @@ class BaseHTTPRequestHandler:
             └──────────────────────────────────────────┘
         '''
 
-        try:
-            lines = self.raw_requestline.split('\r\n')
-            self.requestline = lines[0]
-            args = self.requestline.split()
-            if len(args) != 3:
-                return False
-            self.command = args[0]
-            self.path = args[1]
-            self.request_version = args[2]
-
-            for line in lines[1:]:
-                if line == '':
-                    break
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    self.headers[key.strip()] = value.strip()
-            
-            return True
+        # la separacion de linea, headers y body ya la hizo HTTPRequestParser
+        self.requestline = request.requestline
+        self.command = request.command
+        self.path = request.path
+        self.request_version = request.request_version
+        self.headers = request.headers
+
+        # archivo de solo lectura en memoria para el body (exactamente Content-Length bytes)
+        self.rfile = BytesIO(request.body)
 
-        except Exception as e:
-            print(f"[HTTP Parser] Error parseando petición: {e}", file=sys.stderr)
-            return False
-        
     def send_response(self, code, message=None):
         '''
             formato de respuesta http:
@@ -154,15 +344,22 @@ class BaseHTTPRequestHandler:
             4xx: Client Error (400 Bad Request, 404 Not Found)
             5xx: Server Error (500 Internal Error, 503 Unavailable)
         '''
+        self.status_code = code
         if message is None:
-            message = self.responses.get(code, ('Unknown',))[0]
-        
-        response_line = f"HTTP/1.1 {code} {message}\r\n"
-        self.wfile.write(response_line.encode('utf-8'))
+            response_line = self._status_lines.get(code)
+            if response_line is None:
+                response_line = f"HTTP/1.1 {code} Unknown\r\n".encode('utf-8')
+        else:
+            response_line = f"HTTP/1.1 {code} {message}\r\n".encode('utf-8')
 
         # headers de control del servidor
-        self.send_header('Server', 'CaptivePortalHTTP/1.0')
-        self.send_header('Connection', 'close')
+        lines = self._header_lines = [response_line, SERVER_HEADER]
+        if self.close_connection:
+            lines.append(CONNECTION_CLOSE)
+        else:
+            remaining = self.max_keepalive_requests - self.requests_handled
+            lines.append(CONNECTION_KEEP_ALIVE)
+            lines.append(f"Keep-Alive: timeout={self.keepalive_timeout}, max={remaining}\r\n".encode('ascii'))
 
     def send_header(self, keyword, value):
         """    
@@ -170,10 +367,29 @@ class BaseHTTPRequestHandler:
         value: Valor del header
         """
         header_line = f"{keyword}: {value}\r\n"
-        self.wfile.write(header_line.encode('utf-8'))
+        self._header_lines.append(header_line.encode('utf-8'))
+
+    def send_raw_headers(self, header_lines):
+        """Añade headers ya codificados (bytes terminados en CRLF)"""
+        self._header_lines.append(header_lines)
     
     def end_headers(self):
-        self.wfile.write(b"\r\n")
+        # status line y headers se unen en un solo buffer
+        self._header_lines.append(b"\r\n")
+        self.wfile.write(b''.join(self._header_lines))
+        self._header_lines = []
+
+    def flush_response(self):
+        '''
+            Envia todo lo acumulado en wfile con un solo sendmsg. En el event
+            loop no hace nada: el loop recoge wfile al terminar el handler.
+        '''
+        if self.socketRequest is None:
+            return
+        chunks = self.wfile.take()
+        if chunks:
+            self.socketRequest.settimeout(self.write_timeout)
+            send_buffers(self.socketRequest, chunks)
 
     def send_error(self, code, message=None):
 
@@ -182,44 +398,241 @@ class BaseHTTPRequestHandler:
             if message:
                 long_msg = message
             
-            # Ruta al archivo de error
-            file_error_path = os.path.join(self.frontend_path, 'error.html')
+            # error.html viene de la cache con los marcadores ya reemplazados
+            content = self.assets.render_error(code, short_msg, long_msg)
+            if content is None:
+                content = f"{code} {short_msg}: {long_msg}".encode('utf-8')
             
-            # Leer el archivo de error
-            with open(file_error_path, 'r', encoding='utf-8') as file:
-                html_content = file.read()
-            
-            # Reemplazar los marcadores con los valores reales
-            html_content = html_content.replace('ERROR_CODE', str(code))
-            html_content = html_content.replace('ERROR_TITLE', short_msg)
-            html_content = html_content.replace('ERROR_MESSAGE', long_msg)
-            
-            # Enviar la respuesta
+            # Enviar la respuesta (comprimida si el cliente acepta gzip y compensa)
+            encoding = None
+            negotiable = len(content) >= self.dynamic_gzip_min_size
+            if negotiable and self.accepts_gzip():
+                content = gzip_bytes(content, self.dynamic_gzip_level)
+                encoding = 'gzip'
+
             self.send_response(code)
             self.send_header('Content-Type', 'text/html; charset=utf-8')
-            self.send_header('Content-Length', str(len(html_content.encode('utf-8'))))
+            self.send_header('Content-Length', str(len(content)))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            if negotiable:
+                self.send_header('Vary', 'Accept-Encoding')
             self.end_headers()
-            self.wfile.write(html_content.encode('utf-8'))
+            if getattr(self, '_send_body', True):
+                self.wfile.write(content)
             
         except Exception as e:
             pass
 
+    def send_asset(self, asset):
+        '''
+            Envia un archivo de la cache respondiendo 304 si el cliente ya
+            tiene la misma version (If-None-Match / If-Modified-Since).
+            Si existe variante gzip y el cliente la acepta, se envia esa.
+            Un Range de un solo intervalo se responde con 206.
+        '''
+        byte_range = self.parse_range(asset)
+        use_gzip = byte_range is None and asset.gzip_body is not None and self.accepts_gzip()
+        etag = asset.gzip_etag if use_gzip else asset.etag
+
+        if self.is_not_modified(asset, etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', asset.last_modified)
+            self.send_header('Cache-Control', 'no-cache')
+            if asset.gzip_body is not None:
+                self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{asset.size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if byte_range is None:
+            offset, length = 0, asset.size
+            body = asset.gzip_body if use_gzip else asset.body
+            if body is not None:
+                length = len(body)
+            self.send_response(200)
+        else:
+            offset, length = byte_range
+            body = asset.body
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {offset}-{offset + length - 1}/{asset.size}')
+
+        self.send_header('Content-Type', asset.mime_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        if asset.gzip_body is not None:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', asset.last_modified)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        if not getattr(self, '_send_body', True):
+            return
+        if body is not None:
+            self.wfile.write(memoryview(body)[offset:offset + length])
+        else:
+            self.send_file(asset.path, offset, length)
+
+    def send_file(self, path, offset, length):
+        '''
+            Envia un tramo de un archivo sin pasarlo por memoria de Python:
+            con sockets bloqueantes se usa socket.sendfile; en el event loop
+            el envio queda pendiente para que el loop lo haga con os.sendfile
+        '''
+        if self.socketRequest is None:
+            self.pending_file = (path, offset, length)
+            return
+
+        self.flush_response() # los headers deben salir antes que el archivo
+        self.socketRequest.settimeout(self.write_timeout)
+        with open(path, 'rb') as file:
+            sent = self.socketRequest.sendfile(file, offset, length)
+        if sent != length:
+            # el archivo cambio de tamaño: la respuesta quedo mal delimitada
+            self.close_connection = True
+
+    def parse_range(self, asset):
+        '''
+            Interpreta "Range: bytes=..." (RFC 9110 14.2) para un solo
+            intervalo. Devuelve (offset, length), None si se debe enviar el
+            archivo completo o False si el intervalo no es satisfacible.
+        '''
+        header = self.headers.get('Range')
+        if not header or self.command not in ('GET', 'HEAD'):
+            return None
+
+        # If-Range: solo se respeta el Range si el cliente tiene esta version
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range.strip() not in (asset.etag, asset.last_modified):
+            return None
+
+        unit, _, spec = header.partition('=')
+        if unit.strip().lower() != 'bytes' or ',' in spec:
+            return None # varios intervalos: se envia el archivo completo
+
+        first, sep, last = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first == '':
+                suffix = int(last)
+                if suffix <= 0:
+                    return False
+                start = max(0, asset.size - suffix)
+                end = asset.size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else asset.size - 1
+        except ValueError:
+            return None
+
+        if start >= asset.size:
+            return False
+        if start > end:
+            return None # intervalo mal formado: se ignora
+
+        end = min(end, asset.size - 1)
+        return start, end - start + 1
+
+    def accepts_gzip(self):
+        '''
+            Negociacion de Accept-Encoding (RFC 9110 12.5.3): gzip o * con q > 0
+        '''
+        accept = self.headers.get('Accept-Encoding')
+        if not accept:
+            return False
+
+        wildcard = False
+        for item in accept.split(','):
+            coding, _, params = item.partition(';')
+            coding = coding.strip().lower()
+            if coding not in ('gzip', 'x-gzip', '*'):
+                continue
+
+            quality = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+
+            if coding == '*':
+                wildcard = quality > 0
+            else:
+                return quality > 0
+        return wildcard
+
+    def is_not_modified(self, asset, etag):
+        '''
+            Validacion condicional (RFC 9110 13.1): If-None-Match tiene
+            prioridad sobre If-Modified-Since
+        '''
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            if if_none_match.strip() == '*':
+                return True
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                if tag.startswith('W/'):
+                    tag = tag[2:]
+                if tag == etag:
+                    return True
+            return False
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(asset.mtime) <= since
+
+        return False
+
     responses = {
         200: ('OK', 'Solicitud exitosa'),
         201: ('Creado', 'Recurso creado exitosamente'),
         204: ('Sin Contenido', 'Solicitud exitosa sin contenido que devolver'),
         301: ('Movido Permanentemente', 'El recurso ha sido movido permanentemente'),
+        206: ('Contenido Parcial', 'Se envía solo el intervalo solicitado'),
         302: ('Encontrado', 'El recurso ha sido movido temporalmente'),
+        304: ('No Modificado', 'El recurso no ha cambiado desde la última petición'),
         400: ('Solicitud Incorrecta', 'El servidor no pudo entender la solicitud'),
         401: ('No Autorizado', 'Debe autenticarse para acceder a este recurso'),
         403: ('Prohibido', 'No tiene permisos para acceder a este recurso'),
         404: ('No Encontrado', 'La página que está buscando no existe'),
         405: ('Método No Permitido', 'Método HTTP no permitido para esta ruta'),
+        413: ('Contenido Demasiado Grande', 'El cuerpo de la petición excede el límite permitido'),
+        416: ('Rango No Satisfacible', 'El intervalo solicitado está fuera del archivo'),
+        431: ('Headers Demasiado Grandes', 'Los headers de la petición exceden el límite permitido'),
         500: ('Error Interno del Servidor', 'El servidor encontró un error inesperado'),
         502: ('Gateway Incorrecto', 'El servidor recibió una respuesta inválida'),
+        501: ('No Implementado', 'El servidor no soporta la funcionalidad requerida'),
         503: ('Servicio No Disponible', 'El servidor no está disponible temporalmente'),
     }
     
+    # Status lines pre-codificadas: HTTP/1.1 <code> <mensaje>\r\n
+    _status_lines = {code: f"HTTP/1.1 {code} {texts[0]}\r\n".encode('utf-8') for code, texts in responses.items()}
+
+    def do_HEAD(self):
+        """Igual que GET pero sin enviar el cuerpo"""
+        self._send_body = False
+        try:
+            self.do_GET()
+        finally:
+            self._send_body = True
+
     # Métodos a implementar en subclase ServerCaptivePortal
     def do_GET(self):
         """Maneja peticiones GET (debe implementarse en subclase)"""
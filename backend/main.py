@@ -1,8 +1,10 @@
 from authService import AuthService
+from sqliteAuthService import SqliteAuthService
 from firewallManager import FirewallManager
 import serverManager
 import sys
 from sessionsManager import NetworkSessionManager
+from sessionStore import SessionStore
 
 '''
 ┌─────────────────────────────────────────────────────────┐
@@ -71,36 +73,64 @@ from sessionsManager import NetworkSessionManager
                           │
           (Thread termina, servidor sigue aceptando)
 '''
+SESSION_TIMEOUT = 30 * 60
+RECONCILE_INTERVAL = 60
+
 class CaptivePortal:
-    def __init__(self, port, internet_iface, local_iface):
+    def __init__(self, port, internet_iface, local_iface, engine='threads', processes=1, firewall_backend='iptables',
+                 users_backend='json'):
 
         self.internet_iface = internet_iface
         self.local_iface = local_iface
         self.portal_port = port
+        self.engine = engine
+        self.processes = processes
 
         print("[Main] Inicializando Portal Cautivo...")
 
-        self.auth_manager = AuthService(data='dataUsers.json')
+        if users_backend == 'sqlite':
+            # el primer arranque con SQLite importa los usuarios de dataUsers.json
+            self.auth_manager = SqliteAuthService('users.db', import_from='dataUsers.json')
+        else:
+            self.auth_manager = AuthService(data='dataUsers.json')
         print("[Main] AuthManager inicializado")
 
-        self.firewall_manager = FirewallManager(self.internet_iface, self.local_iface, str(self.portal_port))
-        if self.firewall_manager.setup_captive_portal():
-                print("Firewall configurado correctamente")
-        else:
-                print("Error al configurar el firewall")
+        self.firewall_manager = FirewallManager(self.internet_iface, self.local_iface, str(self.portal_port),
+                                                backend=firewall_backend, session_timeout=SESSION_TIMEOUT)
         self.http_server = None
 
+        # Las sesiones sobreviven a un reinicio del portal (sessions.snapshot + sessions.wal).
+        # Se recuperan antes de tocar el firewall: asi este se arma de una vez con
+        # la politica base y las sesiones vigentes, sin cortar a nadie
         self.sessions_manager = NetworkSessionManager(
-            firewall_manager=self.firewall_manager
+            firewall_manager=self.firewall_manager,
+            timeout=SESSION_TIMEOUT,
+            store=SessionStore('sessions')
         )
 
+        if self.firewall_manager.warm_start():
+                print("Firewall configurado correctamente")
+        else:
+                print("Error al configurar el firewall")
+
+        self.firewall_manager.start_reconciler(RECONCILE_INTERVAL)
+
     def start(self):
         print("[Main] Iniciando servidor HTTP...")
-        serverManager.start(self.auth_manager, self.sessions_manager, port= self.portal_port)
+        serverManager.start(self.auth_manager, self.sessions_manager, port= self.portal_port, engine=self.engine,
+                            processes=self.processes)
         
 
 if __name__ == '__main__':
     params= sys.argv[1:]  
 
-    portal = CaptivePortal(int(params[0]), params[1], params[2])
+    # Uso: python3 main.py <PUERTO> <IFACE_INTERNET> <IFACE_LOCAL> [threads|async] [PROCESOS] [iptables|ipset|nftables]
+    #                      [json|sqlite]
+    engine = params[3] if len(params) > 3 else 'threads'
+    processes = int(params[4]) if len(params) > 4 else 1
+    firewall_backend = params[5] if len(params) > 5 else 'iptables'
+    users_backend = params[6] if len(params) > 6 else 'json'
+
+    portal = CaptivePortal(int(params[0]), params[1], params[2], engine=engine, processes=processes,
+                           firewall_backend=firewall_backend, users_backend=users_backend)
     portal.start()
@@ -0,0 +1,272 @@
+import os
+import bisect
+import weakref
+import threading
+'''
+Registro de metricas en memoria con formato de exposicion de Prometheus.
+
+    REGISTRY.counter(...)    contador que solo crece (peticiones, logins)
+    REGISTRY.gauge(...)      valor que sube y baja, o que se calcula al leerlo
+    REGISTRY.histogram(...)  distribucion de duraciones en buckets fijos
+    REGISTRY.register_stats(prefijo, get_stats)
+                             publica como gauges los get_stats() existentes
+                             (pool de hilos, cola del firewall, cache ARP)
+
+Cada serie (metrica + valores de sus etiquetas) tiene su propio lock, que
+solo se toma para sumar un numero: registrar una observacion no bloquea a
+las demas series ni recorre las sesiones. El texto se arma solo cuando se
+consulta /metrics.
+
+En modo pre-fork un worker puede nacer (o renacer) mientras un hilo del
+supervisor tiene tomado alguno de estos locks: el registro los rehace en
+el hijo tras cada fork.
+'''
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, labels):
+        return [('', labels, self.value)]
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # el ultimo es +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + ('+Inf',), counts):
+            cumulative += count
+            result.append(('_bucket', labels + (('le', _format_bound(bound)),), cumulative))
+        result.append(('_sum', labels, total))
+        result.append(('_count', labels, cumulative))
+        return result
+
+
+def _format_bound(bound):
+    return bound if isinstance(bound, str) else repr(float(bound))
+
+
+class Metric:
+    '''
+        Una familia de series con el mismo nombre. Sin etiquetas se usa
+        directamente (metric.inc()); con etiquetas se elige la serie con
+        metric.labels(valor1, valor2).inc().
+    '''
+
+    def __init__(self, name, help, kind, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(float(b) for b in buckets)
+        self.function = None
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        if self.kind == 'histogram':
+            return _HistogramChild(self.buckets)
+        if self.kind == 'gauge':
+            return _GaugeChild()
+        return _CounterChild()
+
+    def labels(self, *values):
+        key = tuple(map(str, values))
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    # atajos para metricas sin etiquetas
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def set_function(self, function):
+        '''El valor del gauge se calcula al leer /metrics (p. ej. len(sesiones))'''
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            return [('', (), self.function())]
+        result = []
+        for values, child in list(self._children.items()):
+            result.extend(child.samples(tuple(zip(self.labelnames, values))))
+        return result
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._stats = {}  # prefijo -> (ayuda, funcion get_stats)
+        self._lock = threading.Lock()
+
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._reset_locks_after_fork())
+
+    def _reset_locks_after_fork(self):
+        '''En el hijo solo corre el hilo que hizo fork: ningun lock puede seguir tomado'''
+        self._lock = threading.Lock()
+        for metric in self._metrics.values():
+            metric._lock = threading.Lock()
+            for child in metric._children.values():
+                child._lock = threading.Lock()
+
+    def _get_or_create(self, name, help, kind, labelnames=(), **options):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(name, help, kind, labelnames, **options)
+            elif metric.kind != kind or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"La métrica {name} ya existe con otro tipo o etiquetas")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(name, help, 'counter', labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get_or_create(name, help, 'gauge', labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(name, help, 'histogram', labelnames, buckets=buckets)
+
+    def register_stats(self, prefix, help, get_stats):
+        '''Cada valor numerico de get_stats() se publica como gauge <prefix>_<clave>'''
+        with self._lock:
+            self._stats[prefix] = (help, get_stats)
+
+    def reset(self):
+        '''
+            Vuelve todas las series a cero y olvida los valores calculados al
+            leer. Un worker pre-fork hereda las series del supervisor y
+            funciones que apuntan a copias de su estado: empieza de cero y
+            esos valores los aporta el supervisor.
+        '''
+        with self._lock:
+            self._stats.clear()
+            for metric in self._metrics.values():
+                metric.function = None
+                metric._children = {}
+
+    def collect(self):
+        '''
+            Lista de familias (nombre, tipo, ayuda, muestras); son datos
+            simples para poder enviarlos por RPC desde el supervisor
+        '''
+        with self._lock:
+            metrics = list(self._metrics.values())
+            stats = list(self._stats.items())
+
+        families = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                continue
+            families.append((metric.name, metric.kind, metric.help, samples))
+
+        for prefix, (help, get_stats) in stats:
+            try:
+                values = get_stats()
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    families.append((f"{prefix}_{key}", 'gauge', f"{help} ({key})", [('', (), value)]))
+        return families
+
+    def render(self, extra=()):
+        '''
+            Texto en formato de exposicion de Prometheus. `extra` son familias
+            de otro proceso (collect() del supervisor): las series con el
+            mismo nombre y etiquetas se suman.
+        '''
+        merged = {}
+        for name, kind, help, samples in list(self.collect()) + list(extra):
+            family = merged.get(name)
+            if family is None:
+                family = merged[name] = (kind, help, {})
+            series = family[2]
+            for suffix, labels, value in samples:
+                key = (suffix, tuple(labels))
+                series[key] = series.get(key, 0) + value
+
+        lines = []
+        for name, (kind, help, series) in merged.items():
+            lines.append(f"# HELP {name} {_escape_help(help)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (suffix, labels), value in series.items():
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Registro del proceso
+REGISTRY = MetricsRegistry()
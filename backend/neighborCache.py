@@ -0,0 +1,184 @@
+import os
+import time
+import subprocess
+import weakref
+import threading
+from metrics import REGISTRY
+'''
+Cache de la tabla de vecinos (ARP) para obtener la MAC de un cliente.
+
+En lugar de ejecutar `ip neigh show <ip>` en cada peticion, la tabla completa
+se lee de una vez de /proc/net/arp (sin fork) y se guarda en un dict. Un hilo
+la recarga en segundo plano cada refresh_interval, asi las consultas casi
+siempre encuentran una tabla reciente.
+
+    lookup(ip) ──→ tabla fresca y la IP esta ──→ MAC          (hit)
+                   │
+                   └─ si no ──→ recargar (una sola recarga a la vez; los
+                                demas hilos esperan esa misma) ──→ MAC (miss)
+
+Si el archivo no existe (no es Linux) se parsea un unico volcado de
+`ip neigh show` por recarga.
+'''
+
+UNKNOWN_MAC = "00:00:00:00:00:00"
+
+ARP_FLAG_COMPLETE = 0x2
+
+LOOKUP_SECONDS = REGISTRY.histogram('portal_arp_lookup_seconds', 'Tiempo para obtener la MAC de un cliente',
+                                    ('result',), buckets=(1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5))
+
+
+def parse_proc_arp(text):
+    '''
+        Parsea el contenido de /proc/net/arp -> {ip: MAC en mayusculas}.
+        Las entradas incompletas (sin respuesta ARP) se ignoran.
+    '''
+    table = {}
+    for line in text.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) < 4:
+            continue
+        ip, _, flags, mac = parts[:4]
+        try:
+            if not int(flags, 16) & ARP_FLAG_COMPLETE:
+                continue
+        except ValueError:
+            continue
+        if mac != UNKNOWN_MAC:
+            table[ip] = mac.upper()
+    return table
+
+
+def parse_ip_neigh(text):
+    '''Parsea la salida de `ip neigh show` -> {ip: MAC en mayusculas}'''
+    table = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if "lladdr" not in parts or "FAILED" in parts or "INCOMPLETE" in parts:
+            continue
+        idx = parts.index("lladdr")
+        if idx + 1 < len(parts):
+            table[parts[0]] = parts[idx + 1].upper()
+    return table
+
+
+class NeighborCache:
+
+    def __init__(self, source='/proc/net/arp', ttl=2.0, refresh_interval=1.0, min_reload_interval=0.2):
+        """
+        source: archivo con formato /proc/net/arp (inyectable para pruebas)
+        ttl: antiguedad maxima de la tabla para responder sin recargar
+        refresh_interval: cada cuanto la recarga el hilo de fondo (0 = sin hilo)
+        min_reload_interval: tras una recarga, una IP que no aparece no
+                             provoca otra hasta pasado este tiempo
+        """
+        self.source = source
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.min_reload_interval = min_reload_interval
+
+        self._table = {}
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._stats = dict.fromkeys(('hits', 'misses', 'reloads', 'coalesced', 'errors'), 0)
+        self._reset_after_fork()
+
+        # Tras un fork (modo pre-fork) el hilo de refresco no existe en el hijo
+        # y un lock podria haber quedado tomado: se rehacen en el hijo
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._reset_after_fork())
+
+    def _reset_after_fork(self):
+        self._reload_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _ensure_refresher(self):
+        '''Arranca el hilo de refresco en la primera consulta de cada proceso'''
+        with self._start_lock:
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._refresh_loop, name="neighbor-cache", daemon=True)
+                self._thread.start()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    # Carga de la tabla
+
+    def _read_table(self):
+        try:
+            with open(self.source, encoding='ascii', errors='replace') as file:
+                return parse_proc_arp(file.read())
+        except FileNotFoundError:
+            result = subprocess.run(['ip', 'neigh', 'show'], capture_output=True, text=True, timeout=3)
+            return parse_ip_neigh(result.stdout)
+
+    def reload(self):
+        '''Vuelve a leer la tabla completa'''
+        try:
+            table = self._read_table()
+        except Exception as e:
+            self._count('errors')
+            print(f"⚠️ Error leyendo la tabla de vecinos: {e}")
+            return False
+        self._table = table  # se reemplaza el dict entero: los lectores nunca ven uno a medias
+        self._loaded_at = time.monotonic()
+        self._generation += 1
+        self._count('reloads')
+        return True
+
+    def _reload_for_miss(self, generation):
+        '''
+            Recarga por un miss. Si mientras se esperaba el lock otro hilo ya
+            recargo (cambio la generacion) o la tabla es de hace menos de
+            min_reload_interval, se usa esa carga.
+        '''
+        with self._reload_lock:
+            recent = self._loaded_at and time.monotonic() - self._loaded_at < self.min_reload_interval
+            if self._generation != generation or recent:
+                self._count('coalesced')
+                return
+            self.reload()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            with self._reload_lock:
+                self.reload()
+
+    # Consultas
+
+    def lookup(self, ip):
+        '''MAC del vecino con esa IP o "00:00:00:00:00:00" si no se conoce'''
+        if self._thread is None and self.refresh_interval > 0:
+            self._ensure_refresher()
+
+        started = time.perf_counter()
+        generation = self._generation
+        if time.monotonic() - self._loaded_at < self.ttl:
+            mac = self._table.get(ip)
+            if mac is not None:
+                self._count('hits')
+                LOOKUP_SECONDS.labels('hit').observe(time.perf_counter() - started)
+                return mac
+
+        self._count('misses')
+        self._reload_for_miss(generation)
+        LOOKUP_SECONDS.labels('miss').observe(time.perf_counter() - started)
+        return self._table.get(ip, UNKNOWN_MAC)
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['entries'] = len(self._table)
+        stats['age'] = round(time.monotonic() - self._loaded_at, 3) if self._loaded_at else None
+        return stats
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
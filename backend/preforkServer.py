@@ -0,0 +1,219 @@
+import os
+import sys
+import time
+import signal
+import tempfile
+import threading
+from multiprocessing.connection import Listener, Client
+'''
+Modo pre-fork: N procesos worker atienden HTTP en el mismo puerto
+(SO_REUSEPORT, el kernel reparte las conexiones) y un supervisor los vigila.
+
+                    ┌──────────── supervisor ────────────┐
+                    │  NetworkSessionManager + firewall  │
+                    │  AuthService                       │
+                    │  ServiceOwner (socket unix) ◄──────┼─── RPC
+                    └───┬──────────┬──────────┬──────────┘      │
+                   fork │          │          │                 │
+                    worker 1   worker 2   worker N  ────────────┘
+                    :8080      :8080      :8080   (SO_REUSEPORT)
+
+El estado compartido (sesiones, reglas del firewall y usuarios) tiene un
+unico dueño: el supervisor. Los workers lo consultan y modifican con
+llamadas a traves de un socket unix, asi que todos ven lo mismo.
+'''
+
+class ServiceOwner:
+    '''
+        Expone objetos del supervisor a los workers. Cada conexion de un
+        worker se atiende en su propio hilo; solo se pueden llamar los
+        metodos declarados en `exposed`.
+    '''
+
+    def __init__(self, services, exposed):
+        """
+        services: {nombre: objeto}
+        exposed: {nombre: conjunto de metodos que se pueden llamar}
+        """
+        self.services = services
+        self.exposed = exposed
+        self.authkey = os.urandom(32)
+        self._dir = tempfile.mkdtemp(prefix='captive-portal-')
+        self.address = os.path.join(self._dir, 'owner.sock')
+        self.listener = None
+        self.running = False
+
+    def start(self):
+        self.listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        self.running = True
+        threading.Thread(target=self._accept_loop, name="service-owner", daemon=True).start()
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                if self.running:
+                    print(f"[ServiceOwner] Error aceptando worker: {e}", file=sys.stderr)
+                continue
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    service, method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                if method not in self.exposed.get(service, ()):
+                    conn.send(('error', f"Método no expuesto: {service}.{method}"))
+                    continue
+
+                try:
+                    result = getattr(self.services[service], method)(*args)
+                    conn.send(('ok', result))
+                except Exception as e:
+                    conn.send(('error', f"{type(e).__name__}: {e}"))
+
+    def close(self):
+        self.running = False
+        if self.listener:
+            try:
+                self.listener.close()
+            except OSError:
+                pass
+        try:
+            os.rmdir(self._dir)
+        except OSError:
+            pass
+
+
+class RemoteService:
+    '''
+        Proxy en el worker de un servicio del supervisor. Cada hilo del
+        worker usa su propia conexion para no serializar las peticiones.
+    '''
+
+    def __init__(self, address, authkey, service, exposed):
+        self._address = address
+        self._authkey = authkey
+        self._service = service
+        self._exposed = exposed
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self._address, family='AF_UNIX', authkey=self._authkey)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, method, *args):
+        conn = self._connection()
+        try:
+            conn.send((self._service, method, args))
+            status, result = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise
+        if status != 'ok':
+            raise RuntimeError(result)
+        return result
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._exposed:
+            raise AttributeError(name)
+        return lambda *args: self._call(name, *args)
+
+
+class RemoteSessionsManager(RemoteService):
+    '''
+        Proxy del NetworkSessionManager. La lectura de la MAC (tabla ARP del
+        propio host) y el formateo de tiempos se hacen en el worker; todo lo
+        que cambia sesiones o firewall pasa por el supervisor.
+    '''
+
+    def __init__(self, address, authkey, sessionsManager, exposed):
+        super().__init__(address, authkey, 'sessions', exposed)
+        self._manager = sessionsManager
+        self.session_timeout = sessionsManager.session_timeout
+
+    def get_client_mac(self, client_ip):
+        return self._manager.get_client_mac(client_ip)
+
+    def _format_time(self, seconds):
+        return self._manager._format_time(seconds)
+
+
+class PreforkSupervisor:
+
+    def __init__(self, run_worker, processes, restart_delay=1.0):
+        """
+        run_worker: funcion que ejecuta un worker (recibe su indice)
+        processes: numero de procesos worker
+        restart_delay: espera antes de relanzar un worker caido
+        """
+        self.run_worker = run_worker
+        self.processes = processes
+        self.restart_delay = restart_delay
+        self.workers = {}  # pid -> indice
+        self.stopping = False
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            # proceso worker: señales por defecto y nunca volver al codigo del supervisor
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            code = 0
+            try:
+                self.run_worker(index)
+            except KeyboardInterrupt:
+                pass
+            except BaseException as e:
+                print(f"[Prefork] Worker {index} terminó con error: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+        self.workers[pid] = index
+        print(f"[Prefork] Worker {index} iniciado (PID {pid})")
+
+    def _shutdown(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def serve_forever(self):
+        previous = {sig: signal.signal(sig, self._shutdown) for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            for index in range(self.processes):
+                self._spawn(index)
+
+            while self.workers:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                except InterruptedError:
+                    continue
+
+                index = self.workers.pop(pid, None)
+                if index is None or self.stopping:
+                    continue
+
+                print(f"[Prefork] Worker {index} (PID {pid}) terminó inesperadamente "
+                      f"(estado {status}), relanzando...", file=sys.stderr)
+                time.sleep(self.restart_delay)
+                if not self.stopping:
+                    self._spawn(index)
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+            print("[Prefork] Todos los workers detenidos")
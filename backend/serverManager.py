@@ -1,10 +1,17 @@
 from threadingTCPServer import ThreadingTCPServer
+from asyncServer import SelectorTCPServer
+from preforkServer import PreforkSupervisor, ServiceOwner, RemoteService, RemoteSessionsManager
 from httpServer import BaseHTTPRequestHandler
+from metrics import REGISTRY
 from urllib.parse import urlparse, parse_qs, unquote
-import os
-import mimetypes
 import sys
 
+HTTP_REQUESTS = REGISTRY.counter('portal_http_requests_total', 'Peticiones HTTP atendidas',
+                                 ('method', 'route', 'status'))
+HTTP_DURATION = REGISTRY.histogram('portal_http_request_duration_seconds',
+                                   'Tiempo del handler por peticion', ('route',))
+LOGINS = REGISTRY.counter('portal_logins_total', 'Intentos de login', ('result',))
+
 class ServerCaptivePortal(BaseHTTPRequestHandler):
     authService = None
     sessionsManager = None
@@ -21,6 +28,11 @@ class ServerCaptivePortal(BaseHTTPRequestHandler):
     public_routes = {'/', '/index', '/login', '/registro'}
     private_routes = {'/exito', '/logout'}
 
+    # /metrics solo responde a estas IPs (el administrador, no los clientes de la red local)
+    metrics_path = '/metrics'
+    metrics_allowed_ips = {'127.0.0.1', '::1'}
+    remote_metrics = None  # en modo pre-fork: metricas del supervisor por RPC
+
     def do_GET(self):
         '''
             Cliente → Servidor:
@@ -51,7 +63,9 @@ class ServerCaptivePortal(BaseHTTPRequestHandler):
         path_only = parsed_path.path or '/'
         client_ip = self.clientAddress[0]
 
-        print(f"[{client_ip}] {self.command} {path_only}", file=sys.stderr)
+        if path_only == self.metrics_path and client_ip in self.metrics_allowed_ips:
+            self.serve_metrics()
+            return
 
         if path_only == '/logout':
             self.handle_logout(client_ip)
@@ -87,6 +101,33 @@ class ServerCaptivePortal(BaseHTTPRequestHandler):
         if not is_authenticated: 
             self.send_redirect('/login')
 
+    def serve_metrics(self):
+        '''Metricas en formato de exposicion de Prometheus'''
+        extra = self.remote_metrics.collect() if self.remote_metrics else ()
+        body = REGISTRY.render(extra).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if getattr(self, '_send_body', True):
+            self.wfile.write(body)
+
+    def route_label(self):
+        '''Ruta para las metricas: solo valores conocidos, nunca la URL del cliente'''
+        if self.path is None:
+            return 'invalida'
+        path_only = urlparse(self.path).path or '/'
+        if path_only in self.route_files or path_only == self.metrics_path:
+            return path_only
+        if self.is_static_file(path_only):
+            return 'estatico'
+        return 'otra'
+
+    def record_request(self, duration):
+        route = self.route_label()
+        HTTP_REQUESTS.labels(self.command or '-', route, self.status_code or 0).inc()
+        HTTP_DURATION.labels(route).observe(duration)
+
     def serve_route(self, path):    
 
         # Obtener el archivo correspondiente
@@ -96,16 +137,8 @@ class ServerCaptivePortal(BaseHTTPRequestHandler):
             self.send_error(404, "Ruta no válida")
             return
         
-        # Construir ruta completa
-        filepath = os.path.join(self.frontend_path, filename)
-        
-        # Verificar que el archivo existe
-        if not os.path.exists(filepath):
-            self.send_error(404, f"Archivo {filename} no encontrado")
-            return
-        
         # Servir el archivo
-        self.serve_html_file(filepath)
+        self.serve_html_file(filename)
         return
 
     def do_POST(self):
@@ -142,6 +175,9 @@ class ServerCaptivePortal(BaseHTTPRequestHandler):
             self.send_error(405, "Método POST no permitido para esta ruta")
             return
 
+        if parsed_path.path == '/login':
+            LOGINS.labels('exito' if result['status'] == 'success' else 'fallo').inc()
+
         if result['status'] == 'success':
 
             username = result.get('username')
@@ -158,6 +194,9 @@ class ServerCaptivePortal(BaseHTTPRequestHandler):
                     success = self.sessionsManager.create_session(client_ip, username, client_mac)
                     if success:
                         print(f"✅ Sesión creada: {username} - IP: {client_ip} - MAC: {client_mac}")
+                        # el navegador necesita salida a internet al seguir el redirect
+                        if not self.sessionsManager.wait_for_firewall(client_ip):
+                            print(f"⚠️ El firewall aún no refleja la sesión de {client_ip}")
                     else:
                         print(f"❌ Error creando sesión para {username}")
                         self.send_redirect('/login?error=session_failed')
@@ -178,14 +217,14 @@ class ServerCaptivePortal(BaseHTTPRequestHandler):
 
     def handle_logout(self, client_ip):
         '''Maneja el cierre de sesión'''
-        if self.sessionsManager:
+        if self.sessionsManager and self.command == 'GET': # HEAD no debe cerrar la sesión
             self.sessionsManager.terminate_session(client_ip)
         
         self.send_redirect('/login')
         return
 
     def login(self):
-        content_length = int(self.headers['Content-Length'])
+        content_length = int(self.headers.get('Content-Length', 0))
         post_data = self.rfile.read(content_length).decode()
         data = {}
         for item in post_data.split('&'):
@@ -200,7 +239,7 @@ class ServerCaptivePortal(BaseHTTPRequestHandler):
         return self.authService.validate_user(username, password)
     
     def register(self):
-        content_length = int(self.headers['Content-Length'])
+        content_length = int(self.headers.get('Content-Length', 0))
         post_data = self.rfile.read(content_length).decode()
         data = {}
         for item in post_data.split('&'):
@@ -215,10 +254,18 @@ class ServerCaptivePortal(BaseHTTPRequestHandler):
         # Registrar usuario con authService
         return self.authService.register_user(username, email, password)
     
+    # Headers de redirecciones fijas (sin query string) ya codificados
+    _redirect_headers = {}
+
     def send_redirect(self, location):
         """Envía una redirección HTTP 302"""
         self.send_response(302)
-        self.send_header('Location', location)
+        headers = self._redirect_headers.get(location)
+        if headers is None:
+            headers = f"Location: {location}\r\nContent-Length: 0\r\n".encode('utf-8')
+            if '?' not in location:
+                self._redirect_headers[location] = headers
+        self.send_raw_headers(headers)
         self.end_headers()
     
     def is_static_file(self, path):
@@ -227,52 +274,108 @@ class ServerCaptivePortal(BaseHTTPRequestHandler):
         return any(path.lower().endswith(ext) for ext in static_extensions)
 
     def serve_static_file(self, path):
-        """Sirve archivos estáticos (imágenes, CSS, etc.)"""
+        """Sirve archivos estáticos (imágenes, CSS, etc.) desde la cache"""
         try:
             # Quita la barra inicial del path
             clean_path = path[1:] if path.startswith('/') else path
-            file_path = os.path.join(self.frontend_path, clean_path)
+            asset = self.assets.get(clean_path)
             
             # Verifica que el archivo existe
-            if not os.path.exists(file_path):
+            if asset is None:
                 self.send_error(404, f"Archivo no encontrado: {clean_path}")
                 return
             
-            # Determina el tipo MIME
-            mime_type, _ = mimetypes.guess_type(file_path)
-            if mime_type is None:
-                mime_type = 'application/octet-stream'
-            
-            # Lee y sirve el archivo en modo binario
-            with open(file_path, 'rb') as file:
-                content = file.read()
-            
-            self.send_response(200)
-            self.send_header('Content-type', mime_type)
-            self.send_header('Content-Length', str(len(content)))
-            self.end_headers()
-            if getattr(self, '_send_body', True):
-                self.wfile.write(content)
+            self.send_asset(asset)
             
         except Exception as e:
             self.send_error(500, f"Error al leer el archivo estático: {str(e)}")
 
-    def serve_html_file(self, filepath):
+    def serve_html_file(self, filename):
         try:
-            with open(filepath, 'r', encoding='utf-8') as file:
-                html_content = file.read()
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(html_content.encode('utf-8'))
+            asset = self.assets.get(filename)
+            if asset is None:
+                self.send_error(404, f"Archivo {filename} no encontrado")
+                return
+            self.send_asset(asset)
         except Exception as e:
             self.send_error(500, f"Error al leer el archivo: {str(e)}")
 
-def start(authService, sessionsManager, port=8080):
+# Metodos que los workers pre-fork pueden llamar en el supervisor
+OWNER_EXPOSED = {
+    'sessions': {'is_authenticated', 'create_session', 'terminate_session', 'wait_for_firewall'},
+    'auth': {'validate_user', 'register_user'},
+    'metrics': {'collect'},
+}
+
+def create_server(port, engine='threads', max_workers=32, queue_size=128, backlog=128, reuse_port=False,
+                  max_connections_per_ip=16):
+    '''
+        engine: 'threads' (pool de hilos) o 'async' (event loop con selectors)
+        max_connections_per_ip: conexiones simultaneas por cliente (0 = sin limite)
+    '''
+    if engine == 'async':
+        server = SelectorTCPServer(("", port), ServerCaptivePortal, max_workers=max_workers,
+                                   backlog=backlog, reuse_port=reuse_port,
+                                   max_connections_per_ip=max_connections_per_ip)
+    elif engine == 'threads':
+        server = ThreadingTCPServer(("", port), ServerCaptivePortal, max_workers=max_workers,
+                                    queue_size=queue_size, backlog=backlog, reuse_port=reuse_port,
+                                    max_connections_per_ip=max_connections_per_ip)
+    else:
+        raise ValueError(f"Motor de servidor desconocido: {engine}")
+    REGISTRY.register_stats('portal_server', 'Estado del servidor HTTP', server.get_stats)
+    return server
+
+def start(authService, sessionsManager, port=8080, engine='threads', max_workers=32, queue_size=128, backlog=128,
+          processes=1, max_connections_per_ip=16):
+    '''
+        engine: 'threads' (pool de hilos) o 'async' (event loop con selectors)
+        processes: con mas de 1 se usa el modo pre-fork (un servidor `engine`
+                   por proceso, todos en el mismo puerto con SO_REUSEPORT)
+        max_connections_per_ip: conexiones simultaneas por cliente en cada
+                                proceso (0 = sin limite)
+    '''
 
     ServerCaptivePortal.authService = authService
     ServerCaptivePortal.sessionsManager = sessionsManager
 
-    with ThreadingTCPServer(("", port), ServerCaptivePortal) as httpd:
-        print(f"Servidor HTTP corriendo en puerto {port}")
+    # se carga antes del fork para que los workers compartan estas paginas
+    loaded = ServerCaptivePortal.assets.preload()
+    print(f"Frontend cargado en memoria: {loaded} archivos")
+
+    if processes > 1:
+        return start_prefork(authService, sessionsManager, port, engine, processes,
+                             max_workers=max_workers, queue_size=queue_size, backlog=backlog,
+                             max_connections_per_ip=max_connections_per_ip)
+
+    with create_server(port, engine, max_workers, queue_size, backlog,
+                       max_connections_per_ip=max_connections_per_ip) as httpd:
+        print(f"Servidor HTTP corriendo en puerto {port} (motor: {engine})")
         httpd.serve_forever()
+
+def start_prefork(authService, sessionsManager, port, engine, processes, **server_options):
+    '''
+        El supervisor conserva sesiones, firewall y usuarios; cada worker
+        atiende HTTP y les llama por RPC para que el estado sea unico
+    '''
+    owner = ServiceOwner({'sessions': sessionsManager, 'auth': authService, 'metrics': REGISTRY}, OWNER_EXPOSED)
+    owner.start()
+
+    def run_worker(index):
+        # sesiones, firewall y cache ARP del worker son copias: las metricas de eso las da el supervisor
+        REGISTRY.reset()
+        ServerCaptivePortal.remote_metrics = RemoteService(owner.address, owner.authkey, 'metrics',
+                                                           OWNER_EXPOSED['metrics'])
+        ServerCaptivePortal.sessionsManager = RemoteSessionsManager(
+            owner.address, owner.authkey, sessionsManager, OWNER_EXPOSED['sessions'])
+        ServerCaptivePortal.authService = RemoteService(
+            owner.address, owner.authkey, 'auth', OWNER_EXPOSED['auth'])
+
+        with create_server(port, engine, reuse_port=True, **server_options) as httpd:
+            httpd.serve_forever()
+
+    print(f"Servidor HTTP corriendo en puerto {port} (motor: {engine}, {processes} procesos pre-fork)")
+    try:
+        PreforkSupervisor(run_worker, processes).serve_forever()
+    finally:
+        owner.close()
@@ -0,0 +1,129 @@
+import os
+import json
+import threading
+'''
+Persistencia de sesiones: snapshot + log de escritura anticipada (WAL).
+
+    sessions.snapshot   estado completo en la ultima compactacion (JSON)
+    sessions.wal        un cambio por linea desde esa compactacion:
+                            ["put", ip, mac, username, login_time]
+                            ["del", ip]
+
+Cada create / renovacion / cambio de MAC / terminacion se añade al WAL antes
+de que termine la operacion. Al arrancar se carga el snapshot y se reaplica
+el WAL encima; como cada registro deja la IP en un estado final (put o del),
+reaplicar registros ya incluidos en el snapshot no cambia el resultado.
+
+Cuando el WAL acumula compact_every registros se escribe un snapshot nuevo
+(archivo temporal + rename atomico) y el WAL se vacia.
+'''
+
+class SessionStore:
+
+    def __init__(self, path='sessions', compact_every=5000, fsync=False):
+        """
+        path: prefijo de los archivos (<path>.snapshot y <path>.wal)
+        compact_every: registros en el WAL que disparan una compactacion
+        fsync: forzar cada registro a disco (sobrevive a un corte de luz,
+               no solo a un reinicio del portal) a costa de latencia
+        """
+        self.snapshot_path = f"{path}.snapshot"
+        self.wal_path = f"{path}.wal"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._wal = None
+        self.wal_records = 0
+
+    # Escritura
+
+    def _open_wal(self):
+        if self._wal is None:
+            self._wal = open(self.wal_path, 'a', encoding='utf-8')
+        return self._wal
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            wal = self._open_wal()
+            wal.write(line)
+            wal.flush()
+            if self.fsync:
+                os.fsync(wal.fileno())
+            self.wal_records += 1
+
+    def put(self, ip, session):
+        '''Registra el estado actual de la sesion de una IP (crear, renovar, MAC)'''
+        self._append(['put', ip, session.mac, session.username, session.login_time])
+
+    def delete(self, ip):
+        self._append(['del', ip])
+
+    def needs_compaction(self):
+        return self.wal_records >= self.compact_every
+
+    def compact(self, sessions):
+        '''
+            Escribe un snapshot de `sessions` ({clave: Session}) y vacia el WAL.
+            Mientras dura no se aceptan registros nuevos, asi ninguno se pierde
+            entre el snapshot y el vaciado.
+        '''
+        with self._lock:
+            data = {s.ip: [s.mac, s.username, s.login_time] for s in sessions.copy().values()}
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                # dumps usa el encoder en C; dump escribe por fragmentos en Python
+                file.write(json.dumps({'version': 1, 'sessions': data}, separators=(',', ':')))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            if self._wal is not None:
+                self._wal.close()
+            self._wal = open(self.wal_path, 'w', encoding='utf-8')
+            self.wal_records = 0
+        return len(data)
+
+    # Lectura
+
+    def load(self):
+        '''
+            Reconstruye las sesiones guardadas: {ip: (mac, username, login_time)}.
+            Una ultima linea incompleta del WAL (corte a mitad de escritura) se ignora.
+        '''
+        sessions = {}
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as file:
+                for ip, (mac, username, login_time) in json.load(file)['sessions'].items():
+                    sessions[ip] = (mac, username, login_time)
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ Snapshot de sesiones ilegible ({self.snapshot_path}): {e}")
+
+        replayed = 0
+        try:
+            with open(self.wal_path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        print(f"⚠️ Registro incompleto al final de {self.wal_path}, se descarta")
+                        break
+                    if record[0] == 'put':
+                        _, ip, mac, username, login_time = record
+                        sessions[ip] = (mac, username, login_time)
+                    elif record[0] == 'del':
+                        sessions.pop(record[1], None)
+                    replayed += 1
+        except FileNotFoundError:
+            pass
+
+        self.wal_records = replayed
+        return sessions
+
+    def close(self):
+        with self._lock:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
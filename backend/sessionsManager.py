@@ -1,8 +1,13 @@
+import sys
 import time
-import subprocess
+import heapq
+import socket
 import threading
 from datetime import datetime
 from enum import Enum
+from firewallQueue import FirewallApplyQueue
+from neighborCache import NeighborCache
+from metrics import REGISTRY
 
 class SessionTerminationReason(Enum):
     """Razones de terminación de sesión de red (completamente en español)"""
@@ -13,22 +18,164 @@ class SessionTerminationReason(Enum):
     MAC_MISMATCH = "cambio_mac"  # Cambio de dirección MAC
     UNKNOWN = "desconocida"  # Razón desconocida
     SYSTEM_ERROR = "error_sistema" # Error genérico del sistema
-   
+    IDLE_TIMEOUT = "inactividad, sin tráfico" # Los contadores del firewall dejaron de moverse
+
+UNKNOWN_MAC = "00:00:00:00:00:00"
+
+ACTIVE_SESSIONS = REGISTRY.gauge('portal_active_sessions', 'Sesiones activas')
+SESSIONS_CREATED = REGISTRY.counter('portal_sessions_created_total', 'Sesiones nuevas')
+SESSIONS_TERMINATED = REGISTRY.counter('portal_sessions_terminated_total', 'Sesiones terminadas', ('reason',))
+TRAFFIC_BYTES = REGISTRY.counter('portal_traffic_bytes_total', 'Bytes de las sesiones segun los contadores del firewall',
+                                 ('direction',))
+
+# IP y MAC se guardan como enteros: ocupan menos que los strings y comparan mas rapido
+
+def ip_to_int(ip):
+    """IPv4 en texto -> entero de 32 bits (OSError si no es una IPv4)"""
+    return int.from_bytes(socket.inet_aton(ip), 'big')
+
+def int_to_ip(value):
+    return socket.inet_ntoa(value.to_bytes(4, 'big'))
+
+def mac_to_int(mac):
+    """MAC en texto (con ':' o '-') -> entero de 48 bits; 0 si es desconocida o inválida"""
+    digits = mac.replace(':', '').replace('-', '') if mac else ''
+    if len(digits) != 12:
+        return 0
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return 0
+
+def int_to_mac(value):
+    digits = f"{value:012X}"
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+# Entrada del heap de vencimientos: un solo entero (ms de vencimiento << 32) | ip.
+# Un int de ~73 bits ocupa 36 bytes; la tupla (vencimiento, secuencia, ip) con
+# su contador ocupaba 92. El +1 redondea hacia arriba: nunca vence antes de tiempo
+
+def expiry_entry(expires_at, ip_int):
+    return (int(expires_at * 1000) + 1) << 32 | ip_int
+
+def expiry_deadline(entry):
+    return (entry >> 32) / 1000
+
+
+class Session:
+    """Sesión de un cliente autenticado"""
+
+    # sin expires_at: siempre es login_time + session_timeout del gestor
+    __slots__ = ('ip_int', 'mac_int', 'username', 'login_time',
+                 'packets_up', 'bytes_up', 'packets_down', 'bytes_down', 'counters_seen', 'last_activity')
+
+    def __init__(self, ip_int, mac_int, username, login_time):
+        self.ip_int = ip_int
+        self.mac_int = mac_int          # 0 = MAC aun desconocida
+        self.username = username
+        self.login_time = login_time
+
+        # Trafico desde el inicio de la sesion (contadores de las reglas ACCEPT)
+        self.packets_up = self.bytes_up = 0
+        self.packets_down = self.bytes_down = 0
+        self.counters_seen = None       # ultima lectura cruda del firewall (None = aun sin base)
+        self.last_activity = login_time # ultima vez que los contadores se movieron
+
+    @property
+    def ip(self):
+        return int_to_ip(self.ip_int)
+
+    @property
+    def mac(self):
+        return int_to_mac(self.mac_int)
+
+    def to_dict(self):
+        return {
+            'ip': self.ip, 'mac': self.mac, 'username': self.username, 'login_time': self.login_time,
+            'packets_up': self.packets_up, 'bytes_up': self.bytes_up,
+            'packets_down': self.packets_down, 'bytes_down': self.bytes_down,
+            'last_activity': self.last_activity,
+        }
+
+
 class NetworkSessionManager:
 
-    def __init__(self, firewall_manager, timeout=30*60, cleanup_interval=5*60):
+    # Locks por franja de IPs: operaciones sobre IPs distintas no se esperan entre si
+    LOCK_STRIPES = 32
+
+    def __init__(self, firewall_manager, timeout=30*60, cleanup_interval=5*60, store=None, max_sessions_per_user=0,
+                 neighbors=None, traffic_interval=60, idle_timeout=0, counters_reader=None):
         """
         Inicializa el gestor de sesiones en memoria
 
+        store: SessionStore opcional; si se indica, cada cambio de sesión se
+               guarda en disco y al iniciar se recuperan las sesiones previas
+        max_sessions_per_user: sesiones simultaneas por usuario (0 = sin limite)
+        neighbors: NeighborCache de donde se obtienen las MAC (por defecto /proc/net/arp)
+        traffic_interval: segundos entre lecturas de los contadores del firewall (0 = sin contabilidad)
+        idle_timeout: termina las sesiones cuyo tráfico no se movió en ese tiempo (0 = nunca)
+        counters_reader: función que devuelve {ip: (pkts_sub, bytes_sub, pkts_baj, bytes_baj)};
+                         por defecto la del backend del firewall. Si el backend no
+                         tiene reglas por IP (ipset, nftables) no hay contabilidad.
+
+        Estructuras:
+            - active_sessions: {ip (entero): Session}
+            - indices secundarios por usuario y por MAC, protegidos por
+              _index_lock; cada entrada es una IP (entero), una tupla si hay
+              pocas o un set si hay muchas: casi siempre hay una sola
+
+        Concurrencia:
+            - Lectura (is_authenticated): sin lock en el caso comun; un dict.get
+              es atomico y la sesion de una IP solo cambia con el lock de su franja.
+            - Escritura de una IP: lock de su franja (IP modulo LOCK_STRIPES).
+            - Heap de expiracion: _expiry_lock.
+            - Firewall: los cambios se encolan en firewall_queue y los aplica
+              su propio hilo; ningun lock de sesiones espera a iptables.
         """
         self.session_timeout = timeout
+        self.max_sessions_per_user = max_sessions_per_user
         self.active_sessions = {}  
+        self._by_user = {}
+        self._by_mac = {}
+        self._index_lock = threading.Lock()
         self.firewall = firewall_manager
+        self.neighbors = neighbors if neighbors is not None else NeighborCache()
+        self.firewall_queue = FirewallApplyQueue(firewall_manager)
+        self.firewall_queue.start()
 
-        self.cleanup_interval = cleanup_interval 
+        self.cleanup_interval = cleanup_interval # cada cuanto se muestra el resumen de sesiones
+        if counters_reader is None and traffic_interval:
+            if getattr(firewall_manager, 'traffic_counters', False):
+                counters_reader = firewall_manager.read_counters
+            else:
+                backend = getattr(getattr(firewall_manager, 'backend', None), 'name', None)
+                print(f"⚠️  El firewall ({backend or 'sin backend'}) no tiene contadores por IP: "
+                      f"sin contabilidad de tráfico{' ni idle_timeout' if idle_timeout else ''}")
+                traffic_interval = 0
+        self.traffic_interval = traffic_interval
+        self.idle_timeout = idle_timeout
+        self.counters_reader = counters_reader
+        self._last_counters = {}    # ip (entero) -> ultima lectura cruda de sus reglas
+        self._traffic_errors = 0
         self._stop_cleanup = threading.Event()
-        self._session_lock = threading.RLock()
-        
+        self._stripes = [threading.RLock() for _ in range(self.LOCK_STRIPES)]
+        self._expiry_lock = threading.Lock()
+
+        # Indice de expiracion: min-heap de expiry_entry(vencimiento, ip).
+        # Protegido por _expiry_lock.
+        # Renovar o terminar no busca la entrada vieja: queda obsoleta y se
+        # descarta al salir del heap (o al compactar si se acumulan muchas).
+        self._expiry_heap = []
+        self._expiry_wakeup = threading.Event()
+
+        self.store = store
+        if store is not None:
+            self._restore_sessions()
+
+        ACTIVE_SESSIONS.set_function(lambda: len(self.active_sessions))
+        REGISTRY.register_stats('portal_firewall_queue', 'Cola de cambios del firewall', self.firewall_queue.get_stats)
+        REGISTRY.register_stats('portal_neighbor_cache', 'Cache de la tabla ARP', self.neighbors.get_stats)
+
         # Iniciar el hilo de limpieza
         self.cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
         self.cleanup_thread.start()
@@ -38,45 +185,342 @@ class NetworkSessionManager:
     def _normalize_mac(self, mac: str) -> str:
         """Normaliza MAC a MAYÚSCULAS con dos puntos o devuelve placeholder."""
         if not mac:
-            return "00:00:00:00:00:00"
+            return UNKNOWN_MAC
         normalized = mac.strip().upper().replace('-', ':')
-        return normalized if normalized else "00:00:00:00:00:00"
+        return normalized if normalized else UNKNOWN_MAC
+
+    def _stripe(self, key):
+        """Lock de la franja a la que pertenece la IP (entero)"""
+        return self._stripes[key % self.LOCK_STRIPES]
+
+    # Indices secundarios
+
+    def _index_add(self, session, limit=0):
+        """
+        Añade la sesión a los índices por usuario y MAC.
+        Con limit > 0 no la añade (y devuelve False) si el usuario ya tiene
+        limit sesiones; comprobar y añadir es atómico.
+        """
+        with self._index_lock:
+            if limit and len(self._lookup(self._by_user, session.username)) >= limit:
+                return False
+            self._insert(self._by_user, session.username, session.ip_int)
+            if session.mac_int:
+                self._insert(self._by_mac, session.mac_int, session.ip_int)
+            return True
+
+    def _index_remove(self, session):
+        with self._index_lock:
+            self._discard(self._by_user, session.username, session.ip_int)
+            if session.mac_int:
+                self._discard(self._by_mac, session.mac_int, session.ip_int)
+
+    def _index_set_mac(self, session, mac_int):
+        """Cambia la MAC de la sesión manteniendo el índice por MAC"""
+        with self._index_lock:
+            if session.mac_int:
+                self._discard(self._by_mac, session.mac_int, session.ip_int)
+            session.mac_int = mac_int
+            if mac_int:
+                self._insert(self._by_mac, mac_int, session.ip_int)
+
+    # Entradas de los indices: int -> tupla (hasta INDEX_TUPLE_MAX) -> set
+    INDEX_TUPLE_MAX = 8
+
+    @staticmethod
+    def _lookup(index, key):
+        ips = index.get(key)
+        if ips is None:
+            return ()
+        return (ips,) if isinstance(ips, int) else ips
+
+    def _insert(self, index, key, ip_int):
+        ips = index.get(key)
+        if ips is None or ips == ip_int:
+            index[key] = ip_int
+        elif isinstance(ips, int):
+            index[key] = (ips, ip_int)
+        elif isinstance(ips, tuple):
+            if ip_int not in ips:
+                index[key] = ips + (ip_int,) if len(ips) < self.INDEX_TUPLE_MAX else set(ips + (ip_int,))
+        else:
+            ips.add(ip_int)
+
+    @staticmethod
+    def _discard(index, key, ip_int):
+        ips = index.get(key)
+        if ips is None:
+            return
+        if isinstance(ips, int):
+            if ips == ip_int:
+                del index[key]
+            return
+        remaining = tuple(ip for ip in ips if ip != ip_int) if isinstance(ips, tuple) else None
+        if remaining is None:
+            ips.discard(ip_int)
+            if not ips:
+                del index[key]
+            return
+        index[key] = remaining[0] if len(remaining) == 1 else remaining
+
+    def sessions_for_user(self, username):
+        """IPs con sesión activa del usuario (O(1) por usuario)"""
+        with self._index_lock:
+            return [int_to_ip(key) for key in self._lookup(self._by_user, username)]
+
+    def sessions_for_mac(self, mac):
+        """IPs con sesión activa registrada con esa MAC"""
+        mac_int = mac_to_int(self._normalize_mac(mac))
+        if not mac_int:
+            return []
+        with self._index_lock:
+            return [int_to_ip(key) for key in self._lookup(self._by_mac, mac_int)]
+
+    # Persistencia
+
+    def _persist(self, ip, session=None):
+        """
+        Guarda el estado de la sesión de la IP (None = terminada).
+        Llamar con el lock de la franja tomado para que el orden en disco
+        sea el mismo que en memoria.
+        """
+        if self.store is None:
+            return
+        try:
+            if session is None:
+                self.store.delete(ip)
+            else:
+                self.store.put(ip, session)
+            if self.store.needs_compaction():
+                self._expiry_wakeup.set() # la compactación la hace el hilo de limpieza
+        except OSError as e:
+            print(f"❌ Error guardando sesión de {ip}: {e}")
+
+    def _restore_sessions(self):
+        """
+        Recupera las sesiones guardadas y las pasa al estado deseado del
+        firewall (assume_allowed). Si el firewall tiene warm_start, este deja
+        el kernel con las vigentes y nada mas; si no, las que vencieron con
+        el portal apagado se bloquean una por una.
+        """
+        started = time.perf_counter()
+        saved = self.store.load()
+        now = time.time()
+        expired = 0
+
+        for ip, (mac, username, login_time) in saved.items():
+            expires_at = login_time + self.session_timeout
+            if expires_at <= now:
+                if not hasattr(self.firewall, 'warm_start'):
+                    self.firewall_queue.submit('lock_user', ip)
+                expired += 1
+                continue
+            try:
+                key = ip_to_int(ip)
+            except OSError:
+                continue
+            session = Session(key, mac_to_int(mac), sys.intern(username), login_time)
+            self.active_sessions[key] = session
+            self._index_add(session)
+
+        # heap de expiracion en bloque (heapify es O(n))
+        self._expiry_heap = [expiry_entry(self._expires_at(s), key) for key, s in self.active_sessions.items()]
+        heapq.heapify(self._expiry_heap)
+        restored = len(self.active_sessions)
+
+        # las vigentes forman parte del estado deseado del firewall
+        if hasattr(self.firewall, 'assume_allowed'):
+            self.firewall.assume_allowed(int_to_ip(key) for key in self.active_sessions)
+
+        # snapshot limpio: el proximo arranque no repite el replay del WAL
+        if self.store.wal_records or expired:
+            self.store.compact(self.active_sessions)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"💾 Sesiones recuperadas: {restored} vigentes, {expired} vencidas ({elapsed:.0f} ms)")
 
     # Funcionamiento para manejar las sesiones expiradas
 
+    def _schedule_expiry(self, session):
+        """
+        Registra el vencimiento de la sesión en el heap (O(log n)).
+        Llamar con el lock de la franja de la IP tomado.
+        """
+        entry = expiry_entry(self._expires_at(session), session.ip_int)
+        with self._expiry_lock:
+            heapq.heappush(self._expiry_heap, entry)
+
+            # Si ahora es la primera en vencer, despertar al hilo para que reprograme su espera
+            if self._expiry_heap[0] == entry:
+                self._expiry_wakeup.set()
+
+            # Compactar si la mayoría de entradas son de sesiones renovadas o terminadas
+            if len(self._expiry_heap) > 64 and len(self._expiry_heap) > 2 * len(self.active_sessions):
+                self._expiry_heap = [e for e in self._expiry_heap
+                                     if self._is_current_expiry(e)]
+                heapq.heapify(self._expiry_heap)
+
+    def _is_current_expiry(self, entry):
+        key = entry & 0xFFFFFFFF
+        session = self.active_sessions.get(key)
+        return session is not None and expiry_entry(self._expires_at(session), key) == entry
+
+    def _expires_at(self, session):
+        return session.login_time + self.session_timeout
+
+    def _pop_expired(self, now):
+        """
+        Saca del heap todas las sesiones ya vencidas (descartando entradas
+        obsoletas) y devuelve (ips_vencidas, próximo_vencimiento o None)
+        """
+        expired_ips = []
+        with self._expiry_lock:
+            heap = self._expiry_heap
+            while heap and expiry_deadline(heap[0]) <= now:
+                entry = heapq.heappop(heap)
+                if self._is_current_expiry(entry):
+                    expired_ips.append(entry & 0xFFFFFFFF)
+            next_deadline = expiry_deadline(heap[0]) if heap else None
+        return expired_ips, next_deadline
+
     def _cleanup_loop(self):
-        """Bucle de limpieza automática cada 5 minutos"""
+        """
+        Duerme hasta el próximo vencimiento (o hasta que una sesión nueva
+        venza antes) y termina en lote todas las sesiones vencidas
+        """
+        next_summary = time.monotonic() + self.cleanup_interval
+        next_traffic = time.monotonic() + self.traffic_interval if self.traffic_interval else float('inf')
         while not self._stop_cleanup.is_set():
-            time.sleep(self.cleanup_interval)
-            self._check_and_cleanup_expired()
+            self._expiry_wakeup.clear()
+            next_deadline = self._check_and_cleanup_expired()
+
+            wait = min(next_summary, next_traffic) - time.monotonic()
+            if next_deadline is not None:
+                wait = min(wait, next_deadline - time.time())
+            if wait > 0:
+                self._expiry_wakeup.wait(wait)
+
+            if time.monotonic() >= next_traffic:
+                next_traffic = time.monotonic() + self.traffic_interval
+                self._update_traffic()
+
+            if self.store is not None and self.store.needs_compaction():
+                self._compact_store()
+
+            if time.monotonic() >= next_summary:
+                next_summary = time.monotonic() + self.cleanup_interval
+                self._display_active_sessions_summary()
+
+    # Contabilidad de tráfico
+
+    def _update_traffic(self):
+        """
+        Una lectura de los contadores de todas las reglas ACCEPT del firewall:
+        suma a cada sesión lo que se movió desde la lectura anterior y
+        termina las sesiones inactivas durante idle_timeout.
+        """
+        try:
+            raw = self.counters_reader()
+        except Exception as e:
+            self._traffic_errors += 1
+            if self._traffic_errors == 1:
+                print(f"⚠️ No se pudieron leer los contadores del firewall: {e}")
+            return
+
+        counters = {}
+        for ip, values in raw.items():
+            try:
+                counters[ip_to_int(ip)] = values
+            except OSError:
+                continue
+        self._last_counters = counters
+
+        now = time.time()
+        idle = []
+        total_up = total_down = 0
+        for key, session in self.active_sessions.copy().items():
+            current = counters.get(key)
+            if current is None:
+                continue  # sin reglas propias (aún no aplicadas, o backend ipset): no hay datos
+            seen = session.counters_seen
+            if seen is None:
+                session.counters_seen = current  # sesión recuperada: la base es esta lectura
+                continue
+            if current[1] < seen[1] or current[3] < seen[3]:
+                seen = (0, 0, 0, 0)              # las reglas se recrearon: contadores desde cero
+            if current != seen:
+                session.packets_up += current[0] - seen[0]
+                session.bytes_up += current[1] - seen[1]
+                session.packets_down += current[2] - seen[2]
+                session.bytes_down += current[3] - seen[3]
+                session.last_activity = now
+                total_up += current[1] - seen[1]
+                total_down += current[3] - seen[3]
+            session.counters_seen = current
+
+            if self.idle_timeout and now - session.last_activity > self.idle_timeout:
+                idle.append(key)
+
+        TRAFFIC_BYTES.labels('subida').inc(total_up)
+        TRAFFIC_BYTES.labels('bajada').inc(total_down)
+        for key in idle:
+            with self._stripe(key):
+                session = self.active_sessions.get(key)
+                if session is not None and now - session.last_activity > self.idle_timeout:
+                    self._terminate(key, SessionTerminationReason.IDLE_TIMEOUT)
+
+    def get_session_traffic(self, ip):
+        """
+        Tráfico de la sesión de la IP desde que inició
+
+        Returns:
+            dict | None: paquetes y bytes de subida/bajada y última actividad
+        """
+        try:
+            session = self.active_sessions.get(ip_to_int(ip))
+        except OSError:
+            return None
+        if session is None:
+            return None
+        return {
+            'packets_up': session.packets_up, 'bytes_up': session.bytes_up,
+            'packets_down': session.packets_down, 'bytes_down': session.bytes_down,
+            'last_activity': session.last_activity,
+        }
+
+    def _compact_store(self):
+        try:
+            count = self.store.compact(self.active_sessions)
+            print(f"💾 Snapshot de sesiones compactado: {count} sesiones")
+        except OSError as e:
+            print(f"❌ Error compactando sesiones: {e}")
 
     def _check_and_cleanup_expired(self):
-        """Verifica y limpia sesiones expiradas"""
+        """
+        Termina las sesiones vencidas.
+
+        Returns:
+            float | None: instante del próximo vencimiento
+        """
         try:
-            current_time = time.time()
+            expired_keys, next_deadline = self._pop_expired(time.time())
+
             expired_count = 0
-            
-            with self._session_lock:
-                # Crear lista de IPs expiradas para evitar modificar el dict durante la iteración
-                expired_ips = []
-                
-                for ip, session in self.active_sessions.items():
-                    elapsed = current_time - session.get('login_time', 0)
-                    if elapsed > self.session_timeout:
-                        expired_ips.append(ip)
-            
-            # Terminar sesiones expiradas
-            for ip in expired_ips:
-                if self.terminate_session(ip, SessionTerminationReason.SESSION_TIMEOUT):
-                    expired_count += 1
-            
+            for key in expired_keys:
+                with self._stripe(key):
+                    # pudo renovarse entre que salió del heap y ahora
+                    session = self.active_sessions.get(key)
+                    if session is None or self._expires_at(session) > time.time():
+                        continue
+                    if self._terminate(key, SessionTerminationReason.SESSION_TIMEOUT):
+                        expired_count += 1
+
             if expired_count > 0:
                 print(f"⏰ [{datetime.now().strftime('%H:%M:%S')}] Limpieza automática: {expired_count} sesiones expiradas")
+            return next_deadline
 
-            self._display_active_sessions_summary()
-                
         except Exception as e:
             print(f"❌ Error en limpieza automática: {e}")
+            return None
 
     def _format_time(self, seconds: float) -> str:
         """Formatear tiempo en segundos a string legible"""
@@ -98,31 +542,8 @@ class NetworkSessionManager:
         return " ".join(parts)
 
     def _display_active_sessions_summary(self):
-        """Muestra un resumen de las sesiones activas"""
-        with self._session_lock:
-            active_count = len(self.active_sessions)
-            
-            if active_count == 0:
-                print(f"📊 Sesiones activas: 0")
-                return
-            
-            print(f"\n📊 RESUMEN DE SESIONES ACTIVAS")
-            print(f"   Total: {active_count} sesión(es)")
-            print(f"   {'─' * 40}")
-            
-            for ip, session in self.active_sessions.items():
-                username = session.get('username', 'Desconocido')
-                login_time = session.get('login_time', 0)
-                elapsed = time.time() - login_time
-                remaining = max(0, self.session_timeout - elapsed)
-                
-                elapsed_str = self._format_time(elapsed)
-                remaining_str = self._format_time(remaining)
-                
-                print(f"   • {username:20} {ip:15}")
-                print(f"     Tiempo conectado: {elapsed_str}")
-                print(f"     Tiempo restante:  {remaining_str}")
-                print(f"     Login: {datetime.fromtimestamp(login_time).strftime('%H:%M:%S')}")
+        """Una línea con el total; el detalle (sesiones, tráfico, firewall) está en /metrics"""
+        print(f"📊 Sesiones activas: {len(self.active_sessions)}")
 
     def terminate_session(self, ip, reason: SessionTerminationReason = SessionTerminationReason.UNKNOWN):
         """
@@ -132,23 +553,45 @@ class NetworkSessionManager:
             bool: True si la sesión se terminó exitosamente
         """
         try:
-            with self._session_lock:
+            key = ip_to_int(ip)
+        except OSError:
+            print(f"⚠️  No se encontró sesión para IP {ip}")
+            return False
+        return self._terminate(key, reason)
+
+    def terminate_user_sessions(self, username, reason: SessionTerminationReason = SessionTerminationReason.UNKNOWN):
+        """
+        Terminar todas las sesiones de un usuario
+
+        Returns:
+            int: sesiones terminadas
+        """
+        with self._index_lock:
+            keys = list(self._lookup(self._by_user, username))
+        return sum(1 for key in keys if self._terminate(key, reason))
+
+    def _terminate(self, key, reason):
+        try:
+            with self._stripe(key):
+                ip = int_to_ip(key)
                 # Verificar si existe en el diccionario
-                if ip not in self.active_sessions:
+                if key not in self.active_sessions:
                     print(f"⚠️  No se encontró sesión para IP {ip}")
                     return False
                 
-                session = self.active_sessions[ip]
-                username = session.get('username', 'Desconocido')
-                # mac = session['mac']
+                session = self.active_sessions[key]
+                username = session.username
                 
                 print(f"🔒 Terminando sesión: {username} ({ip}) - Razón: {reason}")
                 
-                # Bloquear en firewall
-                self.firewall.lock_user(ip)
-                
                 # Eliminar del diccionario 
-                del self.active_sessions[ip]
+                del self.active_sessions[key]
+                self._index_remove(session)
+                self._persist(ip)
+                SESSIONS_TERMINATED.labels(reason.name).inc()
+
+                # Bloquear en firewall (lo aplica el hilo del firewall)
+                self.firewall_queue.submit('lock_user', ip)
                 
                 print(f"✅ Sesión terminada: {username} ({ip})")
                 return True
@@ -158,10 +601,24 @@ class NetworkSessionManager:
             return False
     
     def stop_cleanup(self): #Configurar mejor esto
-        """Detener el hilo de limpieza"""
+        """Detener el hilo de limpieza y aplicar los cambios de firewall pendientes"""
         self._stop_cleanup.set()
+        self._expiry_wakeup.set()
         if self.cleanup_thread.is_alive():
             self.cleanup_thread.join(timeout=2)        
+        self.firewall_queue.stop()
+        self.neighbors.stop()
+        if self.store is not None:
+            self.store.close()
+
+    def wait_for_firewall(self, ip, timeout=5):
+        """
+        Espera a que el firewall refleje los cambios encolados para la IP
+        
+        Returns:
+            bool: True si se aplicaron correctamente dentro del timeout
+        """
+        return self.firewall_queue.wait(ip, timeout)
     
     # Manejo de creación y actualización de sesiones
 
@@ -174,36 +631,50 @@ class NetworkSessionManager:
         """
         try:
             # Validar IP
-            if not ip or ip == "0.0.0.0":
+            try:
+                key = ip_to_int(ip) if ip else 0
+            except OSError:
+                key = 0
+            if not key:
                 print(f"❌ IP inválida: {ip}")
                 return False
           
             # Normalizar MAC
-            normalized_mac = self._normalize_mac(mac)
+            mac_int = mac_to_int(self._normalize_mac(mac))
             
-            with self._session_lock:
+            with self._stripe(key):
                 # Verificar si ya existe sesión para esta IP 
-                if ip in self.active_sessions:
-                    existing = self.active_sessions[ip]
+                if key in self.active_sessions:
+                    existing = self.active_sessions[key]
                     
                     # Si es el mismo usuario con misma MAC, renovar sesión
                     print(f"🔄 Renovando sesión existente para {username}")
-                    self.active_sessions[ip]['login_time'] = time.time()
-                    if existing.get('mac', "00:00:00:00:00:00") == "00:00:00:00:00:00" and normalized_mac != "00:00:00:00:00:00":
-                        self.active_sessions[ip]['mac'] = normalized_mac
+                    existing.login_time = existing.last_activity = time.time()
+                    if not existing.mac_int and mac_int:
+                        self._index_set_mac(existing, mac_int)
+                    self._schedule_expiry(existing)
+                    self._persist(ip, existing)
+                    if getattr(self.firewall, 'kernel_timeout', 0):
+                        # el kernel también caduca la IP (ipset): renovar su timeout
+                        self.firewall_queue.submit('unlock_user', ip)
                     return True
 
                 else:
-                    # Desbloquear en firewall (IP + MAC)
-                    print(f"🔓 Desbloqueando en firewall: {ip}")
-                    self.firewall.unlock_user(ip)
-                
                     # Guardar sesión 
-                    self.active_sessions[ip] = {
-                        'mac': normalized_mac,
-                        'username': username,
-                        'login_time': time.time(),
-                    }
+                    session = Session(key, mac_int, sys.intern(username), time.time())
+                    # las reglas ACCEPT de la IP pueden traer contadores de sesiones anteriores
+                    session.counters_seen = self._last_counters.get(key, (0, 0, 0, 0))
+                    if not self._index_add(session, self.max_sessions_per_user):
+                        print(f"❌ {username} ya tiene {self.max_sessions_per_user} sesiones activas")
+                        return False
+                    self.active_sessions[key] = session
+                    self._schedule_expiry(session)
+                    self._persist(ip, session)
+
+                    # Desbloquear en firewall (se aplica en segundo plano, ver wait_for_firewall)
+                    print(f"🔓 Desbloqueando en firewall: {ip}")
+                    SESSIONS_CREATED.inc()
+                    self.firewall_queue.submit('unlock_user', ip)
 
                     return True
                 
@@ -220,31 +691,52 @@ class NetworkSessionManager:
         Returns:
             bool: True si está autenticado y la sesión es válida
         """
-        with self._session_lock:
-            # Verificar si existe en el diccionario
-            if ip not in self.active_sessions:
+        # Camino rapido sin lock: sin sesion, sin MAC que comparar o con la
+        # misma MAC registrada no hay nada que modificar
+        try:
+            key = ip_to_int(ip)
+        except OSError:
+            return False
+        session = self.active_sessions.get(key)
+        if session is None:
+            return False
+        if mac is None:
+            return True
+        normalized_mac = self._normalize_mac(mac)
+        mac_int = mac_to_int(normalized_mac)
+        if not mac_int or mac_int == session.mac_int:
+            return True
+
+        # Camino lento: aprender la MAC o detectar suplantación
+        with self._stripe(key):
+            # Verificar si existe en el diccionario (pudo terminarse mientras tanto)
+            if key not in self.active_sessions:
                 return False
             
-            session = self.active_sessions[ip]
+            session = self.active_sessions[key]
 
             # Verificación de MAC para detectar suplantación
             if mac is not None:
-                normalized_mac = self._normalize_mac(mac)
-                session_mac = session.get('mac', "00:00:00:00:00:00")
-
                 # Aprender MAC si no se tenía registrada
-                if session_mac == "00:00:00:00:00:00" and normalized_mac != "00:00:00:00:00:00":
-                    session['mac'] = normalized_mac
-                elif normalized_mac != "00:00:00:00:00:00" and session_mac != "00:00:00:00:00:00" and normalized_mac != session_mac:
+                if not session.mac_int:
+                    self._index_set_mac(session, mac_int)
+                    self._persist(ip, session)
+                elif mac_int != session.mac_int:
                     # Detectada suplantación: bloquear atacante y cerrar sesión
-                    username = session.get('username', 'Desconocido')
-                    print(f"🚨 Suplantación en {ip}: esperada {session_mac}, recibida {normalized_mac}")
-                    
-                    # Bloquear MAC atacante en firewall
-                    self.firewall.lock_user(ip, normalized_mac)
+                    username = session.username
+                    print(f"🚨 Suplantación en {ip}: esperada {session.mac}, recibida {normalized_mac}")
+                    others = self.sessions_for_mac(normalized_mac)
+                    if others:
+                        print(f"   La MAC {normalized_mac} tiene sesión propia en: {', '.join(others)}")
                     
                     # Eliminar sesión (usuario debe re-logear)
-                    del self.active_sessions[ip]
+                    del self.active_sessions[key]
+                    self._index_remove(session)
+                    self._persist(ip)
+                    SESSIONS_TERMINATED.labels(SessionTerminationReason.IP_SPOOFING_DETECTED.name).inc()
+
+                    # Bloquear MAC atacante en firewall
+                    self.firewall_queue.submit('lock_user', ip, normalized_mac)
                     print(f"✅ Sesión terminada por suplantación: {username} ({ip})")
                     return False
 
@@ -252,19 +744,8 @@ class NetworkSessionManager:
     
     def get_client_mac(self, client_ip):
         """
-        Obtiene la MAC del cliente desde la tabla ARP (ip neigh).
+        Obtiene la MAC del cliente desde la tabla ARP (cache de /proc/net/arp).
+        Devuelve "00:00:00:00:00:00" si no se puede obtener.
         """
-        try:
-            result = subprocess.run(['ip', 'neigh', 'show', client_ip], capture_output=True, text=True, timeout=3)
-            if result.returncode == 0 and result.stdout:
-                line = result.stdout.strip()
-                parts = line.split()
-                if "lladdr" in parts:
-                    idx = parts.index("lladdr")
-                    mac = parts[idx + 1].upper()
-                    return mac
-        except Exception as e:
-            print(f"⚠️ Error obteniendo MAC real: {e}")
-                    
-        return "00:00:00:00:00:00"  # MAC por defecto si no se puede obtener
+        return self.neighbors.lookup(client_ip)
     
\ No newline at end of file
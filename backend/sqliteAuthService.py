@@ -0,0 +1,129 @@
+import os
+import sys
+import sqlite3
+import threading
+from authService import read_users, hash_password
+'''
+Usuarios del portal en SQLite (alternativa a AuthService + dataUsers.json).
+
+No carga los usuarios en memoria: cada login es una busqueda por el indice
+unico de username, asi el arranque y la memoria no crecen con las cuentas.
+
+    users.db        tabla users (username unico, email unico si no es vacio)
+    users.db-wal    journal WAL: los lectores no bloquean al escritor ni al
+                    reves, y un corte a mitad de un registro no corrompe nada
+
+Cada hilo (workers HTTP, hilos RPC del supervisor pre-fork) usa su propia
+conexion, abierta la primera vez que la necesita: una conexion de sqlite3
+no se puede usar desde dos hilos a la vez. Las consultas son siempre los mismos textos SQL,
+asi que cada conexion reutiliza la sentencia ya preparada (cache de sqlite3).
+
+Un registro es un solo INSERT: si dos hilos registran el mismo usuario a la
+vez, el indice unico rechaza al segundo.
+
+Migracion: python3 sqliteAuthService.py [dataUsers.json] [users.db]
+'''
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    email TEXT NOT NULL DEFAULT '',
+    password_hash TEXT NOT NULL,
+    activo INTEGER NOT NULL DEFAULT 1
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users(username);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users(lower(email)) WHERE email <> '';
+"""
+
+SELECT_USER = "SELECT password_hash, activo FROM users WHERE username = ?"
+INSERT_USER = "INSERT INTO users (username, email, password_hash, activo) VALUES (?, ?, ?, ?)"
+INSERT_IGNORE_USER = "INSERT OR IGNORE INTO users (username, email, password_hash, activo) VALUES (?, ?, ?, ?)"
+
+
+class SqliteAuthService:
+    def __init__(self, path='users.db', import_from=None):
+        """
+        path: archivo de la base de datos
+        import_from: dataUsers.json a importar si la base esta vacia
+                     (primer arranque tras cambiar de backend)
+        """
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+
+        if import_from and self.count_users() == 0 and os.path.exists(import_from):
+            imported = self.import_json(import_from)
+            print(f"👤 {imported} usuarios importados de {import_from} a {path}")
+
+    def _connection(self):
+        '''Conexion del hilo actual (una por hilo, creada al primer uso)'''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # check_same_thread=False solo para que close() pueda cerrarlas
+            # todas; cada conexion se usa unicamente desde su hilo
+            connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            # con WAL, NORMAL no sincroniza en cada commit: un corte de luz
+            # puede perder el ultimo registro, pero la base queda consistente
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def count_users(self):
+        return self._connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def validate_user(self, username, password):
+        row = self._connection().execute(SELECT_USER, (username,)).fetchone()
+        if row is not None and row[0] == hash_password(password) and row[1]:
+            return {'status': 'success', 'username': username}
+        return {'status': 'failure', 'error_type': 'invalid'}
+
+    def register_user(self, username, email, password):
+        # El indice unico decide si el usuario (o el email) ya existe
+        connection = self._connection()
+        try:
+            with connection:
+                connection.execute(INSERT_USER, (username, email or '', hash_password(password), 1))
+        except sqlite3.IntegrityError as e:
+            error_type = 'exists' if 'users.username' in str(e) else 'email_exists'
+            return {'status': 'failure', 'error_type': error_type}
+        return {'status': 'success', 'username': username}
+
+    def import_json(self, json_path):
+        '''
+            Copia los usuarios de dataUsers.json (y de su WAL) en una sola
+            transaccion. Los archivos de origen solo se leen (no se compactan).
+            Los que ya existen se saltan, asi que repetirla no duplica nada.
+            Devuelve cuantos se agregaron.
+        '''
+        users, _ = read_users(json_path)
+        rows = ((user['username'], user.get('email') or '', user['password_hash'], int(user.get('activo', False)))
+                for user in users.values())
+        connection = self._connection()
+        before = connection.total_changes
+        with connection:
+            connection.executemany(INSERT_IGNORE_USER, rows)
+        return connection.total_changes - before
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else 'dataUsers.json'
+    target = sys.argv[2] if len(sys.argv) > 2 else 'users.db'
+    service = SqliteAuthService(target)
+    print(f"👤 {service.import_json(source)} usuarios importados de {source} a {target} "
+          f"({service.count_users()} en total)")
+    service.close()
@@ -61,6 +61,10 @@ AP_DHCP_END="${AP_DHCP_END:-192.168.100.150}"
 AP_CHANNEL="${AP_CHANNEL:-6}"
 AP_PASSWORD="${AP_PASSWORD:-12345678}"
 PORTAL_PORT="${PORTAL_PORT:-8080}"
+PORTAL_ENGINE="${PORTAL_ENGINE:-threads}"
+PORTAL_PROCESSES="${PORTAL_PROCESSES:-1}"
+PORTAL_FIREWALL="${PORTAL_FIREWALL:-iptables}"
+PORTAL_USERS="${PORTAL_USERS:-json}"
 AP_NETWORK="${AP_NETWORK:-192.168.100.0/24}"
 
 # ═══════════════════════════════════════════════════════════════
@@ -352,7 +356,7 @@ trap cleanup_portal INT TERM
 
 if [ -f "main.py" ]; then
     echo "🚀 Iniciando servidor Python..."
-    python3 main.py "$PORTAL_PORT" "$INTERNET_INTERFACE" "$LOCAL_IFACE" &
+    python3 main.py "$PORTAL_PORT" "$INTERNET_INTERFACE" "$LOCAL_IFACE" "$PORTAL_ENGINE" "$PORTAL_PROCESSES" "$PORTAL_FIREWALL" "$PORTAL_USERS" &
     PYTHON_PID=$!
     
     echo "🔧 Servidor Python iniciado con PID: $PYTHON_PID"
@@ -366,7 +370,7 @@ else
     echo "❌ No se encuentra main.py en $SCRIPT_DIR"
     echo ""
     echo "El Access Point está funcionando. Para iniciar el portal web manualmente:"
-    echo "cd $SCRIPT_DIR && python3 main.py $PORTAL_PORT $INTERNET_INTERFACE $LOCAL_IFACE"
+    echo "cd $SCRIPT_DIR && python3 main.py $PORTAL_PORT $INTERNET_INTERFACE $LOCAL_IFACE $PORTAL_ENGINE $PORTAL_PROCESSES $PORTAL_FIREWALL $PORTAL_USERS"
     echo ""
     echo "💡 Presiona Ctrl+C para detener el portal cautivo"
     
@@ -136,6 +136,20 @@ iptables -t nat -F 2>/dev/null || true
 echo "   - Limpiando reglas de FILTER..."
 iptables -F 2>/dev/null || true
 
+# Backend ipset: cadena propia y sets (no existen con el backend iptables)
+iptables -X PORTAL_SETS 2>/dev/null || true
+if command -v ipset > /dev/null; then
+    echo "   - Eliminando sets de ipset..."
+    ipset destroy portal_allowed 2>/dev/null || true
+    ipset destroy portal_blocked_macs 2>/dev/null || true
+fi
+
+# Backend nftables: toda su politica esta en una tabla propia
+if command -v nft > /dev/null; then
+    echo "   - Eliminando tabla de nftables..."
+    nft delete table ip captive_portal 2>/dev/null || true
+fi
+
 echo "   - Restaurando políticas por defecto..."
 iptables -P INPUT ACCEPT 2>/dev/null || true
 iptables -P FORWARD ACCEPT 2>/dev/null || true
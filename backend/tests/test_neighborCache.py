@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neighborCache import NeighborCache, parse_proc_arp, UNKNOWN_MAC
+
+ARP_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'proc_net_arp')
+
+
+class ParseProcArpTest(unittest.TestCase):
+
+    def test_fixture(self):
+        with open(ARP_FIXTURE) as file:
+            table = parse_proc_arp(file.read())
+        self.assertEqual(table, {
+            '192.168.50.10': '3C:A0:67:BA:C2:99',
+            '192.168.50.11': 'A4:5E:60:01:02:03',
+            '192.168.50.13': 'F0:18:98:AA:BB:CC',
+            '10.0.2.2': '52:54:00:12:35:02',
+        })
+
+
+class NeighborCacheTest(unittest.TestCase):
+
+    def make_cache(self, **options):
+        # sin hilo de refresco: las recargas solo ocurren por misses
+        cache = NeighborCache(source=ARP_FIXTURE, refresh_interval=0, **options)
+        self.addCleanup(cache.stop)
+        return cache
+
+    def test_hit_and_miss_stats(self):
+        cache = self.make_cache(ttl=60, min_reload_interval=60)
+
+        # tabla vacia: el primer lookup es un miss que la carga
+        self.assertEqual(cache.lookup('192.168.50.10'), '3C:A0:67:BA:C2:99')
+        self.assertEqual(cache.lookup('192.168.50.11'), 'A4:5E:60:01:02:03')
+        # entrada incompleta: miss, pero la tabla es reciente y no se recarga
+        self.assertEqual(cache.lookup('192.168.50.12'), UNKNOWN_MAC)
+
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['reloads'], stats['coalesced']), (1, 2, 1, 1))
+        self.assertEqual(stats['entries'], 4)
+
+    def test_stale_table_is_reloaded(self):
+        cache = self.make_cache(ttl=0.05, min_reload_interval=0)
+        cache.lookup('10.0.2.2')
+        time.sleep(0.1)
+        self.assertEqual(cache.lookup('10.0.2.2'), '52:54:00:12:35:02')
+        self.assertEqual(cache.get_stats()['reloads'], 2)
+
+    def test_concurrent_misses_share_one_reload(self):
+        cache = self.make_cache(ttl=60, min_reload_interval=60)
+        results = []
+
+        # mientras un hilo recarga (lock tomado), los demas misses esperan
+        # y usan esa misma carga en lugar de leer el archivo otra vez
+        with cache._reload_lock:
+            threads = [threading.Thread(target=lambda: results.append(cache.lookup('192.168.50.10')))
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            cache.reload()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['3C:A0:67:BA:C2:99'] * 8)
+        stats = cache.get_stats()
+        self.assertEqual((stats['misses'], stats['reloads'], stats['coalesced']), (8, 1, 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trafficCounters import parse_forward_counters
+
+COUNTERS_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'iptables_forward_counters')
+
+
+class ParseForwardCountersTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(COUNTERS_FIXTURE) as file:
+            self.counters = parse_forward_counters(file.read())
+
+    def test_tagged_rules(self):
+        # (paquetes_subida, bytes_subida, paquetes_bajada, bytes_bajada)
+        self.assertEqual(self.counters['192.168.50.10'], (830, 65432, 1520, 912345))
+
+    def test_repeated_rules_are_summed(self):
+        self.assertEqual(self.counters['192.168.50.11'], (45, 3500, 110, 21000))
+
+    def test_numeric_protocol_column(self):
+        self.assertEqual(self.counters['192.168.50.12'], (300, 9000, 700, 70000))
+
+    def test_untagged_host_rule(self):
+        self.assertEqual(self.counters['192.168.50.13'], (12, 840, 0, 0))
+
+    def test_ignored_rules(self):
+        # DROP, MAC, redes con "/", DNS y el puerto del portal no son de un cliente
+        self.assertEqual(set(self.counters), {'192.168.50.10', '192.168.50.11', '192.168.50.12', '192.168.50.13'})
+
+    def test_empty_output(self):
+        self.assertEqual(parse_forward_counters(''), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import socket
+import selectors
 import threading
+import queue
+import time
 import sys
 '''
 Define el tipo de protocolo (TCP) de un servidor que maneja 
@@ -34,16 +37,135 @@ socket.close()       # 5. Cerrar conexión
 ```
 '''
 
+def _build_plain_response(status_line, text, extra_headers=b""):
+    '''Respuesta completa pre-construida con cierre de conexion'''
+    body = text.encode('utf-8')
+    return (
+        status_line +
+        b"Server: CaptivePortalHTTP/1.0\r\n"
+        b"Content-Type: text/plain; charset=utf-8\r\n"
+        b"Content-Length: " + str(len(body)).encode('ascii') + b"\r\n" +
+        extra_headers +
+        b"Connection: close\r\n"
+        b"\r\n" + body
+    )
+
+
+class ConnectionGuard:
+    '''
+        Protecciones por conexion compartidas por los motores de servidor:
+        limite de conexiones simultaneas por IP y contadores de conexiones
+        cerradas a la fuerza (reaped) por cada motivo
+    '''
+
+    REAP_REASONS = ('header_timeout', 'body_timeout', 'write_timeout', 'idle_timeout', 'ip_limit')
+
+    # Respuesta cuando una IP supera su limite de conexiones
+    IP_LIMIT_RESPONSE = _build_plain_response(
+        b"HTTP/1.1 429 Demasiadas Peticiones\r\n",
+        "Demasiadas conexiones simultaneas desde su dispositivo",
+        b"Retry-After: 2\r\n",
+    )
+
+    def __init__(self, max_connections_per_ip=16):
+        """
+            max_connections_per_ip: conexiones abiertas a la vez por cliente (0 = sin limite)
+        """
+        self.max_connections_per_ip = max_connections_per_ip
+        self._lock = threading.Lock()
+        self._per_ip = {}
+        self.reaped = dict.fromkeys(self.REAP_REASONS, 0)
+
+    def acquire(self, ip):
+        '''Registra una conexion nueva; False si la IP ya esta en su limite'''
+        with self._lock:
+            count = self._per_ip.get(ip, 0)
+            if self.max_connections_per_ip and count >= self.max_connections_per_ip:
+                self.reaped['ip_limit'] += 1
+                return False
+            self._per_ip[ip] = count + 1
+            return True
+
+    def release(self, ip):
+        with self._lock:
+            count = self._per_ip.get(ip, 0) - 1
+            if count > 0:
+                self._per_ip[ip] = count
+            else:
+                self._per_ip.pop(ip, None)
+
+    def record_reaped(self, reason):
+        with self._lock:
+            self.reaped[reason] = self.reaped.get(reason, 0) + 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'clients_connected': len(self._per_ip),
+                'reaped_connections': dict(self.reaped),
+            }
+
+
 class ThreadingTCPServer:
-    def __init__(self, serverAddress, RequestHandlerClass):
+    '''
+        Pool de hilos pre-arrancados con una cola acotada de conexiones.
+
+        accept() ──→ espera del primer byte ──→ cola (max queue_size) ──→ worker 1..N ──→ handler
+                        │                          │
+                        │                          └── cola llena: 503 pre-construido y cierre
+                        └── sin datos en header_timeout: cierre (no llega a ocupar un worker)
+
+        El hilo que acepta vigila con un selector las conexiones que todavia
+        no enviaron nada: un dispositivo que abre conexiones y no habla no
+        ocupa workers, solo descriptores (acotados por el limite por IP).
+    '''
+
+    # Respuesta de rechazo pre-construida: se envia sin tocar el handler
+    # ni los archivos del frontend cuando la cola esta llena
+    REJECT_RESPONSE = _build_plain_response(
+        b"HTTP/1.1 503 Servicio No Disponible\r\n",
+        "Servidor saturado, intente de nuevo en unos segundos",
+        b"Retry-After: 5\r\n",
+    )
+
+    def __init__(self, serverAddress, RequestHandlerClass, max_workers=32, queue_size=128, backlog=128, reuse_port=False,
+                 max_connections_per_ip=16):
         """
             serverAddress: direccion del servidor con formato (host, port)
             RequestHandlerClass: Clase del handler (debe heredar de BaseHTTPRequestHandler)
+            max_workers: numero de hilos pre-arrancados que atienden conexiones
+            queue_size: conexiones aceptadas que pueden esperar un worker libre
+            backlog: conexiones pendientes en el kernel (argumento de listen)
+            reuse_port: SO_REUSEPORT para que varios procesos escuchen el mismo puerto
+            max_connections_per_ip: conexiones simultaneas por cliente (0 = sin limite).
+                                    Las que esperan su primer byte no ocupan un
+                                    worker, asi que no hace falta atarlo a max_workers
         """
         self.serverAddress = serverAddress
         self.RequestHandlerClass = RequestHandlerClass
         self.socket = None
         self.running = False
+
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.request_queue = queue.Queue(maxsize=queue_size)
+        self.workers = []
+        self.guard = ConnectionGuard(max_connections_per_ip)
+
+        # Conexiones aceptadas que aun no enviaron su primer byte
+        # (solo las toca el hilo que acepta)
+        self.selector = None
+        self.first_byte_timeout = getattr(RequestHandlerClass, 'header_timeout', 10)
+        self._waiting = {}  # socket -> (direccion, instante limite)
+
+        # Contadores del pool (protegidos por _stats_lock)
+        self._stats_lock = threading.Lock()
+        self.accepted_connections = 0
+        self.rejected_connections = 0
+        self.busy_workers = 0
+        self.max_queue_depth = 0
     
     def __enter__(self):
         return self
@@ -57,13 +179,24 @@ class ThreadingTCPServer:
         '''
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.socket.bind(self.serverAddress)
     
     def server_activate(self):
         '''
             Escucha conexiones entrantes
         '''
-        self.socket.listen(5) # maximo de conexiones en cola esperando a ser aceptadas
+        self.socket.listen(self.backlog) # maximo de conexiones en cola esperando a ser aceptadas
+
+    def start_workers(self):
+        '''
+            Arranca los hilos del pool antes de aceptar conexiones
+        '''
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"http-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
 
     def serve_forever(self):
         '''
@@ -72,23 +205,30 @@ class ThreadingTCPServer:
 
         self.server_start()
         self.server_activate()
+        self.start_workers()
+
+        print(f"[ThreadingTCPServer] Servidor escuchando en {self.serverAddress[0]}:{self.serverAddress[1]} "
+              f"({self.max_workers} workers, cola {self.queue_size}, backlog {self.backlog})")
 
-        print(f"[ThreadingTCPServer] Servidor escuchando en {self.serverAddress[0]}:{self.serverAddress[1]}")
+        self.socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
 
         self.running=True
         try:
             while self.running:
                 try:
-                    # aceptar una nueva conexion
-                    clientSocket, clientAddress = self.socket.accept()
-
-                    # manejar la peticion con un hilo
-                    client_thread = threading.Thread(
-                            target=self.process_request_thread,
-                            args=(clientSocket, clientAddress)
-                        ) 
-                    client_thread.daemon = True
-                    client_thread.start()  # procesar datos (recibir/enviar)
+                    events = self.selector.select(self._select_timeout())
+                    for key, _ in events:
+                        if key.fileobj is self.socket:
+                            self.accept_connection()
+                        else:
+                            # primer byte recibido (o cierre): ahora si a un worker
+                            clientSocket = key.fileobj
+                            clientAddress, _ = self._waiting.pop(clientSocket)
+                            self.selector.unregister(clientSocket)
+                            self.submit_request(clientSocket, clientAddress)
+                    self.reap_waiting()
 
                 except KeyboardInterrupt:
                     print("\n[ThreadingTCPServer] Deteniendo servidor...")
@@ -98,7 +238,100 @@ class ThreadingTCPServer:
                         print(f"[ThreadingTCPServer] Error: {e}", file=sys.stderr)
 
         finally: 
+            for clientSocket, (clientAddress, _) in list(self._waiting.items()):
+                self.guard.release(clientAddress[0])
+                clientSocket.close()
+            self._waiting.clear()
+            self.selector.close()
             self.server_close()
+
+    def accept_connection(self):
+        '''
+            Acepta una conexion y la deja esperando su primer byte; si la IP
+            supera su limite de conexiones la rechaza
+        '''
+        try:
+            clientSocket, clientAddress = self.socket.accept()
+        except BlockingIOError:
+            return
+        if not self.guard.acquire(clientAddress[0]):
+            self.reject_request(clientSocket, ConnectionGuard.IP_LIMIT_RESPONSE)
+            return
+        self._waiting[clientSocket] = (clientAddress, time.monotonic() + self.first_byte_timeout)
+        self.selector.register(clientSocket, selectors.EVENT_READ)
+
+    def _select_timeout(self):
+        '''Hasta el proximo plazo de primer byte (como mucho 1 s, para ver running)'''
+        if not self._waiting:
+            return 1.0
+        deadline = min(deadline for _, deadline in self._waiting.values())
+        return min(1.0, max(0.0, deadline - time.monotonic()))
+
+    def reap_waiting(self):
+        '''Cierra las conexiones que no enviaron nada dentro de header_timeout'''
+        now = time.monotonic()
+        expired = [sock for sock, (_, deadline) in self._waiting.items() if deadline <= now]
+        for clientSocket in expired:
+            clientAddress, _ = self._waiting.pop(clientSocket)
+            self.selector.unregister(clientSocket)
+            self.guard.release(clientAddress[0])
+            self.guard.record_reaped('header_timeout')
+            try:
+                clientSocket.close()
+            except OSError:
+                pass
+
+    def submit_request(self, clientSocket, clientAddress):
+        '''
+            Encola para un worker una conexion ya registrada en el guard; si
+            la cola esta llena la rechaza
+        '''
+        try:
+            self.request_queue.put_nowait((clientSocket, clientAddress))
+        except queue.Full:
+            self.guard.release(clientAddress[0])
+            with self._stats_lock:
+                self.rejected_connections += 1
+            self.reject_request(clientSocket)
+            return False
+
+        with self._stats_lock:
+            self.accepted_connections += 1
+            depth = self.request_queue.qsize()
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+        return True
+
+    def reject_request(self, clientSocket, response=None):
+        '''
+            Envia el rechazo pre-construido (503 por defecto) sin bloquear el
+            hilo que acepta
+        '''
+        try:
+            clientSocket.setblocking(False)
+            clientSocket.send(response or self.REJECT_RESPONSE)
+        except OSError:
+            pass
+        finally:
+            try:
+                clientSocket.close()
+            except OSError:
+                pass
+
+    def _worker_loop(self):
+        while True:
+            item = self.request_queue.get()
+            if item is None: # señal de parada
+                break
+
+            clientSocket, clientAddress = item
+            with self._stats_lock:
+                self.busy_workers += 1
+            try:
+                self.process_request_thread(clientSocket, clientAddress)
+            finally:
+                with self._stats_lock:
+                    self.busy_workers -= 1
     
     def process_request_thread(self, clientSocket, clientAddress):
         
@@ -107,10 +340,39 @@ class ThreadingTCPServer:
         except Exception as e:
             print(f"[ThreadingTCPServer] Error procesando petición: {e}", file=sys.stderr)
         finally:
+            self.guard.release(clientAddress[0])
             try:
                 clientSocket.close()
             except:
                 pass
+
+    def should_keep_alive(self):
+        '''
+            Solo se mantienen conexiones persistentes si ninguna conexion
+            espera un worker libre
+        '''
+        return self.request_queue.empty()
+
+    def get_stats(self):
+        '''
+            Devuelve una foto de los contadores del pool y de las conexiones
+        '''
+        with self._stats_lock:
+            stats = {
+                'workers': self.max_workers,
+                'busy_workers': self.busy_workers,
+                'worker_utilization': self.busy_workers / self.max_workers if self.max_workers else 0.0,
+                'queue_depth': self.request_queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'queue_size': self.queue_size,
+                'accepted_connections': self.accepted_connections,
+                'rejected_connections': self.rejected_connections,
+            }
+        stats.update(self.guard.get_stats())
+        return stats
+
+    def record_reaped(self, reason):
+        self.guard.record_reaped(reason)
     
     def server_close(self):
         self.running = False
@@ -119,4 +381,11 @@ class ThreadingTCPServer:
                 self.socket.close()
             except:
                 pass
-        
+
+        # Despertar a los workers para que terminen
+        for _ in self.workers:
+            try:
+                self.request_queue.put_nowait(None)
+            except queue.Full:
+                break # los workers son daemon, terminan con el proceso
+        self.workers = []
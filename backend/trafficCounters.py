@@ -0,0 +1,65 @@
+import subprocess
+'''
+Lectura de los contadores de trafico por IP desde iptables.
+
+unlock_user.sh crea dos reglas ACCEPT por cliente en FORWARD:
+
+    -s <ip> -j ACCEPT    trafico que sale del cliente  (subida)
+    -d <ip> -j ACCEPT    trafico que llega al cliente  (bajada)
+
+Una sola llamada a `iptables -L FORWARD -v -x -n` devuelve los contadores
+de todas esas reglas; parse_forward_counters la convierte en un dict por IP
+en una pasada, sin expresiones regulares.
+'''
+
+COUNTERS_COMMAND = ('iptables', '-w', '-L', 'FORWARD', '-v', '-x', '-n')
+
+ANY_ADDRESS = '0.0.0.0/0'
+
+# Columna prot de una regla sin -p: 'all', o el numero 0 con -n en algunas
+# versiones de iptables (p. ej. 1.8.9)
+ANY_PROTOCOL = ('all', '0')
+
+
+def parse_forward_counters(text):
+    '''
+        Parsea la salida de `iptables -L FORWARD -v -x -n`.
+
+        Returns:
+            dict: {ip: (paquetes_subida, bytes_subida, paquetes_bajada, bytes_bajada)}
+                  sumando las reglas ACCEPT repetidas de una misma IP
+    '''
+    counters = {}
+    for line in text.splitlines():
+        # pkts bytes target prot opt in out source destination [extra]
+        fields = line.split(None, 9)
+        if len(fields) < 9 or fields[2] != 'ACCEPT' or fields[3] not in ANY_PROTOCOL:
+            continue
+        try:
+            packets = int(fields[0])
+            octets = int(fields[1])
+        except ValueError:
+            continue  # cabeceras de la tabla
+
+        source, destination = fields[7], fields[8]
+        if destination == ANY_ADDRESS and source != ANY_ADDRESS:
+            ip, upload = source, True
+        elif source == ANY_ADDRESS and destination != ANY_ADDRESS:
+            ip, upload = destination, False
+        else:
+            continue
+        if '/' in ip:
+            continue  # reglas de redes, no de un cliente
+
+        up_packets, up_bytes, down_packets, down_bytes = counters.get(ip, (0, 0, 0, 0))
+        if upload:
+            counters[ip] = (up_packets + packets, up_bytes + octets, down_packets, down_bytes)
+        else:
+            counters[ip] = (up_packets, up_bytes, down_packets + packets, down_bytes + octets)
+    return counters
+
+
+def read_forward_counters(command=COUNTERS_COMMAND):
+    '''Una lectura de los contadores de todos los clientes'''
+    result = subprocess.run(list(command), check=True, capture_output=True, text=True, timeout=10)
+    return parse_forward_counters(result.stdout)